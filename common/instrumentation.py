@@ -0,0 +1,287 @@
+"""
+Instrumentation shared by the FastAPI services: request metrics, named spans around the hot paths,
+a /metrics endpoint in the Prometheus text format and an optional per-request sampling profiler.
+
+Usage:
+    app = FastAPI()
+    instrument(app, "db_handler")
+
+    @timed("load_db")
+    def load_db(...): ...
+
+    with span("to_dict"):
+        ...
+
+The metrics are kept per process: with several workers, each scrape reports the worker which answered it.
+"""
+# Server related
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+
+# concurrency related
+from contextlib import contextmanager
+from functools import wraps
+from inspect import iscoroutinefunction
+from threading import Event, Lock, Thread, enumerate as threads
+import sys
+
+# IO related
+from os import environ
+from time import perf_counter
+from collections import Counter, OrderedDict
+from uuid import uuid4
+
+# typing related
+from typing import Callable, Dict, Iterator, Tuple
+
+# seconds, fine enough at the low end for the cached reads
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# the profiler is off unless switched on for the deployment, a header alone must not be able to slow a service down
+PROFILING = environ.get("PROFILING_ENABLED", "False") == "True"
+PROFILE_HEADER = "x-profile"
+PROFILE_INTERVAL = float(environ.get("PROFILING_INTERVAL_MS", 5)) / 1000
+PROFILES_KEPT = 16
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Histogram:
+    """
+    Cumulative histogram per label set, as Prometheus expects it
+    """
+
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series: Dict[Labels, list] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            # [count per bucket..., +Inf count, sum]
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            for bound, count in zip((*map(str, self.buckets), "+Inf"), series):
+                yield f"{self.name}_bucket{_labels((*key, ('le', bound)))} {count}"
+            yield f"{self.name}_sum{_labels(key)} {series[-1]}"
+            yield f"{self.name}_count{_labels(key)} {series[-2]}"
+
+
+class Metric:
+    """
+    Counter or gauge per label set
+    """
+
+    def __init__(self, name: str, description: str, kind: str = "counter"):
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self._series: Dict[Labels, float] = {}
+        self._lock = Lock()
+
+    def add(self, value: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = list(self._series.items())
+        for key, value in items:
+            yield f"{self.name}{_labels(key)} {value}"
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time until the last byte of the response was sent")
+IN_FLIGHT = Metric("http_requests_in_flight", "Requests being handled", kind="gauge")
+RESPONSE_BYTES = Metric("http_response_bytes_total", "Bytes of the response bodies")
+SPAN_SECONDS = Histogram("span_duration_seconds", "Time spent in a named section of the code")
+METRICS = [REQUEST_SECONDS, IN_FLIGHT, RESPONSE_BYTES, SPAN_SECONDS]
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Time a section of the code into span_duration_seconds{span=name}, errors included
+    :param name: The span, e.g. "load_db"
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        SPAN_SECONDS.observe(perf_counter() - start, span=name)
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """
+    Decorator version of span, for plain and async functions
+    :param name: The span
+    """
+    def decorator(function: Callable) -> Callable:
+        if iscoroutinefunction(function):
+            @wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    """
+    :return: all the metrics in the Prometheus text format
+    """
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all the threads of the process every interval, while active.
+    The result is in the folded format of flame graphs: "thread;outer;...;inner count" per line.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self) -> None:
+        own = self._thread.ident
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threads()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join([names.get(ident, str(ident)), *reversed(stack)])] += 1
+
+    def __enter__(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+_PROFILES: "OrderedDict[str, str]" = OrderedDict()
+_PROFILES_LOCK = Lock()
+# one profiled request at a time, two samplers would each see the other's request
+_PROFILER_LOCK = Lock()
+
+
+class InstrumentationMiddleware:
+    """
+    Plain ASGI middleware (streamed responses are measured until their last chunk):
+    per-route latency histogram, requests in flight and response bytes.
+    With PROFILING_ENABLED=True, a request with the header "X-Profile: 1" is profiled,
+    the response carries an "X-Profile-Id" to fetch the result from /metrics/profile/{id}.
+    """
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status, sent = 500, 0
+        profile_id, profiler = None, None
+        if (PROFILING and (PROFILE_HEADER.encode(), b"1") in scope.get("headers", [])
+                and _PROFILER_LOCK.acquire(blocking=False)):
+            profile_id, profiler = uuid4().hex, SamplingProfiler()
+
+        async def measured_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile_id is not None:
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"x-profile-id", profile_id.encode())]}
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        IN_FLIGHT.add(1, service=self.service)
+        start = perf_counter()
+        try:
+            if profiler is not None:
+                profiler.__enter__()
+            await self.app(scope, receive, measured_send)
+        finally:
+            if profiler is not None:
+                profiler.__exit__()
+                _PROFILER_LOCK.release()
+                with _PROFILES_LOCK:
+                    _PROFILES[profile_id] = profiler.folded()
+                    while len(_PROFILES) > PROFILES_KEPT:
+                        _PROFILES.popitem(last=False)
+
+            # the template ("/analyse/{job_id}"), not the raw path: one series per route, not per id
+            route = getattr(scope.get("route"), "path", "unmatched")
+            labels = {"service": self.service, "route": route, "method": scope["method"], "status": str(status)}
+            REQUEST_SECONDS.observe(perf_counter() - start, **labels)
+            RESPONSE_BYTES.add(sent, **labels)
+            IN_FLIGHT.add(-1, service=self.service)
+
+
+def instrument(app: FastAPI, service: str) -> None:
+    """
+    Add the middleware, GET /metrics and GET /metrics/profile/{profile_id} to an app
+    :param app: The FastAPI app
+    :param service: Value of the "service" label
+    :return: None
+    """
+    app.add_middleware(InstrumentationMiddleware, service=service)
+
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    def metrics() -> str:
+        return render()
+
+    @app.get("/metrics/profile/{profile_id}", response_class=PlainTextResponse, include_in_schema=False)
+    def profile(profile_id: str) -> str:
+        with _PROFILES_LOCK:
+            folded = _PROFILES.get(profile_id)
+        if folded is None:
+            raise HTTPException(status_code=404, detail=f"There is no profile {profile_id}")
+        return folded
@@ -0,0 +1,150 @@
+"""
+Cold start of the services: what a container restart (compose watch's sync+restart) or a new replica pays
+before it can serve. Each service is started in a fresh interpreter, as a container would, and timed:
+
+* import - seconds to import the module of the app (its dependencies included),
+* healthcheck - seconds from then to the first 200 of GET /healthcheck, the app's lifespan startup included.
+
+The minimum of `--repeat` runs is kept, the slower runs being noise (a busy machine, a cold disk cache).
+
+Usage:
+python -m common.startup db_handler.db_handler data_analyzer.routing daemon.daemon --output startup.json
+
+Comparing against an earlier run (exit code 1 if any service got slower than the tolerance):
+python -m common.startup db_handler.db_handler --output new.json --compare startup.json
+"""
+# stdlib only: imported before the timed imports, it must not import any of them itself
+import argparse
+import importlib
+import json
+import subprocess
+import sys
+from os import environ, path
+from time import perf_counter, sleep
+
+# typing related
+from typing import Dict, Iterable, List
+
+# seconds, compared between runs; the absolute floor keeps the jitter of a fast start from being reported
+TIMED = ("import_s", "healthcheck_s")
+FLOOR_S = 0.05
+# the services import as <service>.<module> from the directory which has common/ too
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+def budget(seconds: float) -> float:
+    """
+    :param seconds: a budget measured on a developer's machine
+    :return: scaled by STARTUP_BUDGET_SCALE (default 1), for slower machines such as CI runners
+    """
+    return seconds * float(environ.get("STARTUP_BUDGET_SCALE", 1))
+
+
+def _start(module: str, app: str, deadline: float) -> Dict[str, float]:
+    # runs in the measured interpreter
+    start = perf_counter()
+    service = importlib.import_module(module)
+    imported = perf_counter()
+
+    # the test client isn't part of a service's start
+    from fastapi.testclient import TestClient
+    client = TestClient(getattr(service, app))
+    started = perf_counter()
+    with client:
+        while client.get("/healthcheck").status_code != 200:
+            if perf_counter() - started > deadline:
+                raise TimeoutError(f"{module} isn't healthy after {deadline} s")
+            sleep(0.01)
+        healthy = perf_counter()
+
+    return {"import_s": round(imported - start, 4), "healthcheck_s": round(healthy - started, 4)}
+
+
+def measure(module: str, app: str = "app", repeat: int = 3, deadline: float = 60.0) -> Dict[str, float]:
+    """
+    :param module: of the app, e.g. "db_handler.db_handler"
+    :param app: the FastAPI object in the module
+    :param repeat: fresh interpreters started, the fastest of each timing is kept
+    :param deadline: seconds the healthcheck may fail for
+    :return: {"import_s": ..., "healthcheck_s": ...}
+    :raises RuntimeError: if the service failed to start, with its stderr
+    """
+    runs = []
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, "-m", "common.startup", module, "--app", app, "--worker", "--deadline", str(deadline)],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        if process.returncode != 0:
+            raise RuntimeError(f"{module} failed to start:\n{process.stderr}")
+        runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+    return {timing: min(run[timing] for run in runs) for timing in TIMED}
+
+
+def imported_by(module: str, packages: Iterable[str]) -> List[str]:
+    """
+    :param module: e.g. "data_analyzer.routing"
+    :param packages: e.g. ("matplotlib", "scipy"), those the service imports where they are used only
+    :return: the packages importing the module loads, in a fresh interpreter
+    """
+    packages = list(packages)
+    process = subprocess.run(
+        [sys.executable, "-c", f"import json, sys, {module}; "
+                               f"print(json.dumps([p for p in {packages!r} if p in sys.modules]))"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return json.loads(process.stdout)
+
+
+def compare(old: dict, new: dict, tolerance: float) -> List[str]:
+    """
+    :param old: An earlier output of the benchmark
+    :param new: The current output
+    :param tolerance: Allowed relative growth, e.g. 0.2 for +20%
+    :return: One line per regression, empty if there is none
+    """
+    regressions = []
+    for module, timings in new["results"].items():
+        baseline = old["results"].get(module)
+        if baseline is None:
+            continue
+        for timing in TIMED:
+            if timings[timing] > baseline[timing] * (1 + tolerance) and timings[timing] - baseline[timing] > FLOOR_S:
+                regressions.append(f"{module}: {timing} {baseline[timing]} -> {timings[timing]}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time the cold start of the services")
+    parser.add_argument("modules", nargs="+", help="modules of the apps, e.g. db_handler.db_handler")
+    parser.add_argument("--app", default="app", dest="app")
+    parser.add_argument("--repeat", "-n", type=int, default=3, dest="repeat")
+    parser.add_argument("--deadline", type=float, default=60.0, dest="deadline")
+    parser.add_argument("--output", "-o", default=None, dest="output", metavar="json-path")
+    parser.add_argument("--compare", "-c", default=None, dest="compare", metavar="json-path")
+    parser.add_argument("--tolerance", type=float, default=0.2, dest="tolerance")
+    parser.add_argument("--worker", action="store_true", dest="worker", help=argparse.SUPPRESS)
+    args = vars(parser.parse_args())
+
+    if args["worker"]:
+        print(json.dumps(_start(args["modules"][0], args["app"], args["deadline"])))
+        sys.exit(0)
+
+    report = {"meta": {"python": sys.version.split()[0]},
+              "results": {module: measure(module, args["app"], args["repeat"], args["deadline"])
+                          for module in args["modules"]}}
+    print(json.dumps(report, indent=2))
+    if args["output"] is not None:
+        with open(args["output"], mode="w") as f:
+            json.dump(report, f, indent=2)
+
+    if args["compare"] is not None:
+        with open(args["compare"], mode="r") as f:
+            regressions = compare(json.load(f), report, args["tolerance"])
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# tested objects
+from common.instrumentation import Histogram, Metric, SamplingProfiler, instrument, render, span, timed
+
+# testing related
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from time import sleep
+
+"""
+No server needed to test, only pytest
+
+To test run
+pytest common/tests/test_instrumentation.py -vv --tb=line
+"""
+
+
+class TestHistogram:
+    def test_cumulative_buckets(self):
+        histogram = Histogram("test_seconds", "test", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, route="/x")
+
+        lines = list(histogram.render())
+        assert 'test_seconds_bucket{route="/x",le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{route="/x",le="1.0"} 2' in lines
+        assert 'test_seconds_bucket{route="/x",le="+Inf"} 3' in lines
+        assert 'test_seconds_count{route="/x"} 3' in lines
+
+    def test_escaped_labels(self):
+        metric = Metric("test_total", "test")
+        metric.add(2, path='a"b')
+        assert 'test_total{path="a\\"b"} 2' in list(metric.render())
+
+
+class TestSpans:
+    def test_span_and_timed(self):
+        @timed("test.timed")
+        def work() -> int:
+            return 1
+
+        with span("test.span"):
+            assert work() == 1
+
+        text = render()
+        assert 'span_duration_seconds_count{span="test.span"}' in text
+        assert 'span_duration_seconds_count{span="test.timed"}' in text
+
+
+class TestMiddleware:
+    app = FastAPI()
+    instrument(app, "test")
+
+    @app.get("/items/{item}")
+    def item(item: int) -> dict:
+        return {"item": item}
+
+    @app.get("/stream")
+    def stream() -> StreamingResponse:
+        return StreamingResponse(iter([b"a" * 10, b"b" * 5]))
+
+    client = TestClient(app)
+
+    def test_route_template(self):
+        self.client.get("/items/1")
+        self.client.get("/items/2")
+        text = self.client.get("/metrics").text
+        assert ('http_request_duration_seconds_count'
+                '{method="GET",route="/items/{item}",service="test",status="200"} 2') in text
+
+    def test_streamed_bytes(self):
+        self.client.get("/stream")
+        text = self.client.get("/metrics").text
+        assert 'http_response_bytes_total{method="GET",route="/stream",service="test",status="200"} 15' in text
+
+    def test_profile_disabled_by_default(self):
+        response = self.client.get("/items/1", headers={"X-Profile": "1"})
+        assert "x-profile-id" not in response.headers
+
+
+class TestProfiler:
+    def test_samples_other_threads(self):
+        with SamplingProfiler(interval=0.001) as profiler:
+            sleep(0.05)
+        assert "test_samples_other_threads" in profiler.folded()
@@ -0,0 +1,36 @@
+# tested objects
+from common.startup import budget, compare
+
+"""
+No server needed to test, only pytest
+
+To test run
+pytest common/tests/test_startup.py -vv --tb=line
+"""
+
+
+def report(import_s: float, healthcheck_s: float = 0.01) -> dict:
+    return {"results": {"db_handler.db_handler": {"import_s": import_s, "healthcheck_s": healthcheck_s}}}
+
+
+def test_no_regression():
+    assert compare(report(1.0), report(1.1), tolerance=0.2) == []
+
+
+def test_slower():
+    assert compare(report(1.0), report(1.5), tolerance=0.2) == ["db_handler.db_handler: import_s 1.0 -> 1.5"]
+
+
+def test_jitter_ignored():
+    # +100%, but 20 ms
+    assert compare(report(1.0, 0.02), report(1.0, 0.04), tolerance=0.2) == []
+
+
+def test_new_service_ignored():
+    assert compare({"results": {}}, report(1.0), tolerance=0.2) == []
+
+
+def test_budget_scale(monkeypatch):
+    assert budget(1.5) == 1.5
+    monkeypatch.setenv("STARTUP_BUDGET_SCALE", "2")
+    assert budget(1.5) == 3.0
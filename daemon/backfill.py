@@ -0,0 +1,320 @@
+"""
+Backfill of historical weather into the db_handler: years of hourly records don't fit in memory, so they are
+
+* streamed in chunks of `chunk_rows` records (sorted by time, as exported by the weather APIs),
+* aggregated to the daemon's daily entries incrementally: only the sums and counts of the day still being read
+  are carried from one chunk to the next,
+* committed through /commit/batch by `batch_days` days,
+* checkpointed after every batch: the number of records of the committed days, so that an interrupted backfill
+  skips them when run again and resumes with the next day.
+
+A batch is written to the checkpoint (fsync'ed) before it is posted, and settled once the db_handler took it.
+A run killed in between finds it pending when resumed: the db_handler is asked whether the batch landed
+(a batch is committed all or nothing), so that it is settled without being sent twice, or sent again.
+
+A daily entry has the means of the weather columns (a circular mean of the wind direction), the season
+and, if a file of them is given, the sunrise and sunset. Its datetime is the day at 00:00:00 (UTC).
+"""
+# Networking related
+import httpx
+
+# parsing related
+import numpy as np
+from pandas import DataFrame, DatetimeIndex, concat, read_csv, to_datetime
+from datetime import datetime, timedelta
+
+# concurrency related
+import asyncio
+
+# IO related
+from itertools import islice
+from os import environ, fsync, path, remove, replace
+import argparse
+import json
+
+# typing related
+from typing import Iterator, List
+
+WEATHER = (
+    "temperature", "cloud_cover", "humidity", "atm_pressure", "wind_speed", "wind_direction", "feels_like",
+    "rain_intensity", "sleet_intensity", "snow_intensity"
+)
+# names of the hourly values of tomorrow.io -> columns of the entries (these are accepted as they are too)
+HOURLY_COLUMNS = {
+    "temperature": "temperature", "cloudCover": "cloud_cover", "humidity": "humidity",
+    "pressureSurfaceLevel": "atm_pressure", "windSpeed": "wind_speed", "windDirection": "wind_direction",
+    "temperatureApparent": "feels_like", "rainIntensity": "rain_intensity", "sleetIntensity": "sleet_intensity",
+    "snowIntensity": "snow_intensity",
+}
+# month - 1 -> season, as daemon.get_season
+SEASONS = np.array(("winter", "winter", "spring", "spring", "spring", "summer",
+                    "summer", "summer", "autumn", "autumn", "autumn", "winter"))
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _utc(index: DatetimeIndex) -> DatetimeIndex:
+    return index.tz_convert(None) if index.tz is not None else index
+
+
+class DailyAggregator:
+    """
+    Running sums and counts per day of the hourly records. The records come sorted by time, so a day is complete
+    once a record of a later day is read: every chunk gives the days it completed and carries the last one.
+    """
+
+    def __init__(self):
+        self._partial: DataFrame | None = None
+
+    @staticmethod
+    def _sums(chunk: DataFrame) -> DataFrame:
+        values = chunk.rename(columns=HOURLY_COLUMNS)
+        values = values[[column for column in WEATHER if column in values.columns]].astype(float)
+        if "wind_direction" in values.columns:
+            # averaged as unit vectors: the mean of 350° and 10° is 0°, not 180°
+            radians = np.deg2rad(values.pop("wind_direction"))
+            values = values.assign(wind_sin=np.sin(radians), wind_cos=np.cos(radians))
+
+        grouped = values.groupby(_utc(chunk.index).normalize())
+        sums = concat({"sum": grouped.sum(), "count": grouped.count()}, axis="columns")
+        sums[("records", "")] = grouped.size()
+        return sums
+
+    def add(self, chunk: DataFrame) -> DataFrame:
+        """
+        :param chunk: hourly records with a DatetimeIndex, later than those of the previous chunks
+        :return: sums and counts of the days completed by the chunk, see means()
+        :raises ValueError: if the chunk has records of a day before the one being read
+        """
+        if chunk.empty:
+            return DataFrame()
+
+        sums = self._sums(chunk)
+        if self._partial is not None:
+            if sums.index[0] < self._partial.index[0]:
+                raise ValueError(f"The records are not sorted by time: {sums.index[0]:%Y-%m-%d} "
+                                 f"comes after {self._partial.index[0]:%Y-%m-%d}")
+            sums = sums.add(self._partial, fill_value=0) if sums.index[0] == self._partial.index[0] \
+                else concat([self._partial, sums])
+
+        self._partial = sums.iloc[-1:]
+        return sums.iloc[:-1]
+
+    def flush(self) -> DataFrame:
+        """
+        :return: sums and counts of the last day, the records are over
+        """
+        partial, self._partial = self._partial, None
+        return partial if partial is not None else DataFrame()
+
+    @staticmethod
+    def means(sums: DataFrame) -> DataFrame:
+        """
+        :param sums: as returned by add() or flush()
+        :return: the daily means, by day, in the columns of the entries
+        """
+        if sums.empty:
+            return DataFrame()
+        means = sums["sum"] / sums["count"].where(sums["count"] > 0)
+        if "wind_sin" in means.columns:
+            means["wind_direction"] = np.rad2deg(np.arctan2(means.pop("wind_sin"), means.pop("wind_cos"))) % 360
+        return means[[column for column in WEATHER if column in means.columns]]
+
+
+def read_sun_times(source: str, time_column: str = "date") -> DataFrame:
+    """
+    The sunrise and sunset of every day (one row a day: small enough to be read whole)
+    :param source: csv with a time column and "sunrise" / "sunset" as unix timestamps or datetimes (UTC)
+    :param time_column: the column of the days
+    :return: "sunrise" and "sunset" as strings of DATETIME_FORMAT, by day
+    """
+    days = read_csv(source, index_col=time_column, parse_dates=True, usecols=[time_column, "sunrise", "sunset"])
+    days.index = _utc(DatetimeIndex(days.index)).normalize()
+    for column in ("sunrise", "sunset"):
+        values = days[column]
+        times = to_datetime(values, unit="s", utc=True) if np.issubdtype(values.dtype, np.number) \
+            else to_datetime(values, utc=True)
+        days[column] = times.dt.tz_convert(None).dt.strftime(DATETIME_FORMAT)
+    return days[~days.index.duplicated(keep="last")]
+
+
+def entries(means: DataFrame, sun_times: DataFrame | None = None) -> List[dict]:
+    """
+    :param means: as per DailyAggregator.means
+    :param sun_times: as per read_sun_times, None to leave them out
+    :return: the rows of /commit/batch, the days without any value are left out
+    """
+    rows = []
+    seasons = SEASONS[means.index.month - 1] if len(means) else []
+    for (day, values), season in zip(means.iterrows(), seasons):
+        data = {column: round(float(value), 3) for column, value in values.items() if value == value}
+        if not data:
+            continue
+        if sun_times is not None and day in sun_times.index:
+            data.update(sun_times.loc[day].dropna().to_dict())
+        rows.append({"datetime": day.strftime(DATETIME_FORMAT), "data": {**data, "season": str(season)}})
+    return rows
+
+
+class Checkpoint:
+    """
+    Progress of a backfill, in a JSON file replaced atomically after every committed batch
+    """
+
+    def __init__(self, file: str, source: str, user: str):
+        self.file = file
+        self.source = source
+        self.user = user
+        # hourly records of the committed days, skipped on resume
+        self.records = 0
+        self.committed = 0
+        self.last_day: str | None = None
+        # the batch posted last, until the db_handler acknowledged it: {"first", "records", "rows", "last_day"}
+        self.pending: dict | None = None
+
+        if path.exists(file):
+            with open(file, mode="r") as f:
+                saved = json.load(f)
+            if (saved["source"], saved["user"]) != (source, user):
+                raise ValueError(f"The checkpoint {file} is the one of {saved['source']} for {saved['user']}")
+            self.records, self.committed, self.last_day = saved["records"], saved["committed"], saved["last_day"]
+            self.pending = saved.get("pending")
+
+    def save(self) -> None:
+        # on disk before anything else happens: a batch is only posted once it is recorded as pending
+        with open(self.file + ".tmp", mode="w") as f:
+            json.dump({"source": self.source, "user": self.user, "records": self.records,
+                       "committed": self.committed, "last_day": self.last_day, "pending": self.pending}, f)
+            f.flush()
+            fsync(f.fileno())
+        replace(self.file + ".tmp", self.file)
+
+    def settle(self, landed: bool) -> None:
+        """
+        Account the pending batch
+        :param landed: whether the db_handler committed it, otherwise its records are read and sent again
+        :return: None
+        """
+        if landed and self.pending is not None:
+            self.records += self.pending["records"]
+            self.committed += self.pending["rows"]
+            self.last_day = self.pending["last_day"]
+        self.pending = None
+
+    def done(self) -> None:
+        # a finished backfill starts over if run again
+        if path.exists(self.file):
+            remove(self.file)
+
+
+def read_chunks(source: str, chunk_rows: int, skip: int = 0, time_column: str = "date") -> Iterator[DataFrame]:
+    """
+    :param source: csv of hourly records, sorted by time
+    :param chunk_rows: records per chunk
+    :param skip: records skipped at the start, without parsing them
+    :param time_column: the column of the times
+    :return: iterator over the chunks, indexed by time
+    """
+    with open(source, mode="r") as f:
+        names = next(f).rstrip("\n").split(",")
+        # consumed line by line, the skipped records are never held in memory
+        for _ in islice(f, skip):
+            pass
+        yield from read_csv(f, names=names, index_col=time_column, parse_dates=True, chunksize=chunk_rows)
+
+
+async def landed(client: httpx.AsyncClient, user: str, first: str) -> bool:
+    """
+    :param client: to the db_handler
+    :param user: whose batch it is
+    :param first: datetime of the first row of the batch
+    :return: whether the batch is in the database, its rows being committed all or nothing
+    :raises httpx.HTTPStatusError: if the db_handler can't tell
+    """
+    until = (datetime.strptime(first, DATETIME_FORMAT) + timedelta(seconds=1)).strftime(DATETIME_FORMAT)
+    response = await client.post("/get", json={"user": user, "since": first, "until": until, "limit": 1})
+    if response.status_code in (204, 404):
+        # no data at all for the user
+        return False
+    response.raise_for_status()
+    return bool(response.json()["index"])
+
+
+async def backfill(source: str, user: str, client: httpx.AsyncClient, checkpoint: str | None = None,
+                   sun_times: str | None = None, chunk_rows: int = 50_000, batch_days: int = 365,
+                   time_column: str = "date") -> dict:
+    """
+    Aggregate the hourly records of a csv to daily entries of the user and commit them, resuming after
+    the days a previous run committed
+    :param source: csv of hourly records, sorted by time
+    :param user: whose entries they are
+    :param client: to the db_handler
+    :param checkpoint: the JSON file of the progress, next to the source by default
+    :param sun_times: csv of the sunrise and sunset of every day, see read_sun_times
+    :param chunk_rows: hourly records in memory at most (plus those of one day)
+    :param batch_days: entries per /commit/batch
+    :param time_column: the column of the times, in both csv
+    :return: the numbers of committed entries and skipped records
+    :raises httpx.HTTPStatusError: if a commit failed, the checkpoint has the progress until then
+    :raises ValueError: if the records aren't sorted by time, or the checkpoint is the one of another backfill
+    """
+    progress = Checkpoint(checkpoint or f"{source}.checkpoint.json", source, user)
+    if progress.pending is not None:
+        # the previous run stopped between posting a batch and recording that it was taken
+        progress.settle(await landed(client, user, progress.pending["first"]))
+        await asyncio.to_thread(progress.save)
+    days = await asyncio.to_thread(read_sun_times, sun_times, time_column) if sun_times else None
+    aggregator = DailyAggregator()
+    skipped = progress.records
+    pending: List[DataFrame] = []
+
+    async def commit(sums: DataFrame) -> None:
+        rows = entries(DailyAggregator.means(sums), days)
+        progress.pending = {"first": rows[0]["datetime"] if rows else None, "records": int(sums[("records", "")].sum()),
+                            "rows": len(rows), "last_day": f"{sums.index[-1]:%Y-%m-%d}"}
+        if rows:
+            await asyncio.to_thread(progress.save)
+            response = await client.post("/commit/batch", json={"user": user, "rows": rows})
+            response.raise_for_status()
+        progress.settle(landed=True)
+        await asyncio.to_thread(progress.save)
+
+    chunks = read_chunks(source, chunk_rows, progress.records, time_column)
+    while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+        completed = aggregator.add(chunk)
+        if not completed.empty:
+            pending.append(completed)
+        # the completed days wait for a full batch
+        while sum(map(len, pending)) >= batch_days:
+            completed = concat(pending)
+            pending = [completed.iloc[batch_days:]]
+            await commit(completed.iloc[:batch_days])
+
+    remaining = [sums for sums in (*pending, aggregator.flush()) if not sums.empty]
+    if remaining:
+        await commit(concat(remaining))
+
+    committed = progress.committed
+    await asyncio.to_thread(progress.done)
+    return {"committed": committed, "skipped_records": skipped}
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Backfill the daily weather entries of a user out of hourly records")
+    parser.add_argument("source", help="csv of hourly records, sorted by time")
+    parser.add_argument("--user", "-u", required=True)
+    parser.add_argument("--sun-times", "-s", dest="sun_times", help="csv of the sunrise and sunset of every day")
+    parser.add_argument("--checkpoint", "-c", help="progress file, <source>.checkpoint.json by default")
+    parser.add_argument("--chunk-rows", type=int, default=int(environ.get("BACKFILL_CHUNK_ROWS", 50_000)),
+                        dest="chunk_rows")
+    parser.add_argument("--batch-days", type=int, default=int(environ.get("BACKFILL_BATCH_DAYS", 365)),
+                        dest="batch_days")
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(base_url=environ.get("DB_HANDLER_URL", "http://db_handler:8000"),
+                                 timeout=60) as client:
+        print(await backfill(args.source, args.user, client, args.checkpoint, args.sun_times,
+                             args.chunk_rows, args.batch_days))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,167 @@
+"""
+Cache of the weather API's responses, shared by the users: the key is (location rounded to a grid, day, timestep),
+so the users of the same city on the same day share one paid call.
+
+* an in-memory LRU in front of a directory of JSON files, both expiring after `ttl` seconds,
+  the files outlive the process,
+* concurrent identical requests wait for the one call in flight instead of calling the API again,
+* failures are not cached, every waiter of a failed call gets its error.
+"""
+# concurrency related
+import asyncio
+
+# IO related
+from collections import OrderedDict
+from datetime import datetime, timezone
+from hashlib import sha1
+from os import environ, makedirs, path, remove, replace, scandir
+from time import time
+import json
+
+# typing related
+from typing import Any, Awaitable, Callable, Dict, Sequence, Tuple
+
+
+class WeatherCache:
+    """
+    Used from the event loop only, hence no lock. The files are read and written in worker threads.
+    """
+
+    def __init__(self, directory: str = "media/weather", grid: float = 0.1, maxsize: int = 256,
+                 ttl: float = 6 * 3600, clock: Callable[[], float] = time):
+        """
+        :param directory: where the responses are stored, created by the first one if missing
+        :param grid: degrees, the coordinates are rounded to multiples of it (0.1 is about 11 km)
+        :param maxsize: responses kept in memory, the least recently used are dropped first
+        :param ttl: seconds a response is served for
+        :param clock: replaces time.time (the files outlive the process, hence the wall clock), for tests
+        """
+        self.directory = directory
+        self.grid = grid
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        # key -> (stored at, response)
+        self._memory: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        # key -> the call in flight
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "WeatherCache":
+        return cls(
+            directory=environ.get("WEATHER_CACHE_DIR", "media/weather"),
+            grid=float(environ.get("WEATHER_CACHE_GRID", 0.1)),
+            maxsize=int(environ.get("WEATHER_CACHE_SIZE", 256)),
+            ttl=float(environ.get("WEATHER_CACHE_TTL", 6 * 3600)),
+        )
+
+    def snap(self, location: Sequence[float] | str) -> str:
+        """
+        :param location: (latitude, longitude) or a place the API knows
+        :return: the location as sent to the API: the nearest grid point, or the place's name normalized
+        """
+        if isinstance(location, str):
+            return location.strip().lower()
+        return ",".join(str(round(round(coordinate / self.grid) * self.grid, 6)) for coordinate in location)
+
+    def key(self, location: str, timestep: str) -> str:
+        """
+        :param location: as per snap
+        :return: the key of the response of today (UTC)
+        """
+        day = datetime.fromtimestamp(self._clock(), timezone.utc).date()
+        return f"{location}|{day}|{timestep}"
+
+    def _file(self, key: str) -> str:
+        return path.join(self.directory, f"{sha1(key.encode()).hexdigest()}.json")
+
+    def _read(self, key: str) -> Tuple[float, dict] | None:
+        file = self._file(key)
+        try:
+            with open(file, mode="r") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if stored.get("key") != key or self._clock() - stored["stored"] >= self.ttl:
+            return None
+        return stored["stored"], stored["response"]
+
+    def _write(self, key: str, stored: float, response: dict) -> None:
+        makedirs(self.directory, exist_ok=True)
+        file = self._file(key)
+        with open(file + ".tmp", mode="w") as f:
+            json.dump({"key": key, "stored": stored, "response": response}, f)
+        replace(file + ".tmp", file)
+
+    def _remember(self, key: str, stored: float, response: dict) -> None:
+        self._memory[key] = (stored, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    async def _load(self, key: str, location: str, fetch: Callable[[str], Awaitable[dict]]) -> dict:
+        on_disk = await asyncio.to_thread(self._read, key)
+        if on_disk is not None:
+            self.disk_hits += 1
+            self._remember(key, *on_disk)
+            return on_disk[1]
+
+        self.misses += 1
+        response = await fetch(location)
+        stored = self._clock()
+        await asyncio.to_thread(self._write, key, stored, response)
+        self._remember(key, stored, response)
+        return response
+
+    async def get(self, location: Sequence[float] | str, timestep: str,
+                  fetch: Callable[[str], Awaitable[dict]]) -> dict:
+        """
+        The response for the location, from the memory, the disk or a single call in flight, else from fetch
+        :param location: (latitude, longitude) or a place the API knows
+        :param timestep: part of the key, e.g. "1d"
+        :param fetch: calls the API for the snapped location
+        :return: the response, shared with the other callers: don't modify it
+        :raises Exception: whatever fetch raised, to every caller waiting for that call
+        """
+        location = self.snap(location)
+        key = self.key(location, timestep)
+
+        cached = self._memory.get(key)
+        if cached is not None:
+            if self._clock() - cached[0] < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            del self._memory[key]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, location, fetch))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # a cancelled caller doesn't cancel the call the others wait for
+        return await asyncio.shield(task)
+
+    def purge(self) -> int:
+        """
+        Delete the expired files
+        :return: how many were deleted
+        """
+        if not path.isdir(self.directory):
+            return 0
+        deleted = 0
+        for entry in scandir(self.directory):
+            if entry.is_file() and self._clock() - entry.stat().st_mtime >= self.ttl:
+                remove(entry.path)
+                deleted += 1
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._memory), "hits": self.hits, "disk_hits": self.disk_hits,
+                "coalesced": self.coalesced, "misses": self.misses, "in_flight": len(self._in_flight)}
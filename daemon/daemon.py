@@ -1,17 +1,20 @@
 # Networking related
-from fastapi import FastAPI
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 import json
 import httpx
+from daemon.weather import WeatherClient, daily_values
 
 # typing related
+from pydantic import BaseModel, ConfigDict, Field
 from pydantic import validate_call as enforce_types
+from typing import Any, Dict, Tuple
 
 # miscellaneous
 from datetime import datetime, date
-from time import sleep
-
-# process related
-import warnings
+from os import environ, path
 
 
 @enforce_types
@@ -60,109 +63,176 @@ def load_json(path: str) -> dict:
     return dict_
 
 
-def request_json(url: str, metaname: str, tp: str = "GET", attempts: int = 3, wait: float | int = 5, **kwargs) -> dict:
+def internal_client(base_url: str) -> httpx.AsyncClient:
     """
-    Sends an url request with expectation of a json return value.
-    :param url: the (fully loaded) url to send request to
-    :param metaname: the name of the api service to display in warning messages
-    :param tp: type of the request to send: GET, POST, UPDATE...
-    :param attempts: Number of attempts to make before giving up. Must be >= 1
-    :param wait: Number of seconds to wait before making the next request. Must be >= 1
-    :param kwargs: keyword arguments to pass to requests
-    :return: json as python dictionary
+    :param base_url: of a service of the compose network, e.g. "http://db_handler:8000"
+    :return: the client, without a CA bundle (tens of ms to load at startup) unless the URL is https
     """
-    if not isinstance(url, str): raise TypeError(f"URL, must be a string, {type(url)} passed.")
-    if not isinstance(metaname, str): raise TypeError(f"Metaname, must be a string, {type(metaname)} passed.")
-    if not isinstance(tp, str): raise TypeError(f"Request type, must be a string, {type(tp)} passed.")
-    if not hasattr(requests, tp.lower()): raise ValueError(f"Request type {tp} is invalid.")
-    if not isinstance(attempts, int): raise TypeError(f"Number of attempts must be an int, {type(attempts)} passed.")
-    if attempts < 1: raise ValueError(f"The number of call attempts must be >= 1, {attempts} passed.")
-    if not isinstance(wait, (int, float)): raise TypeError(f"The wait time must be a number, {type(wait)} passed.")
-    if wait < 1: raise ValueError("The wait time must be >= 1 (seconds).")
-
-    for i in range(attempts):
-        response = getattr(requests, tp.lower())(url, **kwargs)
-        if response.ok: break
-
-        warning = "Error calling the {what} API ({code}){again}.".format(
-            code=response.status_code,
-            what=metaname,
-            again=" trying again.." if i < attempts - 1 else ""
-        )
-        warnings.warn(warning, category=RuntimeWarning)
-        sleep(wait)
+    return httpx.AsyncClient(base_url=base_url, timeout=httpx.Timeout(30, connect=2),
+                             verify=base_url.startswith("https://"))
+
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# daily values of tomorrow.io -> columns of the entries
+WEATHER_COLUMNS = {
+    "temperatureAvg": "temperature", "cloudCoverAvg": "cloud_cover", "humidityAvg": "humidity",
+    "pressureSurfaceLevelAvg": "atm_pressure", "windSpeedAvg": "wind_speed", "windDirectionAvg": "wind_direction",
+    "temperatureApparentAvg": "feels_like", "rainIntensityAvg": "rain_intensity",
+    "sleetIntensityAvg": "sleet_intensity", "snowIntensityAvg": "snow_intensity",
+}
+
+SECRETS_PATH = environ.get("DAEMON_SECRETS", "secrets.json")
+SECRETS = load_json(SECRETS_PATH) if path.exists(SECRETS_PATH) else {}
+
+# warm for the process's lifetime: the connection pools and the weather cache
+# (the weather API's pool is opened by the first rating, see WeatherClient)
+WEATHER = WeatherClient.from_env(environ.get("WEATHER_API_KEY", SECRETS.get("apikey", "")))
+DB_HANDLER = internal_client(environ.get("DB_HANDLER_URL", "http://db_handler:8000"))
+DATA_ANALYZER = internal_client(environ.get("DATA_ANALYZER_URL", "http://data-analyser:8000"))
+
+# ratings accepted, committed, failed to commit and committed without weather, along with the last error
+COUNTERS: Dict[str, Any] = {"accepted": 0, "committed": 0, "failed": 0, "without_weather": 0, "last_error": None}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await WEATHER.aclose()
+    await DB_HANDLER.aclose()
+    await DATA_ANALYZER.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
-    try:
-        dict_ = response.json()
-        return dict_
-    except requests.exceptions.JSONDecodeError:
-        warnings.warn("{what} API's response does not contain a valid json.".format(what=metaname))
-        return dict()
-
-
-if __name__ != "__main__":
-    quit()
-
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "--day-rank", "-d",
-    type=int,
-    default=0,
-    choices=list(range(1, 11)),
-    dest="day_rank",
-    metavar="ranking"
-)
-parser.add_argument(
-    "--analyze", "-a",
-    action="store_true",
-    dest="analyze"
-)
-args = vars(parser.parse_args())
-
-day_rank = args["day_rank"]
-analyze = args["analyze"]
-
-secrets = load_json("secrets.json")
-loaded_url = (
-    "https://api.tomorrow.io/v4/weather/history/recent?timesteps={timestep}&location={location}&units=metric&apikey={apikey}"
-    .format(timestep="1d", location=",".join(map(str, secrets["location"])), apikey=secrets["apikey"])
-)
-
-if day_rank:
-    res = request_json(
-        url=loaded_url,
-        tp="GET",
-        metaname="weather"
-    )
-
-    if res.items():
-        weather_data = res["timelines"]["daily"][1]["values"]
-    else:
-        weather_data = dict()
 
-    datetime_now: datetime = datetime.now()
+def build_entry(day_rank: int, when: datetime, weather: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    :param day_rank: the rating
+    :param when: of the rating
+    :param weather: the day's values of tomorrow.io, {} if they couldn't be fetched
+    :return: the data of the /commit of the rating, without the values which are missing
+    """
     entry = {
         # magnetic_activity
-        "datetime": datetime_now.strftime("%Y-%m-%d %H:%M:%S"),
         "day_rank": day_rank,
-        "sunrise": weather_data["sunriseTime"].replace("T", " ").replace("Z", ""),
-        "sunset": weather_data["sunsetTime"].replace("T", " ").replace("Z", ""),
-        "season": get_season(datetime_now),
-        "temperature": weather_data.get("temperatureAvg"),
-        "cloud_cover": weather_data.get("cloudCoverAvg"),
-        "humidity": weather_data.get("humidityAvg"),
-        "atm_pressure": weather_data.get("pressureSurfaceLevelAvg"),
-        "wind_speed": weather_data.get("windSpeedAvg"),
-        "wind_direction": weather_data.get("windDirectionAvg"),
-        "feels_like": weather_data.get("temperatureApparentAvg"),
-        "rain_intensity": weather_data.get("rainIntensityAvg"),
-        "sleet_intensity": weather_data.get("sleetIntensityAvg"),
-        "snow_intensity": weather_data.get("snowIntensityAvg")
+        "season": get_season(when),
+        **{column: weather.get(name) for name, column in WEATHER_COLUMNS.items()},
     }
-    # call db_handler with the entry json
+    for column in ("sunrise", "sunset"):
+        time = weather.get(f"{column}Time")
+        if time is not None:
+            entry[column] = time.replace("T", " ").replace("Z", "")
+    return {column: value for column, value in entry.items() if value is not None}
 
-if analyze:
-    # call analyzer
-    print("Calling the analyzer script...")
-    analyzer_subprocess = subprocess.run(['python', 'data-analyzer.py'], capture_output=True)
-    print(f"{analyzer_subprocess.returncode=}\n{analyzer_subprocess.stderr}\n{analyzer_subprocess.stdout}")
+
+async def record(user: str, day_rank: int, when: datetime, location: Tuple[float, float] | str) -> None:
+    """
+    Background task of a rating: fetch the weather and commit the entry
+    """
+    try:
+        weather = daily_values(await WEATHER.recent(location), 1)
+    except HTTPException as err:
+        # the rating matters more than its weather
+        COUNTERS["without_weather"] += 1
+        COUNTERS["last_error"] = f"weather: {err.status_code} - {err.detail}"
+        weather = {}
+
+    payload = {"user": user, "datetime": when.strftime(DATETIME_FORMAT), "data": build_entry(day_rank, when, weather)}
+    try:
+        response = await DB_HANDLER.post("/commit", json=payload)
+    except httpx.HTTPError as err:
+        COUNTERS["failed"] += 1
+        COUNTERS["last_error"] = f"db_handler: {type(err).__name__} - {err}"
+        return
+
+    if response.status_code != 201:
+        COUNTERS["failed"] += 1
+        COUNTERS["last_error"] = f"db_handler: {response.status_code} - {response.text}"
+        return
+    COUNTERS["committed"] += 1
+
+
+async def forward(method: str, url: str, **kwargs: Any) -> dict:
+    """
+    A request to the data_analyzer
+    :return: its JSON
+    :raises HTTPException: its error, 502 if it can't be reached
+    """
+    try:
+        response = await DATA_ANALYZER.request(method, url, **kwargs)
+    except httpx.HTTPError as err:
+        raise HTTPException(status_code=502, detail=f"Connecting to the data analyzer failed: {type(err).__name__}")
+    if response.is_error:
+        raise HTTPException(status_code=response.status_code, detail=response.text)
+    return response.json()
+
+
+# Override the default handler for pydantic ValidationError's
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError) -> JSONResponse:
+    err_dict = exc.errors()[0]
+    where = err_dict["loc"]
+    detail = {"msg": err_dict["msg"], "got": err_dict["input"]}
+    return JSONResponse(content={"loc": where, "detail": detail}, status_code=400)
+
+
+class RatingPayload(BaseModel):
+    user: str
+    day_rank: int = Field(ge=1, le=10)
+    # (latitude, longitude) or a place, the one of secrets.json if not given
+    location: Tuple[float, float] | str | None = None
+
+    model_config = ConfigDict(extra='forbid')
+
+
+@app.post("/rating", status_code=202)
+async def rate(payload: RatingPayload, background: BackgroundTasks) -> dict:
+    """
+    Record a rating. Answered at once: the weather is fetched and the entry committed in the background
+    :param payload: JSON as per the docs.md
+    :return: 202 and the datetime of the entry
+    :raises 400: if the payload is bad or there is no location
+    """
+    location = payload.location if payload.location is not None else SECRETS.get("location")
+    if location is None:
+        raise HTTPException(status_code=400, detail="No location given, and none in the secrets")
+
+    when = datetime.now()
+    COUNTERS["accepted"] += 1
+    background.add_task(record, payload.user, payload.day_rank, when, location)
+    return {"status": "accepted", "datetime": when.strftime(DATETIME_FORMAT)}
+
+
+class AnalysisPayload(BaseModel):
+    user: str
+    kind: str = "summary"
+    priority: int = Field(10, ge=0, le=100)
+
+    model_config = ConfigDict(extra='forbid')
+
+
+@app.post("/analyse", status_code=202)
+async def analyse(payload: AnalysisPayload) -> dict:
+    """
+    Queue an analysis on the data analyzer, see its POST /analyse
+    :return: 202 and the job
+    :raises HTTPException: the one of the data analyzer, 502 if it can't be reached
+    """
+    return await forward("POST", "/analyse", json=payload.model_dump())
+
+
+@app.get("/analyse/{job_id}", status_code=200)
+async def analysis_job(job_id: str) -> dict:
+    """
+    :return: the job, with its result once done
+    :raises HTTPException: the one of the data analyzer, 502 if it can't be reached
+    """
+    return await forward("GET", f"/analyse/{job_id}")
+
+
+@app.get("/healthcheck", status_code=200)
+async def health_check() -> dict:
+    """
+    :return: the counters of the ratings, the last error and the state of the weather client
+    """
+    return {**COUNTERS, "weather": WEATHER.stats()}
@@ -0,0 +1,191 @@
+# bridge to the fastapi
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+import httpx
+
+# tested objects
+from daemon.backfill import DailyAggregator, backfill, entries, read_sun_times
+
+# testing related
+import pytest
+import asyncio
+import numpy as np
+import json
+from os import path
+from pandas import DataFrame, concat, date_range, read_csv
+
+"""
+No server needed to test, the db_handler is replaced by a local stand-in
+
+To test run
+docker container exec --tty daemon pytest /daemon/tests/test_backfill.py -vv --tb=line
+"""
+
+
+@pytest.fixture
+def hourly(tmp_path) -> str:
+    # 10 days and 5 hours of tomorrow.io hourly values, the last day incomplete
+    rng = np.random.default_rng(0)
+    index = date_range("2024-12-28 00:00", periods=10 * 24 + 5, freq="h", tz="UTC").rename("date")
+    data = DataFrame({"temperature": rng.normal(5, 3, len(index)), "humidity": rng.uniform(40, 90, len(index)),
+                      "windDirection": rng.choice([350.0, 10.0], len(index))}, index=index)
+    data.iloc[30:60, 0] = np.nan
+    file = str(tmp_path / "hourly_data.csv")
+    data.to_csv(file, date_format="%Y-%m-%dT%H:%M:%SZ")
+    return file
+
+
+class Crash(Exception):
+    pass
+
+
+class StandIn:
+    """
+    Stand-in db_handler: records the committed rows, fails the batches numbered in `failing`,
+    rejects a datetime committed twice (as the sqlite backend does) and validates the batches with `validate`
+    """
+
+    def __init__(self, failing=(), validate=None):
+        self.rows = []
+        self.batches = 0
+        self.failing = set(failing)
+        self.app = FastAPI()
+
+        @self.app.post("/commit/batch", status_code=201)
+        async def commit_batch(payload: dict):
+            self.batches += 1
+            if self.batches in self.failing:
+                return JSONResponse({"detail": "restarting"}, status_code=503)
+            if validate is not None:
+                try:
+                    validate(payload)
+                except Exception as err:
+                    return JSONResponse({"detail": str(err)}, status_code=400)
+            if {row["datetime"] for row in payload["rows"]} & {row["datetime"] for row in self.rows}:
+                return JSONResponse({"detail": "already committed"}, status_code=409)
+            self.rows.extend(payload["rows"])
+            return {"rows": len(payload["rows"])}
+
+        @self.app.post("/get")
+        async def get(payload: dict):
+            index = [row["datetime"] for row in self.rows if payload["since"] <= row["datetime"] < payload["until"]]
+            return {"columns": [], "index": index[:payload["limit"]], "data": [], "next_cursor": None}
+
+    def run(self, hourly: str, crash_after: int | None = None, **kwargs) -> dict:
+        """
+        :param crash_after: the run is killed once this batch is committed, before the checkpoint records it
+        """
+        async def killed(response: httpx.Response) -> None:
+            if response.request.url.path == "/commit/batch" and self.batches == crash_after:
+                raise Crash()
+
+        async def run() -> dict:
+            async with httpx.AsyncClient(base_url="http://db_handler", event_hooks={"response": [killed]},
+                                         transport=httpx.ASGITransport(app=self.app)) as client:
+                return await backfill(hourly, "me", client, **kwargs)
+
+        return asyncio.run(run())
+
+
+def test_aggregator(hourly):
+    records = read_csv(hourly, index_col="date", parse_dates=True)
+    expected = records.drop(columns="windDirection").resample("D").mean()
+    expected.index = expected.index.tz_convert(None)
+
+    aggregator = DailyAggregator()
+    # chunks which don't match the days
+    days = [aggregator.add(records.iloc[start:start + 7]) for start in range(0, len(records), 7)]
+    means = DailyAggregator.means(concat([*(day for day in days if not day.empty), aggregator.flush()]))
+
+    assert list(means.index) == list(expected.index)
+    assert np.allclose(means[["temperature", "humidity"]], expected, equal_nan=True)
+    # 350° and 10° average to 0°, not 180°
+    assert ((means["wind_direction"] < 10) | (means["wind_direction"] > 350)).all()
+
+
+def test_unsorted():
+    aggregator = DailyAggregator()
+    index = date_range("2024-01-02", periods=3, freq="h")
+    aggregator.add(DataFrame({"temperature": [1.0, 2.0, 3.0]}, index=index))
+    with pytest.raises(ValueError):
+        aggregator.add(DataFrame({"temperature": [1.0]}, index=index - np.timedelta64(1, "D"))[:1])
+
+
+def test_entries(tmp_path):
+    sun = tmp_path / "daily_data.csv"
+    sun.write_text("date,sunrise,sunset\n2024-12-31,1735631000,1735660000\n")
+    means = DataFrame({"temperature": [1.5, np.nan], "humidity": [50.0, np.nan]},
+                      index=date_range("2024-12-31", periods=2, freq="D"))
+
+    rows = entries(means, read_sun_times(str(sun)))
+    # the day without values is left out
+    assert rows == [{"datetime": "2024-12-31 00:00:00",
+                     "data": {"temperature": 1.5, "humidity": 50.0, "sunrise": "2024-12-31 07:43:20",
+                              "sunset": "2024-12-31 15:46:40", "season": "winter"}}]
+
+
+def test_backfill(hourly):
+    stand_in = StandIn()
+    assert stand_in.run(hourly, chunk_rows=50, batch_days=3) == {"committed": 11, "skipped_records": 0}
+    assert [row["datetime"][:10] for row in stand_in.rows] == [f"{day:%Y-%m-%d}" for day in
+                                                               date_range("2024-12-28", periods=11, freq="D")]
+    assert stand_in.batches == 4
+    # the checkpoint of a finished backfill is removed
+    assert not path.exists(f"{hourly}.checkpoint.json")
+
+
+def test_resume(hourly):
+    expected = StandIn()
+    expected.run(hourly, chunk_rows=50, batch_days=3)
+
+    stand_in = StandIn(failing=[3])
+    with pytest.raises(httpx.HTTPStatusError):
+        stand_in.run(hourly, chunk_rows=50, batch_days=3)
+    assert len(stand_in.rows) == 6 and path.exists(f"{hourly}.checkpoint.json")
+
+    # the 6 committed days are skipped, not read again
+    assert stand_in.run(hourly, chunk_rows=50, batch_days=3) == {"committed": 11, "skipped_records": 6 * 24}
+    assert stand_in.rows == expected.rows
+
+
+def test_killed_after_the_post(hourly):
+    expected = StandIn()
+    expected.run(hourly, chunk_rows=50, batch_days=3)
+
+    stand_in = StandIn()
+    with pytest.raises(Crash):
+        stand_in.run(hourly, chunk_rows=50, batch_days=3, crash_after=2)
+    # the second batch is in, the checkpoint only has it as pending
+    assert len(stand_in.rows) == 6
+    with open(f"{hourly}.checkpoint.json") as f:
+        assert json.load(f)["committed"] == 3
+
+    # settled without sending it again (which would be a 409)
+    assert stand_in.run(hourly, chunk_rows=50, batch_days=3) == {"committed": 11, "skipped_records": 6 * 24}
+    assert stand_in.rows == expected.rows
+    assert stand_in.batches == 4
+
+
+def test_zero_values(hourly):
+    # as validated by the real db_handler
+    utility = pytest.importorskip("db_handler.utility")
+    from db_handler.schema import SCHEMA
+
+    def validate(payload: dict) -> None:
+        utility.validate_batch(utility.BatchCommitPayload(**payload), tuple(SCHEMA))
+
+    # no snow at all: the daily means are 0.0
+    records = read_csv(hourly)
+    records.assign(snowIntensity=0.0, rainIntensity=0).to_csv(hourly, index=False)
+
+    stand_in = StandIn(validate=validate)
+    assert stand_in.run(hourly, chunk_rows=50, batch_days=3)["committed"] == 11
+    assert all(row["data"]["snow_intensity"] == 0.0 for row in stand_in.rows)
+
+
+def test_other_checkpoint(hourly, tmp_path):
+    stand_in = StandIn()
+    (tmp_path / "progress.json").write_text('{"source": "other.csv", "user": "me", "records": 0, '
+                                            '"committed": 0, "last_day": null}')
+    with pytest.raises(ValueError):
+        stand_in.run(hourly, checkpoint=str(tmp_path / "progress.json"))
@@ -0,0 +1,177 @@
+# tested objects
+from daemon.cache import WeatherCache
+from daemon.tests.test_weather import StandIn
+
+# testing related
+import pytest
+import asyncio
+from os import listdir
+
+"""
+No server needed to test, the tomorrow.io API is replaced by a local stand-in
+
+To test run
+docker container exec --tty daemon pytest /daemon/tests/test_cache.py -vv --tb=line
+"""
+
+# 2025-05-02 12:00:00 UTC
+NOON = 1746187200.0
+
+
+class Clock:
+    def __init__(self, now: float = NOON):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Upstream:
+    """
+    Stand-in fetch: counts the calls, answers after a delay, fails if told to
+    """
+
+    def __init__(self, delay: float = 0.0, error: Exception | None = None):
+        self.delay = delay
+        self.error = error
+        self.calls = []
+
+    async def __call__(self, location: str) -> dict:
+        self.calls.append(location)
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {"location": {"name": location}}
+
+
+def cache(tmp_path, **kwargs) -> WeatherCache:
+    return WeatherCache(str(tmp_path), **{"clock": Clock(), **kwargs})
+
+
+def test_snap(tmp_path):
+    weather = cache(tmp_path)
+    assert weather.snap((48.8566, 2.3522)) == weather.snap((48.87, 2.36)) == "48.9,2.4"
+    assert weather.snap((48.8566, 2.3522)) != weather.snap((48.74, 2.3522))
+    assert weather.snap(" London ") == "london"
+    assert cache(tmp_path, grid=1).snap((48.8566, 2.3522)) == "49,2"
+
+
+def test_same_city(tmp_path):
+    weather, upstream = cache(tmp_path), Upstream()
+
+    async def run() -> list:
+        return [await weather.get(location, "1d", upstream) for location in ((48.8566, 2.3522), (48.87, 2.36))]
+
+    first, second = asyncio.run(run())
+    assert first is second
+    assert upstream.calls == ["48.9,2.4"]
+    assert weather.stats() | {"size": 0} == {"size": 0, "hits": 1, "disk_hits": 0, "coalesced": 0, "misses": 1,
+                                             "in_flight": 0}
+
+
+def test_coalesced(tmp_path):
+    weather, upstream = cache(tmp_path), Upstream(delay=0.05)
+
+    async def run() -> list:
+        return await asyncio.gather(*(weather.get((48.85, 2.35), "1d", upstream) for _ in range(10)),
+                                    weather.get((48.85, 2.35), "1h", upstream))
+
+    results = asyncio.run(run())
+    # one call per timestep
+    assert len(upstream.calls) == 2
+    assert weather.coalesced == 9
+    assert all(result is results[0] for result in results[:10])
+
+
+def test_errors_not_cached(tmp_path):
+    weather, upstream = cache(tmp_path), Upstream(delay=0.01, error=RuntimeError("quota exceeded"))
+
+    async def run() -> None:
+        results = await asyncio.gather(*(weather.get("paris", "1d", upstream) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+        upstream.error = None
+        assert await weather.get("paris", "1d", upstream) == {"location": {"name": "paris"}}
+
+    asyncio.run(run())
+    assert len(upstream.calls) == 2
+
+
+def test_disk(tmp_path):
+    upstream, clock = Upstream(), Clock()
+
+    async def run(weather: WeatherCache) -> dict:
+        return await weather.get("paris", "1d", upstream)
+
+    asyncio.run(run(cache(tmp_path, clock=clock)))
+    # another process, or after a restart
+    restarted = cache(tmp_path, clock=clock)
+    assert asyncio.run(run(restarted)) == {"location": {"name": "paris"}}
+    assert len(upstream.calls) == 1 and restarted.disk_hits == 1
+
+
+def test_expiry(tmp_path):
+    upstream, clock = Upstream(), Clock()
+    weather = cache(tmp_path, clock=clock, ttl=60)
+
+    async def run() -> None:
+        await weather.get("paris", "1d", upstream)
+        clock.now += 59
+        await weather.get("paris", "1d", upstream)
+        assert len(upstream.calls) == 1
+
+        # expired in memory and on disk
+        clock.now += 1
+        await weather.get("paris", "1d", upstream)
+        assert len(upstream.calls) == 2
+
+        # another day, another key
+        clock.now += 24 * 3600 - 61
+        await weather.get("paris", "1d", upstream)
+        assert len(upstream.calls) == 3
+
+    asyncio.run(run())
+
+
+def test_lru(tmp_path):
+    weather, upstream = cache(tmp_path, maxsize=2), Upstream()
+
+    async def run() -> None:
+        for location in ("a", "b", "a", "c"):
+            await weather.get(location, "1d", upstream)
+
+    asyncio.run(run())
+    assert list(weather._memory) == [weather.key("a", "1d"), weather.key("c", "1d")]
+    # b only left the memory
+    assert len(listdir(tmp_path)) == 3
+
+
+def test_purge(tmp_path):
+    weather = WeatherCache(str(tmp_path), ttl=0)
+    asyncio.run(weather.get("paris", "1d", Upstream()))
+    assert weather.purge() == 1 and listdir(tmp_path) == []
+
+
+def test_client(tmp_path):
+    stand_in = StandIn(delay=0.05)
+
+    async def run() -> list:
+        client = stand_in.client(cache=cache(tmp_path))
+        # the users of the same city
+        results = await client.recent_many([(48.8566, 2.3522), (48.87, 2.36), (48.91, 2.41), (52.52, 13.40)])
+        await client.aclose()
+        return results
+
+    results = asyncio.run(run())
+    assert stand_in.calls == 2
+    assert [result["location"]["name"] for result in results] == ["48.9,2.4"] * 3 + ["52.5,13.4"]
+
+
+@pytest.mark.parametrize("location", [(48.85, 2.35), "Paris"])
+def test_key_per_day(tmp_path, location):
+    clock = Clock()
+    weather = cache(tmp_path, clock=clock)
+    today = weather.key(weather.snap(location), "1d")
+    clock.now += 12 * 3600
+    assert weather.key(weather.snap(location), "1d") != today
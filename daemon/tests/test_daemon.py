@@ -1,8 +1,133 @@
 from daemon.daemon import *
 
+# bridge to the fastapi
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+import daemon.daemon as service
+import httpx
+
+# testing related
+import pytest
+from daemon.tests.test_weather import StandIn as WeatherStandIn
+
+"""
+No server needed to test, the db_handler, the data analyzer and the weather API are replaced by local stand-ins
+
+To test run
+docker container exec --tty daemon pytest /daemon/tests/test_daemon.py -vv --tb=line
+"""
+
+
+@pytest.fixture
+def stand_ins(monkeypatch) -> dict:
+    commits, rules = [], []
+    db_handler, data_analyzer = FastAPI(), FastAPI()
+
+    @db_handler.post("/commit", status_code=201)
+    async def commit(payload: dict):
+        # checks of the db_handler the test applies, see db_handler_rules
+        for rule in rules:
+            try:
+                rule(payload)
+            except HTTPException as err:
+                return JSONResponse({"detail": err.detail}, status_code=err.status_code)
+        commits.append(payload)
+        return None
+
+    @data_analyzer.post("/analyse", status_code=202)
+    async def submit(payload: dict):
+        return {"job_id": "1", "status": "queued", **payload}
+
+    @data_analyzer.get("/analyse/{job_id}")
+    async def job(job_id: str):
+        raise HTTPException(status_code=404, detail=f"There is no job {job_id}")
+
+    weather = WeatherStandIn()
+    monkeypatch.setattr(service, "WEATHER", weather.client())
+    monkeypatch.setattr(service, "DB_HANDLER", httpx.AsyncClient(base_url="http://db_handler",
+                                                                 transport=httpx.ASGITransport(app=db_handler)))
+    monkeypatch.setattr(service, "DATA_ANALYZER", httpx.AsyncClient(base_url="http://data-analyser",
+                                                                    transport=httpx.ASGITransport(app=data_analyzer)))
+    monkeypatch.setattr(service, "COUNTERS", {**service.COUNTERS})
+    return {"commits": commits, "rules": rules, "weather": weather}
+
+
+@pytest.fixture
+def db_handler_rules(stand_ins) -> None:
+    # the validation of the real db_handler's /commit, available where the db_handler is installed
+    utility = pytest.importorskip("db_handler.utility")
+    from db_handler.schema import SCHEMA, validate_values
+
+    def validate(payload: dict) -> None:
+        commit = utility.CommitPayload(**payload)
+        utility.validate_columns(commit, tuple(SCHEMA))
+        utility.validate_post_data(commit)
+        validate_values(commit.data)
+
+    stand_ins["rules"].append(validate)
+
 
 class TestDBWriter:
-    pass
+    def test_rating(self, stand_ins):
+        with TestClient(service.app) as client:
+            response = client.post("/rating", json={"user": "me", "day_rank": 8, "location": [48.85, 2.35]})
+            assert response.status_code == 202, response.text
+
+            # the background task is over once the response is returned by the TestClient
+            [commit] = stand_ins["commits"]
+            assert commit["user"] == "me" and commit["datetime"] == response.json()["datetime"]
+            assert commit["data"] == {"day_rank": 8, "season": get_season(datetime.now()), "temperature": 12}
+            assert client.get("/healthcheck").json()["committed"] == 1
+
+    def test_zero_weather(self, stand_ins, db_handler_rules):
+        # a dry day at 0 °C: every value is committed
+        stand_ins["weather"].values[1] = {"temperatureAvg": 0.0, "rainIntensityAvg": 0.0, "snowIntensityAvg": 0,
+                                          "humidityAvg": 55.5}
+        with TestClient(service.app) as client:
+            assert client.post("/rating", json={"user": "me", "day_rank": 4, "location": "paris"}).status_code == 202
+            health = client.get("/healthcheck").json()
+            assert health["committed"] == 1, health["last_error"]
+
+        [commit] = stand_ins["commits"]
+        assert commit["data"] == {"day_rank": 4, "season": get_season(datetime.now()), "temperature": 0.0,
+                                  "rain_intensity": 0.0, "snow_intensity": 0, "humidity": 55.5}
+
+    def test_without_weather(self, stand_ins):
+        stand_ins["weather"].failures = 100
+        service.WEATHER.retries = 0
+        with TestClient(service.app) as client:
+            assert client.post("/rating", json={"user": "me", "day_rank": 3, "location": "paris"}).status_code == 202
+            assert stand_ins["commits"][0]["data"]["day_rank"] == 3
+            health = client.get("/healthcheck").json()
+            assert health["without_weather"] == 1 and health["last_error"].startswith("weather: 502")
+
+    @pytest.mark.parametrize("payload", [{"user": "me", "day_rank": 11, "location": "paris"},
+                                         {"user": "me", "day_rank": 5, "location": "paris", "odd": 1}])
+    def test_bad_rating(self, stand_ins, payload):
+        with TestClient(service.app) as client:
+            assert client.post("/rating", json=payload).status_code == 400
+        assert stand_ins["commits"] == []
+
+    def test_no_location(self, stand_ins, monkeypatch):
+        monkeypatch.setattr(service, "SECRETS", {})
+        with TestClient(service.app) as client:
+            assert client.post("/rating", json={"user": "me", "day_rank": 5}).status_code == 400
+
+
+def test_analysis(stand_ins):
+    with TestClient(service.app) as client:
+        response = client.post("/analyse", json={"user": "me", "kind": "gamma"})
+        assert response.status_code == 202 and response.json()["kind"] == "gamma"
+        assert client.get("/analyse/nope").status_code == 404
+
+
+def test_build_entry():
+    entry = build_entry(7, datetime(2025, 5, 2, 20), {"sunriseTime": "2025-05-02T04:12:00Z", "humidityAvg": 60,
+                                                      "snowIntensityAvg": None})
+    assert entry == {"day_rank": 7, "season": "spring", "humidity": 60, "sunrise": "2025-05-02 04:12:00"}
+    # zero is a value, not a missing one
+    assert build_entry(7, datetime(2025, 5, 2, 20), {"rainIntensityAvg": 0.0})["rain_intensity"] == 0.0
 
 
 def test_get_season():
@@ -0,0 +1,25 @@
+# tested objects
+from common.startup import budget, imported_by, measure
+
+"""
+No server needed to test, only pytest: the app is started in fresh interpreters, as a container restart would
+
+To test run
+docker container exec --tty daemon pytest /daemon/tests/test_startup.py -vv --tb=line
+"""
+
+# seconds, about twice the cold start measured on a laptop (0.45 s and 15 ms): past them it is a regression
+IMPORT_BUDGET = 1.0
+HEALTHCHECK_BUDGET = 0.5
+
+
+def test_cold_start():
+    timings = measure("daemon.daemon", repeat=2)
+    assert timings["import_s"] < budget(IMPORT_BUDGET), timings
+    assert timings["healthcheck_s"] < budget(HEALTHCHECK_BUDGET), timings
+
+
+def test_heavy_imports_deferred():
+    # pandas is the backfill's only, a separate process
+    assert imported_by("daemon.daemon", ("pandas", "numpy")) == []
+
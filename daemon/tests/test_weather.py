@@ -0,0 +1,234 @@
+# bridge to the fastapi
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+import httpx
+
+# tested objects
+from daemon.weather import CLOSED, HALF_OPEN, OPEN, RECENT_HISTORY, CircuitBreaker, WeatherClient, daily_values
+
+# testing related
+import pytest
+import asyncio
+from time import perf_counter
+
+"""
+No server needed to test, the tomorrow.io API is replaced by a local stand-in
+
+To test run
+docker container exec --tty daemon pytest /daemon/tests/test_weather.py -vv --tb=line
+"""
+
+
+class StandIn:
+    """
+    Stand-in of the tomorrow.io history endpoint: answers after a delay, the first `failures` requests with `status`,
+    the others with the daily `values` of yesterday and today
+    """
+
+    def __init__(self, delay: float = 0.0, failures: int = 0, status: int = 503, headers: dict | None = None):
+        self.delay = delay
+        self.failures = failures
+        self.values = [{"temperatureAvg": 10}, {"temperatureAvg": 12}]
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.locations = []
+        self.app = FastAPI()
+
+        @self.app.get(RECENT_HISTORY)
+        async def recent(request: Request):
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                await asyncio.sleep(self.delay)
+                if request.query_params.get("apikey") != "key":
+                    return JSONResponse({"message": "Invalid apikey"}, status_code=401)
+                if self.calls <= self.failures:
+                    return JSONResponse({"message": "failing"}, status_code=status, headers=headers)
+                location = request.query_params["location"]
+                self.locations.append(location)
+                return {"timelines": {"daily": [{"time": "2025-05-01T00:00:00Z", "values": self.values[0]},
+                                                {"time": "2025-05-02T00:00:00Z", "values": self.values[1]}]},
+                        "location": {"name": location}}
+            finally:
+                self.in_flight -= 1
+
+    def client(self, apikey: str = "key", **kwargs) -> WeatherClient:
+        return WeatherClient(apikey, base_url="http://weather", transport=httpx.ASGITransport(app=self.app),
+                             backoff=0.001, **kwargs)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_concurrent_locations():
+    stand_in = StandIn(delay=0.1)
+    locations = [(48.85, 2.35), (52.52, 13.40), "london", (40.71, -74.01), (35.68, 139.69), (55.75, 37.62)]
+
+    async def run() -> tuple:
+        client = stand_in.client(concurrency=3)
+        start = perf_counter()
+        results = await client.recent_many(locations)
+        await client.aclose()
+        return results, perf_counter() - start
+
+    results, elapsed = asyncio.run(run())
+    assert [result["location"]["name"] for result in results] == ["48.85,2.35", "52.52,13.4", "london",
+                                                                  "40.71,-74.01", "35.68,139.69", "55.75,37.62"]
+    assert stand_in.max_in_flight == 3
+    # 2 rounds of 3, not 6 one after the other
+    assert elapsed < 0.1 * 5
+
+
+def test_pool_opened_by_the_first_call():
+    stand_in = StandIn()
+
+    async def run() -> None:
+        client = stand_in.client()
+        # nothing to load at the daemon's start, https's CA bundle included
+        assert client._client is None
+        await client.recent("london")
+        assert client._client is not None
+        await client.aclose()
+
+    asyncio.run(run())
+
+
+def test_retry_until_up():
+    stand_in = StandIn(failures=2)
+
+    async def run() -> dict:
+        client = stand_in.client(retries=3)
+        result = await client.recent("london")
+        await client.aclose()
+        return result
+
+    assert daily_values(asyncio.run(run()), -1) == {"temperatureAvg": 12}
+    assert stand_in.calls == 3
+
+
+def test_gives_up():
+    stand_in = StandIn(failures=10, status=500)
+
+    async def run() -> None:
+        client = stand_in.client(retries=2)
+        with pytest.raises(HTTPException, check=lambda err: err.status_code == 502):
+            await client.recent("london")
+        await client.aclose()
+
+    asyncio.run(run())
+    assert stand_in.calls == 3
+
+
+def test_bad_key_not_retried():
+    stand_in = StandIn()
+
+    async def run() -> None:
+        client = stand_in.client(apikey="wrong")
+        with pytest.raises(HTTPException, check=lambda err: err.status_code == 502 and "401" in err.detail):
+            await client.recent("london")
+        # the API is up: it doesn't count as a failure
+        assert client.breaker.failures == 0
+        await client.aclose()
+
+    asyncio.run(run())
+    assert stand_in.calls == 1
+
+
+def test_retry_after():
+    stand_in = StandIn(failures=1, status=429, headers={"Retry-After": "0.2"})
+
+    async def run() -> float:
+        client = stand_in.client()
+        start = perf_counter()
+        await client.recent("london")
+        await client.aclose()
+        return perf_counter() - start
+
+    assert asyncio.run(run()) >= 0.2
+    assert stand_in.calls == 2
+
+
+def test_rate_limit_window():
+    # no calls left this hour: waiting that long fails at once, without calling the API again
+    stand_in = StandIn(failures=1, status=429, headers={"X-RateLimit-Remaining-Hour": "0"})
+
+    async def run() -> None:
+        client = stand_in.client()
+        with pytest.raises(HTTPException, check=lambda err: err.status_code == 503 and "Retry-After" in err.headers):
+            await client.recent("london")
+        assert client.stats()["rate_limited_for"] > 3500
+        await client.aclose()
+
+    asyncio.run(run())
+    assert stand_in.calls == 1
+
+
+class TestCircuitBreaker:
+    def test_states(self):
+        clock = Clock()
+        breaker = CircuitBreaker(threshold=2, cooldown=10, clock=clock)
+        breaker.failed()
+        assert breaker.state == CLOSED
+        breaker.failed()
+        assert breaker.state == OPEN
+        with pytest.raises(HTTPException, check=lambda err: err.status_code == 503):
+            breaker.acquire()
+
+        clock.now = 10
+        assert breaker.state == HALF_OPEN
+        breaker.acquire()
+        # a single trial at a time
+        with pytest.raises(HTTPException):
+            breaker.acquire()
+        # a failed trial opens it again for the whole cooldown
+        breaker.failed()
+        assert breaker.state == OPEN
+
+        clock.now = 20
+        assert breaker.acquire()
+        breaker.succeeded()
+        assert breaker.state == CLOSED and breaker.failures == 0
+
+    def test_abandoned(self):
+        clock = Clock()
+        breaker = CircuitBreaker(threshold=1, cooldown=10, clock=clock)
+        # in flight since before the circuit opened
+        assert not breaker.acquire()
+        breaker.failed()
+
+        clock.now = 10
+        trial = breaker.acquire()
+        # cancelling the older request doesn't let a second trial through
+        breaker.abandoned(False)
+        with pytest.raises(HTTPException, check=lambda err: err.status_code == 503):
+            breaker.acquire()
+        # cancelling the trial does
+        breaker.abandoned(trial)
+        assert breaker.acquire()
+
+    def test_fails_fast(self):
+        clock = Clock()
+        stand_in = StandIn(failures=100)
+
+        async def run() -> None:
+            client = stand_in.client(retries=1, concurrency=1,
+                                     breaker=CircuitBreaker(threshold=2, cooldown=30, clock=clock))
+            results = await client.recent_many(["a", "b", "c"])
+            # the first location's two attempts opened it, the others didn't reach the API
+            assert [err.status_code for err in results] == [502, 503, 503]
+            assert stand_in.calls == 2
+
+            stand_in.failures = 0
+            clock.now = 30
+            assert (await client.recent("a"))["location"]["name"] == "a"
+            assert client.stats()["breaker"] == CLOSED
+            await client.aclose()
+
+        asyncio.run(run())
@@ -0,0 +1,279 @@
+"""
+Async client of the tomorrow.io weather history API, fetching the weather of many locations at once:
+
+* at most `concurrency` requests in flight, the others wait for a slot,
+* failed connections, timeouts, 429 and 5xx are retried with exponential backoff and full jitter,
+* the rate limit headers are honoured: Retry-After, and no request before the end of a window
+  (second / hour / day) whose remaining calls are 0; waits longer than `max_wait` fail instead,
+* a circuit breaker: after `threshold` failures in a row the API isn't called for `cooldown` seconds,
+  the requests fail at once instead, then a single trial request decides whether it is up again.
+"""
+# Networking related
+from fastapi import HTTPException
+import httpx
+
+# concurrency related
+import asyncio
+from random import uniform
+
+# IO related
+from os import environ
+from time import monotonic
+
+# typing related
+from typing import Callable, Dict, Iterable, List, Sequence
+
+# the responses shared by the users of a same place
+from daemon.cache import WeatherCache
+
+RECENT_HISTORY = "/v4/weather/history/recent"
+# worth retrying: rate limited, or the API restarting / overloaded
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# tomorrow.io's rate limit windows, in seconds
+WINDOWS = {"Second": 1, "Hour": 3600, "Day": 86400}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+
+class CircuitBreaker:
+    """
+    Counts the failures in a row: past the threshold it opens for `cooldown` seconds, then lets a single trial through
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0, clock: Callable[[], float] = monotonic):
+        """
+        :param threshold: failures in a row which open the circuit
+        :param cooldown: seconds the circuit stays open
+        :param clock: replaces time.monotonic, for tests
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED
+        return OPEN if self._clock() - self.opened_at < self.cooldown else HALF_OPEN
+
+    def acquire(self) -> bool:
+        """
+        Before a request
+        :return: whether the request is the trial of the half-open circuit, to be passed to abandoned()
+        :raises 503: if the circuit is open, or half-open with the trial request already in flight
+        """
+        state = self.state
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and not self._trial:
+            self._trial = True
+            return True
+        retry = max(1, round(self.opened_at + self.cooldown - self._clock()))
+        raise HTTPException(status_code=503, detail=f"The weather API is unavailable, retry in {retry} s",
+                            headers={"Retry-After": str(retry)})
+
+    def abandoned(self, trial: bool) -> None:
+        """
+        The request was cancelled: it tells nothing, if it was the trial another one may be
+        :param trial: as returned by acquire() for the request, a request started earlier leaves the trial in flight
+        """
+        if trial:
+            self._trial = False
+
+    def succeeded(self) -> None:
+        self.failures, self.opened_at, self._trial = 0, None, False
+
+    def failed(self) -> None:
+        self.failures += 1
+        if self._trial or self.failures >= self.threshold:
+            # (re)opened: a failed trial restarts the cooldown
+            self.opened_at, self._trial = self._clock(), False
+
+
+class WeatherClient:
+    """
+    One connection pool to the weather API for the process's lifetime
+    """
+
+    def __init__(self, apikey: str, base_url: str = "https://api.tomorrow.io", concurrency: int = 5,
+                 retries: int = 3, backoff: float = 0.5, max_wait: float = 60.0, timeout: float = 10.0,
+                 breaker: CircuitBreaker | None = None, cache: WeatherCache | None = None,
+                 transport: httpx.AsyncBaseTransport | None = None, clock: Callable[[], float] = monotonic):
+        """
+        :param apikey: of tomorrow.io
+        :param base_url: e.g. "https://api.tomorrow.io"
+        :param concurrency: maximum requests in flight, also the size of the pool
+        :param retries: attempts after the first one
+        :param backoff: seconds, the n-th retry waits up to backoff * 2^n
+        :param max_wait: seconds a request waits at most for the rate limit, it fails past that
+        :param timeout: seconds to connect, and between two chunks of the response
+        :param breaker: the circuit breaker, 5 failures in a row and 30 seconds of cooldown by default
+        :param cache: of the responses of recent(), None calls the API every time
+        :param transport: replaces the network, for tests
+        :param clock: replaces time.monotonic, for tests
+        """
+        self.apikey = apikey
+        self.retries = retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.breaker = breaker if breaker is not None else CircuitBreaker(clock=clock)
+        self.cache = cache
+        self._clock = clock
+        # no request before this time (of the clock), as per the rate limit headers
+        self._not_before = 0.0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._options = dict(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            transport=transport,
+        )
+        # opened by the first request: loading the CA bundle of https takes longer than the rest of the daemon's start
+        self._client: httpx.AsyncClient | None = None
+
+    @classmethod
+    def from_env(cls, apikey: str) -> "WeatherClient":
+        return cls(
+            apikey,
+            base_url=environ.get("WEATHER_API_URL", "https://api.tomorrow.io"),
+            concurrency=int(environ.get("WEATHER_CONCURRENCY", 5)),
+            retries=int(environ.get("WEATHER_RETRIES", 3)),
+            max_wait=float(environ.get("WEATHER_MAX_WAIT", 60)),
+            breaker=CircuitBreaker(
+                threshold=int(environ.get("WEATHER_BREAKER_THRESHOLD", 5)),
+                cooldown=float(environ.get("WEATHER_BREAKER_COOLDOWN", 30)),
+            ),
+            cache=WeatherCache.from_env(),
+        )
+
+    def _rate_limited(self, response: httpx.Response) -> None:
+        # the longest wait any of the headers asks for
+        waits = [0.0]
+        retry_after = response.headers.get("retry-after")
+        if retry_after is not None and retry_after.replace(".", "", 1).isdigit():
+            waits.append(float(retry_after))
+        for window, seconds in WINDOWS.items():
+            if response.headers.get(f"x-ratelimit-remaining-{window.lower()}") == "0":
+                waits.append(seconds)
+        self._not_before = max(self._not_before, self._clock() + max(waits))
+
+    async def _wait_for_rate_limit(self) -> None:
+        """
+        :raises 503: if the wait is longer than max_wait
+        """
+        wait = self._not_before - self._clock()
+        if wait > self.max_wait:
+            raise HTTPException(status_code=503, detail=f"The weather API's rate limit is reached for {wait:.0f} s",
+                                headers={"Retry-After": str(round(wait))})
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def get(self, path: str, params: Dict[str, str]) -> dict:
+        """
+        GET a JSON from the weather API
+        :param path: e.g. RECENT_HISTORY
+        :param params: the query, without the apikey
+        :return: the JSON
+        :raises 502: if the API can't be reached, keeps failing or answers something else than a JSON
+        :raises 503: if the circuit is open or the rate limit is reached for longer than max_wait
+        :raises 504: if the API keeps timing out
+        """
+        async with self._slots:
+            for attempt in range(self.retries + 1):
+                await self._wait_for_rate_limit()
+                trial = self.breaker.acquire()
+                if self._client is None:
+                    self._client = httpx.AsyncClient(**self._options)
+                try:
+                    response = await self._client.get(path, params={**params, "apikey": self.apikey})
+                except asyncio.CancelledError:
+                    self.breaker.abandoned(trial)
+                    raise
+                except httpx.TimeoutException as err:
+                    self.breaker.failed()
+                    if attempt == self.retries:
+                        raise HTTPException(status_code=504, detail=f"The weather API timed out: {type(err).__name__}")
+                except httpx.TransportError as err:
+                    self.breaker.failed()
+                    if attempt == self.retries:
+                        raise HTTPException(status_code=502,
+                                            detail=f"Connecting to the weather API failed: {type(err).__name__} - {err}")
+                else:
+                    self._rate_limited(response)
+                    if response.status_code not in RETRY_STATUS:
+                        # a bad request or a bad key is ours to fix, the API itself is up
+                        self.breaker.succeeded()
+                        return self._parse(response)
+                    self.breaker.failed()
+                    if attempt == self.retries:
+                        raise HTTPException(status_code=502, detail=f"The weather API keeps failing "
+                                                                    f"({response.status_code}): {response.text}")
+
+                # full jitter: the retries of concurrent requests don't hit the API in lockstep
+                await asyncio.sleep(uniform(0, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def _parse(response: httpx.Response) -> dict:
+        if not response.is_success:
+            raise HTTPException(status_code=502,
+                                detail=f"The weather API refused the request ({response.status_code}): {response.text}")
+        try:
+            return response.json()
+        except ValueError:
+            raise HTTPException(status_code=502, detail="The weather API's response is not a valid JSON")
+
+    async def recent(self, location: Sequence[float] | str, timestep: str = "1d") -> dict:
+        """
+        The weather of the last days (or hours) at a location
+        :param location: (latitude, longitude) or a place the API knows, snapped to the cache's grid if any
+        :param timestep: "1d" or "1h"
+        :return: the JSON of the API, {"timelines": {"daily": [{"time": ..., "values": {...}}, ...]}, ...}
+        :raises HTTPException: as per get
+        """
+        if self.cache is not None:
+            return await self.cache.get(location, timestep, lambda snapped: self._recent(snapped, timestep))
+        return await self._recent(location, timestep)
+
+    async def _recent(self, location: Sequence[float] | str, timestep: str) -> dict:
+        if not isinstance(location, str):
+            location = ",".join(map(str, location))
+        return await self.get(RECENT_HISTORY, {"location": location, "timesteps": timestep, "units": "metric"})
+
+    async def recent_many(self, locations: Iterable[Sequence[float] | str],
+                          timestep: str = "1d") -> List[dict | HTTPException]:
+        """
+        The weather of many locations, fetched concurrently (at most `concurrency` at once)
+        :return: the JSON of each location in order, or the HTTPException its request failed with
+        """
+        async def fetch(location: Sequence[float] | str) -> dict | HTTPException:
+            try:
+                return await self.recent(location, timestep)
+            except HTTPException as err:
+                return err
+
+        return list(await asyncio.gather(*(fetch(location) for location in locations)))
+
+    def stats(self) -> dict:
+        return {"breaker": self.breaker.state, "failures": self.breaker.failures,
+                "rate_limited_for": max(0.0, self._not_before - self._clock()),
+                "cache": self.cache.stats() if self.cache is not None else None}
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+
+
+def daily_values(history: dict, day: int) -> dict:
+    """
+    :param history: JSON of WeatherClient.recent with the "1d" timestep
+    :param day: which of the days, e.g. -1 for the last one
+    :return: the values of the day, {} if there are none
+    """
+    daily = history.get("timelines", {}).get("daily") or []
+    try:
+        return daily[day]["values"]
+    except (IndexError, KeyError):
+        return {}
@@ -0,0 +1,114 @@
+# IO related
+from collections import OrderedDict
+from os import environ
+from time import monotonic
+
+# typing related
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class AnalysisCache:
+    """
+    LRU of analysis results, keyed by (user, data version, analysis parameters).
+    The data version of a user is the ETag of their /get response on the db_handler:
+    - within `ttl` seconds of the last check the cached results are served without asking the db_handler at all,
+    - afterwards the db_handler is asked with If-None-Match, a 304 makes them fresh again without transferring data.
+    A commit changes the version, so a result is never served for data it wasn't computed from (past the ttl).
+
+    Used from the event loop only, hence no lock.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = 5.0, clock: Callable[[], float] = monotonic):
+        """
+        :param maxsize: results kept, the least recently used are dropped first
+        :param ttl: seconds during which a user's version is trusted without revalidation, 0 always revalidates
+        :param clock: replaces time.monotonic, for tests
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._results: "OrderedDict[Tuple[str, str, Hashable], Any]" = OrderedDict()
+        # user -> (etag, checked at)
+        self._validators: Dict[str, Tuple[str, float]] = {}
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "AnalysisCache":
+        return cls(
+            maxsize=int(environ.get("ANALYSIS_CACHE_SIZE", 128)),
+            ttl=float(environ.get("ANALYSIS_CACHE_TTL", 5)),
+        )
+
+    def _lookup(self, user: str, params: Hashable) -> Any | None:
+        validator = self._validators.get(user)
+        if validator is None:
+            return None
+        key = (user, validator[0], params)
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+        return result
+
+    def fresh(self, user: str, params: Hashable) -> Any | None:
+        """
+        :return: the cached result if the user's version was checked less than ttl seconds ago, None otherwise
+        """
+        validator = self._validators.get(user)
+        if validator is None or self._clock() - validator[1] >= self.ttl:
+            return None
+        result = self._lookup(user, params)
+        if result is not None:
+            self.hits += 1
+        return result
+
+    def etag(self, user: str, params: Hashable) -> str | None:
+        """
+        :return: the ETag to send as If-None-Match, None if there is no result to revalidate
+        """
+        if self._lookup(user, params) is None:
+            return None
+        return self._validators[user][0]
+
+    def revalidated(self, user: str, params: Hashable) -> Any | None:
+        """
+        The db_handler answered 304: the user's version is current again
+        :return: the cached result, None if it was evicted meanwhile
+        """
+        validator = self._validators.get(user)
+        if validator is None:
+            # all the user's results were evicted while the request was in flight: the caller recomputes
+            return None
+        self._validators[user] = (validator[0], self._clock())
+        result = self._lookup(user, params)
+        if result is not None:
+            self.revalidations += 1
+        return result
+
+    def put(self, user: str, etag: str | None, params: Hashable, result: Any) -> None:
+        """
+        Keep a result computed from the data of the given version
+        :param etag: the ETag of the data, None (a db_handler without ETags) keeps nothing
+        """
+        self.misses += 1
+        if etag is None:
+            return
+
+        previous = self._validators.get(user)
+        if previous is not None and previous[0] != etag:
+            # results of the older versions can't be served anymore
+            for key in [key for key in self._results if key[0] == user and key[1] != etag]:
+                del self._results[key]
+
+        self._validators[user] = (etag, self._clock())
+        self._results[(user, etag, params)] = result
+        self._results.move_to_end((user, etag, params))
+        while len(self._results) > self.maxsize:
+            (evicted, _, _), _ = self._results.popitem(last=False)
+            if not any(key[0] == evicted for key in self._results):
+                del self._validators[evicted]
+
+    def stats(self) -> dict:
+        return {"size": len(self._results), "hits": self.hits,
+                "revalidations": self.revalidations, "misses": self.misses}
@@ -0,0 +1,223 @@
+"""
+The notebook's charts of the ratings (box plot, ECDF, EWMA over the raw ratings) rendered server side as PNG or SVG.
+
+* the rendering is CPU bound: it runs in a pool of worker processes, each importing matplotlib once, when it starts,
+  never in the event loop's process,
+* the outputs are content addressed: a chart is stored on disk under the hash of (chart, data version, format,
+  parameters), so the same name always holds the same bytes and can be cached for good by the clients,
+* the directory is bounded in bytes, the least recently served charts are deleted first.
+"""
+# concurrency related
+import asyncio
+from concurrent.futures import Executor
+from threading import Lock
+
+# parsing related
+import numpy as np
+from pandas import Series
+
+# IO related
+from collections import OrderedDict
+from hashlib import sha1
+from io import BytesIO
+from os import environ, makedirs, path, remove, replace, scandir, utime
+import json
+
+# typing related
+from typing import Any, Callable, Dict
+
+# the analyses
+from data_analyzer.incremental import EWMA_ALPHA, RATINGS
+from data_analyzer.jobs import process_pool
+
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def warm() -> None:
+    """
+    Initializer of the worker processes: import matplotlib (and pick its headless backend) before the first chart
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.figure  # noqa: F401
+
+
+def _box(ax, ratings: Series) -> None:
+    ax.boxplot(ratings, orientation="horizontal", medianprops={"color": "green", "linewidth": 1.5})
+    ax.set_xticks(range(0, 11))
+    ax.set_yticks([])
+    ax.set_ylim(0.9, 1.1)
+    ax.set_title("Distribution of the day ratings", fontweight="bold", fontsize=10)
+
+
+def _ecdf(ax, ratings: Series) -> None:
+    ecdf = ratings.value_counts(normalize=True).sort_index().cumsum()
+    ax.scatter(x=ecdf.index, y=ecdf.array, s=10, facecolors="green", edgecolors="green")
+    ax.step([0, *ecdf.index, 10], [0, 0, *ecdf.array], where="post", color="green", linewidth=1)
+    ax.set_xlim(0, 10)
+    ax.set_xticks(np.arange(0, 11, 1))
+    ax.set_ylim(-0.01, 1.01)
+    ax.set_yticks(np.arange(0, 1.1, 0.1))
+    ax.set_title("Empirical CDF of the ratings")
+
+
+def _ewma(ax, ratings: Series, alpha: float = EWMA_ALPHA) -> None:
+    ax.plot(ratings.ewm(alpha=alpha).mean(), color="green")
+    ax.scatter(x=ratings.index, y=ratings.array, s=10, color="blue")
+    ax.set_ylim(0, RATINGS[-1] + 0.5)
+    ax.set_yticks(np.arange(0, 11, 1))
+    ax.tick_params(axis="x", rotation=45)
+    ax.set_title("EWMA over time over raw ratings")
+
+
+# chart -> draws it on the axes out of the ratings and its parameters
+CHARTS: Dict[str, Callable[..., None]] = {"box": _box, "ecdf": _ecdf, "ewma": _ewma}
+# (figure width, height) in inches
+SIZES = {"box": (6, 2), "ecdf": (6, 4), "ewma": (6, 4)}
+
+
+def render(chart: str, fmt: str, ratings: Series, params: Dict[str, Any]) -> bytes:
+    """
+    Entry point of the worker processes
+    :param chart: one of CHARTS
+    :param fmt: one of FORMATS
+    :param ratings: the user's ratings, by datetime, without the missing ones
+    :param params: keyword arguments of the chart, e.g. the alpha of the EWMA
+    :return: the encoded image
+    """
+    # the Figure API rather than pyplot: no global state shared between the charts of a worker
+    from matplotlib import rc_context
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=SIZES[chart], layout="tight")
+    CHARTS[chart](figure.subplots(), ratings, **params)
+    buffer = BytesIO()
+    # without the creation date and the random ids (svg) the same chart is the same bytes
+    with rc_context({"svg.hashsalt": chart}):
+        figure.savefig(buffer, format=fmt, metadata={"Date": None} if fmt == "svg" else None)
+    return buffer.getvalue()
+
+
+class ChartRenderer:
+    """
+    The pool of worker processes rendering the charts
+    """
+
+    def __init__(self, workers: int = 1, executor: Callable[..., Executor] = process_pool):
+        """
+        :param workers: charts rendered at once
+        :param executor: builds the pool out of the number of workers and an initializer, e.g. a ThreadPoolExecutor
+        """
+        self.workers = workers
+        self._executor_factory = executor
+        self._executor: Executor | None = None
+
+    @classmethod
+    def from_env(cls) -> "ChartRenderer":
+        return cls(workers=int(environ.get("CHART_WORKERS", 1)))
+
+    def start(self) -> None:
+        self._executor = self._executor_factory(self.workers, initializer=warm)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, chart: str, fmt: str, ratings: Series, params: Dict[str, Any]) -> bytes:
+        """
+        :return: the encoded image, as per render
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, render, chart, fmt, ratings, params)
+
+
+class ChartCache:
+    """
+    LRU of the rendered charts on disk, bounded in bytes. The files outlive the process: the directory is listed
+    at start, its files ordered by their modification time, which serving a file updates.
+    Used from worker threads, hence the lock.
+    """
+
+    def __init__(self, directory: str = "media/charts", max_bytes: int = 64 * 2 ** 20):
+        """
+        :param directory: where the charts are stored, created by the first one if missing
+        :param max_bytes: total size of the charts kept, the least recently served are deleted first
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+
+        files = sorted((entry for entry in (scandir(directory) if path.isdir(directory) else ())
+                        if entry.is_file() and not entry.name.endswith(".tmp")),
+                       key=lambda entry: entry.stat().st_mtime)
+        # name -> size
+        self._files: "OrderedDict[str, int]" = OrderedDict((entry.name, entry.stat().st_size) for entry in files)
+        self.size = sum(self._files.values())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "ChartCache":
+        return cls(
+            directory=environ.get("CHART_CACHE_DIR", "media/charts"),
+            max_bytes=int(environ.get("CHART_CACHE_BYTES", 64 * 2 ** 20)),
+        )
+
+    @staticmethod
+    def name(chart: str, version: str, fmt: str, params: Dict[str, Any]) -> str:
+        """
+        :param version: of the user's data, e.g. the ETag of the db_handler
+        :return: the file name of the chart
+        """
+        key = json.dumps([chart, version, fmt, params], sort_keys=True)
+        return f"{sha1(key.encode()).hexdigest()}.{fmt}"
+
+    def get(self, name: str) -> bytes | None:
+        """
+        :return: the chart, None if it isn't stored (or not anymore)
+        """
+        with self._lock:
+            if name not in self._files:
+                self.misses += 1
+                return None
+            file = path.join(self.directory, name)
+            try:
+                with open(file, mode="rb") as f:
+                    content = f.read()
+                utime(file)
+            except OSError:
+                # deleted by something else
+                self.size -= self._files.pop(name)
+                self.misses += 1
+                return None
+            self._files.move_to_end(name)
+            self.hits += 1
+            return content
+
+    def put(self, name: str, content: bytes) -> None:
+        """
+        Store a chart, then delete the least recently served ones until the size is within max_bytes
+        """
+        file = path.join(self.directory, name)
+        with self._lock:
+            makedirs(self.directory, exist_ok=True)
+            with open(file + ".tmp", mode="wb") as f:
+                f.write(content)
+            replace(file + ".tmp", file)
+            self.size += len(content) - self._files.pop(name, 0)
+            self._files[name] = len(content)
+
+            # the new chart is kept even if it alone is over the limit
+            while self.size > self.max_bytes and len(self._files) > 1:
+                evicted, size = self._files.popitem(last=False)
+                self.size -= size
+                self.evictions += 1
+                try:
+                    remove(path.join(self.directory, evicted))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        return {"files": len(self._files), "bytes": self.size, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,174 @@
+"""
+Spearman correlations of the rating and the weather factors, all pairs at once and for many users in one call.
+
+Every column is ranked once (ties get their average rank), the correlations are then the Pearson ones of the ranks,
+computed for all the pairs as matrix products over a (users, rows, columns) stack.
+Missing values (NaN, and the padding of users with fewer rows) are left out pairwise. The users are stacked
+in batches of similar row counts (within a factor 2) and bounded size, so the padding never costs more than
+the data itself and the memory used doesn't grow with the number of users. The ranks of a column are
+among all its values, so the few pairs where a row has a value in only one of the columns are ranked again
+on the rows they share, one by one.
+Columns without variation in a pair (e.g. no snow at all) have no correlation: NaN, and listed as constant.
+"""
+# parsing related
+import numpy as np
+from pandas import DataFrame
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+# typing related
+from typing import Dict, Iterator, List, Tuple
+
+RATING = "day_rank"
+
+# values (users x rows x columns) of a batch stacked for correlate(), which holds a few arrays of that size
+MAX_CELLS = 2 ** 22
+
+# below it a variance is rounding noise: the column is taken as constant
+EPSILON = 1e-9
+
+
+def rank(values: np.ndarray) -> np.ndarray:
+    """
+    Ranks along the second to last axis, ties averaged, as pandas' rank() / scipy's rankdata
+    :param values: float array (..., rows, columns), NaN for missing values
+    :return: the ranks (1 based) of the values among the values of their column, NaN where they are missing
+    """
+    values = np.moveaxis(values, -2, -1)
+    order = np.argsort(values, axis=-1, kind="stable")
+    ordered = np.take_along_axis(values, order, axis=-1)
+
+    # runs of equal values, NaN never equals anything so each is a run of its own
+    positions = np.broadcast_to(np.arange(ordered.shape[-1]), ordered.shape)
+    starts = np.ones(ordered.shape, dtype=bool)
+    starts[..., 1:] = ordered[..., 1:] != ordered[..., :-1]
+    ends = np.ones(ordered.shape, dtype=bool)
+    ends[..., :-1] = starts[..., 1:]
+
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=-1)
+    last = np.flip(np.minimum.accumulate(np.flip(np.where(ends, positions, ordered.shape[-1]), axis=-1), axis=-1),
+                   axis=-1)
+
+    ranks = np.empty(ordered.shape)
+    np.put_along_axis(ranks, order, (first + last) / 2 + 1, axis=-1)
+    ranks[np.isnan(values)] = np.nan
+    return np.moveaxis(ranks, -1, -2)
+
+
+def correlate(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Spearman correlation matrices
+    :param values: float array (users, rows, columns), NaN for missing values
+    :return: the matrices (users, columns, columns) and whether each column varies at all (users, columns)
+    """
+    ranks = rank(values)
+    present = ~np.isnan(ranks)
+    ranks = np.where(present, ranks, 0.0)
+    present = present.astype(float)
+
+    # per pair (c, d) over the rows where both are present: count, sums and sums of squares of c, sum of c * d.
+    # Batched matrix products (BLAS), rows x columns^2 per user
+    n = np.swapaxes(present, 1, 2) @ present
+    sums = np.swapaxes(ranks, 1, 2) @ present
+    squares = np.swapaxes(ranks ** 2, 1, 2) @ present
+    products = np.swapaxes(ranks, 1, 2) @ ranks
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = products - sums * np.swapaxes(sums, 1, 2) / n
+        variance = squares - sums ** 2 / n
+        varies = (variance > EPSILON) & (np.swapaxes(variance, 1, 2) > EPSILON)
+        matrix = np.where(varies, covariance / np.sqrt(variance * np.swapaxes(variance, 1, 2)), np.nan)
+
+        # pairs with rows where only one of them is present: their ranks aren't among the shared rows only
+        counts = np.diagonal(n, axis1=1, axis2=2)
+        partial = (n < counts[:, :, None]) | (n < counts[:, None, :])
+        for user, c, d in zip(*np.nonzero(np.triu(partial, k=1))):
+            matrix[user, c, d] = matrix[user, d, c] = _pair(values[user, :, c], values[user, :, d])
+
+    # rounding may leave the diagonal a hair off 1
+    return np.clip(matrix, -1.0, 1.0), np.diagonal(varies, axis1=1, axis2=2)
+
+
+def _pair(x: np.ndarray, y: np.ndarray) -> float:
+    both = ~np.isnan(x) & ~np.isnan(y)
+    if both.sum() < 2:
+        return np.nan
+    ranks = rank(np.stack([x[both], y[both]], axis=-1))
+    deviations = ranks - ranks.mean(axis=0)
+    variances = (deviations ** 2).sum(axis=0)
+    if (variances <= EPSILON).any():
+        return np.nan
+    return float(deviations[:, 0] @ deviations[:, 1] / np.sqrt(variances[0] * variances[1]))
+
+
+def factors(db: DataFrame) -> List[str]:
+    """
+    :return: the numeric columns of a user's data, the rating first
+    """
+    numeric = [col for col, dtype in db.dtypes.items() if is_numeric_dtype(dtype) and not is_bool_dtype(dtype)]
+    return sorted(numeric, key=lambda col: col != RATING)
+
+
+def batches(data: Dict[str, DataFrame], columns: int, max_cells: int = MAX_CELLS) -> Iterator[List[str]]:
+    """
+    :param data: user -> their data
+    :param columns: columns of the stacks
+    :param max_cells: bound of users x rows x columns per batch, a user with more rows is a batch of their own
+    :return: the users in batches of row counts within a factor 2 of each other (same power of two)
+    """
+    by_size: Dict[int, List[str]] = {}
+    for user in sorted(data, key=lambda user: len(data[user])):
+        by_size.setdefault((max(len(data[user]), 1) - 1).bit_length(), []).append(user)
+
+    for users in by_size.values():
+        batch, rows = [], 0
+        for user in users:
+            rows = max(rows, len(data[user]))
+            if batch and (len(batch) + 1) * rows * columns > max_cells:
+                yield batch
+                batch = []
+            batch.append(user)
+        yield batch
+
+
+def spearman(data: Dict[str, DataFrame]) -> Dict[str, dict]:
+    """
+    Spearman correlations of many users' data in one batched computation
+    :param data: user -> their data, the rating in the column "day_rank"
+    :return: user -> {"rating": factor -> correlation with the rating, "factors": factor -> factor -> correlation,
+    "constant": factors without any variation}. Pairs without a correlation are left out.
+    """
+    if not data:
+        return {}
+
+    columns = list(dict.fromkeys(col for db in data.values() for col in factors(db)))
+    results = {}
+    for users in batches(data, len(columns), MAX_CELLS):
+        results.update(_spearman({user: data[user] for user in users}, columns))
+    # in the order of the data
+    return {user: results[user] for user in data}
+
+
+def _spearman(data: Dict[str, DataFrame], columns: List[str]) -> Dict[str, dict]:
+    rows = max(len(db) for db in data.values())
+
+    # padded with NaN, which the correlation leaves out like any missing value
+    values = np.full((len(data), rows, len(columns)), np.nan)
+    for i, db in enumerate(data.values()):
+        for j, col in enumerate(columns):
+            if col in db.columns:
+                values[i, :len(db), j] = db[col].to_numpy(dtype=float, na_value=np.nan)
+
+    matrices, varies = correlate(values)
+
+    results = {}
+    for user, matrix, varying in zip(data, matrices, varies):
+        present = [j for j, col in enumerate(columns) if col in data[user].columns]
+        table = {columns[j]: {columns[k]: float(matrix[j, k]) for k in present if k != j and not np.isnan(matrix[j, k])}
+                 for j in present if columns[j] != RATING}
+        results[user] = {
+            "rating": {col: correlations[RATING] for col, correlations in table.items() if RATING in correlations},
+            "factors": {col: {other: value for other, value in correlations.items() if other != RATING}
+                        for col, correlations in table.items()},
+            "constant": [columns[j] for j in present if not varying[j]],
+        }
+    return results
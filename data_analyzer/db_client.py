@@ -0,0 +1,90 @@
+# Server related
+from fastapi import HTTPException
+import httpx
+
+# concurrency related
+import asyncio
+from random import uniform
+
+# IO related
+from os import environ
+
+# typing related
+from typing import Any, Dict
+
+# worth retrying: the db_handler restarting or overloaded, never a bad request
+RETRY_STATUS = (502, 503, 504)
+
+
+class DBClient:
+    """
+    The one connection pool of the process to the db_handler, opened for the app's lifetime.
+    At most `concurrency` requests are in flight at once, the others wait for a slot instead of piling up on the db_handler.
+    Failed connections, timeouts and 502-504 are retried with exponential backoff and full jitter.
+    """
+
+    def __init__(self, base_url: str, connect_timeout: float = 2.0, read_timeout: float = 30.0,
+                 concurrency: int = 10, retries: int = 3, backoff: float = 0.1,
+                 transport: httpx.AsyncBaseTransport | None = None):
+        """
+        :param base_url: e.g. "http://db_handler:8000"
+        :param connect_timeout: seconds to establish a connection
+        :param read_timeout: seconds between two chunks of the response
+        :param concurrency: maximum requests in flight, also the size of the pool
+        :param retries: attempts after the first one
+        :param backoff: seconds, the n-th retry waits up to backoff * 2^n
+        :param transport: replaces the network, for tests
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self._slots = asyncio.Semaphore(concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            # plain http inside the compose network: no CA bundle to load at startup
+            verify=base_url.startswith("https://"),
+            transport=transport,
+        )
+
+    @classmethod
+    def from_env(cls) -> "DBClient":
+        return cls(
+            base_url=environ.get("DB_HANDLER_URL", "http://db_handler:8000"),
+            connect_timeout=float(environ.get("DB_CONNECT_TIMEOUT", 2)),
+            read_timeout=float(environ.get("DB_READ_TIMEOUT", 30)),
+            concurrency=int(environ.get("DB_MAX_CONCURRENCY", 10)),
+            retries=int(environ.get("DB_RETRIES", 3)),
+        )
+
+    async def post(self, path: str, json: Dict[str, Any], headers: Dict[str, str] | None = None) -> httpx.Response:
+        """
+        POST to the db_handler, for idempotent requests only (they may be sent more than once)
+        :param path: e.g. "/get"
+        :param json: The payload
+        :param headers: Extra headers
+        :return: the response, whatever its status unless it is worth retrying
+        :raises 502: if the db_handler can't be reached or keeps answering 502-504
+        :raises 504: if the db_handler keeps timing out
+        """
+        async with self._slots:
+            for attempt in range(self.retries + 1):
+                try:
+                    response = await self._client.post(path, json=json, headers=headers)
+                    if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                        return response
+                except httpx.TimeoutException as err:
+                    if attempt == self.retries:
+                        raise HTTPException(status_code=504, detail=f"The database timed out: {type(err).__name__}")
+                except httpx.TransportError as err:
+                    if attempt == self.retries:
+                        raise HTTPException(
+                            status_code=502,
+                            detail=f"Connecting to the database failed: {type(err).__name__} - {err}"
+                        )
+
+                # full jitter: the retries of concurrent requests don't hit the db_handler in lockstep
+                await asyncio.sleep(uniform(0, self.backoff * 2 ** attempt))
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
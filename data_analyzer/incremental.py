@@ -0,0 +1,170 @@
+"""
+Descriptive statistics of the ratings kept as running state per user, updated with the new entries only:
+mean and variance (Welford, merged batch-wise as per Chan et al.), a histogram of the ratings 1-10
+(ECDF, exact median, minimum and maximum), the current EWMA and count / sum / sum of squares per weekday.
+
+Applying k new entries costs O(k) whatever the size of the history, a full scan is only needed to (re)build the state.
+"""
+# parsing related
+import numpy as np
+from pandas import DataFrame, DatetimeIndex, Timestamp, to_datetime
+
+# IO related
+from os import environ
+
+# typing related
+from typing import Any, Dict
+
+RATING = "day_rank"
+# the daemon accepts ratings 1 to 10, one bucket each
+RATINGS = np.arange(1, 11)
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+EWMA_ALPHA = float(environ.get("ANALYSIS_EWMA_ALPHA", 0.1))
+
+
+class RunningStats:
+    """
+    Running state of one user's ratings. NaN ratings (entries committed without one) are skipped.
+    Also remembers up to which entry it is: the latest datetime seen and how many entries with exactly that datetime,
+    so that the next sync asks the db_handler for the entries since then only.
+    """
+
+    def __init__(self, alpha: float = EWMA_ALPHA):
+        self.alpha = alpha
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.histogram = np.zeros(len(RATINGS), dtype=np.int64)
+        # EWMA as pandas' ewm(adjust=True): sum of the weighted ratings over the sum of the weights
+        self.ewm_numerator = 0.0
+        self.ewm_denominator = 0.0
+        self.weekday_count = np.zeros(7, dtype=np.int64)
+        self.weekday_sum = np.zeros(7)
+        self.weekday_sumsq = np.zeros(7)
+
+        # entries accounted, rated or not, to be compared with the rows of the user in the database
+        self.entries = 0
+        self.last: Timestamp | None = None
+        self.at_last = 0
+        # ETag of the last sync, revalidated as long as nothing new came in
+        self.etag: str | None = None
+
+    @classmethod
+    def from_frame(cls, db: DataFrame, alpha: float = EWMA_ALPHA) -> "RunningStats":
+        """
+        Full scan, to build the state of a user
+        :param db: The user's entries, with the ratings in the column "day_rank"
+        :param alpha: smoothing factor of the EWMA
+        :return: the state
+        """
+        state = cls(alpha)
+        state.apply(db)
+        return state
+
+    def apply(self, db: DataFrame) -> int:
+        """
+        Account the entries which are not in the state yet
+        :param db: entries at or after self.last, in datetime order, e.g. the answer of a /get with since=self.last
+        :return: number of entries accounted
+        """
+        index = db.index if isinstance(db.index, DatetimeIndex) else to_datetime(db.index, format="ISO8601")
+        if self.last is not None:
+            # entries sharing the latest datetime seen were partially accounted already
+            keep = np.ones(len(index), dtype=bool)
+            keep[index < self.last] = False
+            keep[np.flatnonzero(index == self.last)[:self.at_last]] = False
+            index, db = index[keep], db[keep]
+        if not len(index):
+            return 0
+
+        last = index[-1]
+        at_last = int((index == last).sum())
+        self.at_last = self.at_last + at_last if last == self.last else at_last
+        self.last = last
+        self.entries += len(index)
+
+        ratings = db[RATING].to_numpy(dtype=float, na_value=np.nan) if RATING in db.columns else np.full(len(db), np.nan)
+        rated = ~np.isnan(ratings)
+        self.update(ratings[rated], np.asarray(index.dayofweek)[rated])
+        return len(index)
+
+    def update(self, ratings: np.ndarray, weekdays: np.ndarray) -> None:
+        """
+        O(1) per rating
+        :param ratings: new ratings in datetime order, without NaN
+        :param weekdays: their weekday, 0 is Monday
+        :return: None
+        """
+        k = len(ratings)
+        if not k:
+            return
+
+        # Chan's merge of the running (count, mean, M2) with those of the batch, which is Welford's for k = 1
+        batch_mean = ratings.mean()
+        batch_m2 = float(((ratings - batch_mean) ** 2).sum())
+        total = self.count + k
+        delta = batch_mean - self.mean
+        self.mean += delta * k / total
+        self.m2 += batch_m2 + delta ** 2 * self.count * k / total
+        self.count = total
+
+        buckets = np.clip(np.rint(ratings).astype(np.int64), RATINGS[0], RATINGS[-1]) - RATINGS[0]
+        self.histogram += np.bincount(buckets, minlength=len(RATINGS))
+
+        # the oldest of the batch is weighted (1 - alpha)^(k - 1), the newest 1
+        decay = 1 - self.alpha
+        weights = decay ** np.arange(k - 1, -1, -1, dtype=float)
+        self.ewm_numerator = self.ewm_numerator * decay ** k + float(weights @ ratings)
+        self.ewm_denominator = self.ewm_denominator * decay ** k + float(weights.sum())
+
+        self.weekday_count += np.bincount(weekdays, minlength=7)
+        self.weekday_sum += np.bincount(weekdays, weights=ratings, minlength=7)
+        self.weekday_sumsq += np.bincount(weekdays, weights=ratings ** 2, minlength=7)
+
+    def request(self) -> Dict[str, Any]:
+        """
+        :return: the /get fields asking for the entries the state doesn't have yet
+        """
+        fields = {"columns": [RATING]}
+        if self.last is not None:
+            fields["since"] = self.last.strftime("%Y-%m-%d %H:%M:%S")
+        return fields
+
+    def _quantile(self, position: int) -> int:
+        # the rating of the position-th (0 based) smallest rating
+        return int(RATINGS[np.searchsorted(np.cumsum(self.histogram), position, side="right")])
+
+    def summary(self) -> dict:
+        """
+        :return: count, mean, median, std, min, max, ECDF (rating -> share of ratings <= it), EWMA and the weekdays'
+        count, mean and std. Values are None where there are too few ratings, the std is the sample one (ddof=1).
+        """
+        n = self.count
+        if not n:
+            return {"count": 0, "mean": None, "median": None, "std": None, "min": None, "max": None,
+                    "ecdf": {}, "ewma": None, "weekdays": {}}
+
+        present = np.flatnonzero(self.histogram)
+        weekdays = {}
+        for day, count, total, squares in zip(WEEKDAYS, self.weekday_count, self.weekday_sum, self.weekday_sumsq):
+            if not count:
+                continue
+            mean = total / count
+            variance = (squares - count * mean ** 2) / (count - 1) if count > 1 else None
+            weekdays[day] = {"count": int(count), "mean": float(mean),
+                             "std": float(np.sqrt(max(variance, 0.0))) if variance is not None else None}
+
+        return {
+            "count": n,
+            "mean": float(self.mean),
+            "median": (self._quantile((n - 1) // 2) + self._quantile(n // 2)) / 2,
+            "std": float(np.sqrt(self.m2 / (n - 1))) if n > 1 else None,
+            "min": int(RATINGS[present[0]]),
+            "max": int(RATINGS[present[-1]]),
+            "ecdf": {int(rating): float(share) for rating, share, count
+                     in zip(RATINGS, np.cumsum(self.histogram) / n, self.histogram) if count},
+            "ewma": float(self.ewm_numerator / self.ewm_denominator),
+            "weekdays": weekdays,
+        }
+
@@ -0,0 +1,205 @@
+"""
+Scheduler of the analysis jobs: the requests only queue a job and get its id back, `workers` consumers take the jobs
+by priority and have the CPU bound part run in a process pool, so that the event loop keeps serving meanwhile.
+
+* an identical job (same user and kind) still queued or running is not queued twice, its id is returned instead,
+* at most `max_queued` jobs wait: past that the submissions are refused (429) instead of making everybody wait longer,
+* a queued job can be cancelled, a running one is left to finish but its result is dropped.
+"""
+# Server related
+from fastapi import HTTPException
+
+# concurrency related
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
+from multiprocessing import get_context
+from itertools import count
+from uuid import uuid4
+
+# IO related
+from collections import OrderedDict
+from os import environ
+from time import time
+
+# typing related
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+def process_pool(workers: int, initializer: Callable[[], None] | None = None) -> Executor:
+    # spawned, not forked: a fork would copy the event loop's threads and locks in whatever state they are
+    return ProcessPoolExecutor(workers, mp_context=get_context("spawn"), initializer=initializer)
+
+
+class Job:
+    __slots__ = ("id", "user", "kind", "priority", "status", "result", "error", "created", "started", "finished")
+
+    def __init__(self, user: str, kind: str, priority: int):
+        self.id = uuid4().hex
+        self.user = user
+        self.kind = kind
+        self.priority = priority
+        self.status = QUEUED
+        self.result: Any = None
+        self.error: str | None = None
+        self.created = time()
+        self.started: float | None = None
+        self.finished: float | None = None
+
+    def describe(self) -> dict:
+        described = {"job_id": self.id, "user": self.user, "kind": self.kind, "priority": self.priority,
+                     "status": self.status, "created": self.created, "started": self.started,
+                     "finished": self.finished}
+        if self.status == DONE:
+            described["result"] = self.result
+        if self.status == FAILED:
+            described["error"] = self.error
+        return described
+
+
+class JobScheduler:
+    """
+    Priority queue of jobs (lower priority first, then first come first served) drained by `workers` consumers.
+    Used from the event loop only, hence no lock.
+    """
+
+    def __init__(self, run: Callable[[Job, Executor], Awaitable[Any]], workers: int = 2, max_queued: int = 32,
+                 kept: int = 256, executor: Callable[[int], Executor] = process_pool):
+        """
+        :param run: runs a job, with the executor for its CPU bound part, and returns its result
+        :param workers: jobs running at once, also the number of worker processes
+        :param max_queued: jobs waiting at most, the next submissions are refused
+        :param kept: finished jobs kept for GET /analyse/{job_id}, the oldest are forgotten first
+        :param executor: builds the pool out of the number of workers, e.g. a ThreadPoolExecutor for tests
+        """
+        self._run = run
+        self.workers = workers
+        self.max_queued = max_queued
+        self.kept = kept
+        self._executor_factory = executor
+        self._executor: Executor | None = None
+        self._queue: asyncio.PriorityQueue | None = None
+        self._consumers: List[asyncio.Task] = []
+        self._order = count()
+
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        # (user, kind) -> the id of the identical job queued or running
+        self._pending: Dict[Tuple[str, str], str] = {}
+        self.queued = 0
+
+    @classmethod
+    def from_env(cls, run: Callable[[Job, Executor], Awaitable[Any]]) -> "JobScheduler":
+        return cls(
+            run,
+            workers=int(environ.get("ANALYSIS_WORKERS", 2)),
+            max_queued=int(environ.get("ANALYSIS_QUEUE_DEPTH", 32)),
+            kept=int(environ.get("ANALYSIS_JOBS_KEPT", 256)),
+        )
+
+    def start(self) -> None:
+        """
+        Start the pool and the consumers, from within the event loop (the app's lifespan)
+        """
+        self._executor = self._executor_factory(self.workers)
+        self._queue = asyncio.PriorityQueue()
+        self._consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        self._consumers = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, user: str, kind: str, priority: int = 10) -> Job:
+        """
+        :param user: whose data is analysed
+        :param kind: the analysis
+        :param priority: lower runs first
+        :return: the job, or the identical one already queued or running
+        :raises 429: if the queue is full
+        :raises 503: if the scheduler isn't started
+        """
+        pending = self._pending.get((user, kind))
+        if pending is not None:
+            return self._jobs[pending]
+
+        if self._queue is None:
+            raise HTTPException(status_code=503, detail="The job scheduler is not running")
+        if self.queued >= self.max_queued:
+            raise HTTPException(status_code=429, detail=f"Too many jobs queued ({self.queued}), retry later",
+                                headers={"Retry-After": "1"})
+
+        job = Job(user, kind, priority)
+        self._jobs[job.id] = job
+        self._pending[(user, kind)] = job.id
+        self.queued += 1
+        self._queue.put_nowait((priority, next(self._order), job))
+        self._forget_finished()
+        return job
+
+    def get(self, job_id: str) -> Job:
+        """
+        :raises 404: if there is no such job (or it was forgotten)
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"There is no job {job_id}")
+        return job
+
+    def cancel(self, job_id: str) -> Job:
+        """
+        :return: the cancelled job
+        :raises 404: if there is no such job
+        :raises 409: if it is finished already
+        """
+        job = self.get(job_id)
+        if job.status in FINISHED:
+            raise HTTPException(status_code=409, detail=f"The job {job_id} is {job.status} already")
+
+        if job.status == QUEUED:
+            # left in the queue, the consumer skips it
+            self.queued -= 1
+        self._finish(job, CANCELLED)
+        return job
+
+    def _finish(self, job: Job, status: str, result: Any = None, error: str | None = None) -> None:
+        job.status, job.result, job.error, job.finished = status, result, error, time()
+        if self._pending.get((job.user, job.kind)) == job.id:
+            del self._pending[(job.user, job.kind)]
+
+    def _forget_finished(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(0, len(finished) - self.kept)]:
+            del self._jobs[job_id]
+
+    async def _consume(self) -> None:
+        while True:
+            _, _, job = await self._queue.get()
+            if job.status == CANCELLED:
+                continue
+
+            self.queued -= 1
+            job.status, job.started = RUNNING, time()
+            try:
+                result = await self._run(job, self._executor)
+            except asyncio.CancelledError:
+                raise
+            except HTTPException as err:
+                if job.status != CANCELLED:
+                    self._finish(job, FAILED, error=f"{err.status_code} - {err.detail}")
+            except Exception as err:
+                if job.status != CANCELLED:
+                    self._finish(job, FAILED, error=f"{type(err).__name__} - {err}")
+            else:
+                if job.status != CANCELLED:
+                    self._finish(job, DONE, result=result)
+
+    def stats(self) -> dict:
+        statuses = [job.status for job in self._jobs.values()]
+        return {"workers": self.workers, "queued": self.queued, "max_queued": self.max_queued,
+                "running": statuses.count(RUNNING)}
@@ -0,0 +1,111 @@
+"""
+The analyses of a user's data. They are CPU bound: the jobs run them in worker processes (see jobs.py),
+so they are plain top-level functions of a DataFrame, picklable along with their arguments.
+scipy is imported by the fits themselves, once per worker process and never in the event loop's.
+"""
+# parsing related
+import numpy as np
+from pandas import DataFrame
+
+# typing related
+from typing import Any, Callable, Dict
+
+# the analyses
+from data_analyzer.correlation import RATING, factors, spearman
+
+# 95% intervals
+CONFIDENCE = 0.95
+
+
+def summarise(data: DataFrame) -> dict:
+    """
+    :param data: The user's data
+    :return: its shape and the Spearman correlations of the rating and the weather factors (see correlation.spearman)
+    """
+    return {"status": "analyzed", "database": data.shape, "correlations": spearman({"user": data})["user"]}
+
+
+def _ratings(data: DataFrame) -> np.ndarray:
+    ratings = data[RATING].to_numpy(dtype=float, na_value=np.nan)
+    return ratings[~np.isnan(ratings)]
+
+
+def fit_gamma(data: DataFrame) -> dict:
+    """
+    Maximum likelihood fit of a gamma distribution to the ratings
+    :param data: The user's data
+    :return: shape, loc and scale of the fit, its mean and the interval holding 95% of the ratings under it
+    :raises ValueError: if there are fewer than 3 ratings
+    """
+    from scipy.stats import gamma
+
+    ratings = _ratings(data)
+    if len(ratings) < 3:
+        raise ValueError(f"A gamma fit needs at least 3 ratings, there are {len(ratings)}")
+
+    shape, loc, scale = gamma.fit(ratings)
+    lower, upper = gamma.interval(CONFIDENCE, shape, loc=loc, scale=scale)
+    return {"shape": float(shape), "loc": float(loc), "scale": float(scale),
+            "mean": float(gamma.mean(shape, loc=loc, scale=scale)),
+            "interval": [float(lower), float(upper)], "ratings": len(ratings)}
+
+
+def _additive(x: np.ndarray, intercept: float, *coefficients: float) -> np.ndarray:
+    # rating ~ b0 + sum_i f_i(factor_i) with f_i a cubic without constant term: 3 coefficients per factor
+    terms = np.stack([x, x ** 2, x ** 3], axis=1)
+    return intercept + np.einsum("fpr,fp->r", terms, np.reshape(coefficients, (len(x), 3)))
+
+
+def fit_gam(data: DataFrame) -> dict:
+    """
+    Generalized additive model of the rating, rating ~ b0 + sum_i f_i(factor_i) + e, fitted with scipy's curve_fit.
+    Each f_i is a cubic of the standardized factor. Days missing any factor are left out, factors without variation too.
+    :param data: The user's data
+    :return: intercept, the coefficients (linear, quadratic, cubic) of each factor with their 95% intervals, R^2
+    :raises ValueError: if there are too few complete days for the number of coefficients
+    """
+    from scipy.optimize import curve_fit
+    from scipy.stats import t
+
+    names = [col for col in factors(data) if col != RATING]
+    complete = data[[RATING, *names]].astype(float).dropna()
+    names = [col for col in names if complete[col].std() > 0]
+
+    parameters = 1 + 3 * len(names)
+    if len(complete) <= parameters:
+        raise ValueError(f"The model has {parameters} coefficients, there are only {len(complete)} complete days")
+
+    x = complete[names].to_numpy().T
+    x = (x - x.mean(axis=1, keepdims=True)) / x.std(axis=1, keepdims=True)
+    y = complete[RATING].to_numpy()
+
+    estimates, covariance = curve_fit(_additive, x, y, p0=np.zeros(parameters))
+    margin = t.ppf((1 + CONFIDENCE) / 2, len(y) - parameters) * np.sqrt(np.diag(covariance))
+    residuals = y - _additive(x, *estimates)
+
+    terms = {}
+    for i, name in enumerate(names):
+        coefficients = slice(1 + 3 * i, 4 + 3 * i)
+        terms[name] = {"coefficients": estimates[coefficients].tolist(),
+                       "intervals": np.stack([estimates[coefficients] - margin[coefficients],
+                                              estimates[coefficients] + margin[coefficients]], axis=1).tolist()}
+
+    return {"intercept": float(estimates[0]), "factors": terms, "days": len(y),
+            "r2": float(1 - (residuals ** 2).sum() / ((y - y.mean()) ** 2).sum())}
+
+
+MODELS: Dict[str, Callable[[DataFrame], Any]] = {
+    "summary": summarise,
+    "gamma": fit_gamma,
+    "gam": fit_gam,
+}
+
+
+def run(kind: str, data: DataFrame) -> Any:
+    """
+    Entry point of the worker processes
+    :param kind: one of MODELS
+    :param data: The user's data
+    :return: the result of the analysis
+    """
+    return MODELS[kind](data)
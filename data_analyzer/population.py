@@ -0,0 +1,120 @@
+"""
+Analysis of every user at once, e.g. nightly: the whole population's data comes in one export of the db_handler
+(a single pass over its database) and the per-user summaries are computed by vectorized groupby operations,
+so the work is O(total rows) in one process instead of a request and an import per user.
+The results are written in bulk, into one JSON file replaced atomically.
+"""
+# parsing related
+from pandas import DataFrame, Series, crosstab
+
+# IO related
+from os import environ, fsync, makedirs, path as os_path, replace
+from time import gmtime, strftime
+import json
+
+# typing related
+from typing import Dict
+
+# the analyses
+from data_analyzer.correlation import spearman
+from data_analyzer.incremental import EWMA_ALPHA, RATING, RATINGS, WEEKDAYS, RunningStats
+
+# a relative path is taken from the directory of the service, not from wherever it was started
+RESULTS_PATH = os_path.join(os_path.dirname(os_path.abspath(__file__)),
+                            environ.get("ANALYSIS_RESULTS_PATH", "media/population.json"))
+
+
+def _none(value: float) -> float | None:
+    return None if value != value else float(value)
+
+
+def summarise_population(db: DataFrame, alpha: float = EWMA_ALPHA) -> Dict[str, dict]:
+    """
+    The statistics of /stats and the correlations of /analyse, for every user
+    :param db: Everybody's data, with a "user" column and a DatetimeIndex, sorted by user then datetime (as exported)
+    :param alpha: smoothing factor of the EWMA
+    :return: user -> {"stats": as RunningStats.summary, "correlations": as correlation.spearman}
+    """
+    if db.empty:
+        return {}
+
+    # positional: the datetimes repeat from one user to the next
+    ratings = (db[RATING] if RATING in db.columns else Series(float("nan"), index=db.index)).astype(float)
+    rated = ratings.notna().to_numpy()
+    ratings = Series(ratings.to_numpy()[rated])
+    users = Series(db["user"].to_numpy()[rated], name="user")
+    weekdays = Series(db.index.dayofweek.to_numpy()[rated], name="weekday")
+    by_user = ratings.groupby(users, sort=False)
+
+    # EWMA as RunningStats: a rating is weighted (1 - alpha)^(number of the user's ratings after it)
+    weights = (1 - alpha) ** by_user.cumcount(ascending=False)
+    ewma = (ratings * weights).groupby(users, sort=False).sum() / weights.groupby(users, sort=False).sum()
+
+    stats = DataFrame({"count": by_user.count(), "mean": by_user.mean(), "median": by_user.median(),
+                       "std": by_user.std(), "min": by_user.min(), "max": by_user.max(), "ewma": ewma})
+    histogram = crosstab(users, ratings.round().clip(RATINGS[0], RATINGS[-1]).astype(int))
+    ecdf = histogram.cumsum(axis=1).div(histogram.sum(axis=1), axis=0)
+    by_day = ratings.groupby([users, weekdays]).agg(["count", "mean", "std"])
+
+    correlations = spearman({user: group.drop(columns="user") for user, group in db.groupby("user", sort=False)})
+
+    results = {}
+    for user in correlations:
+        if user not in stats.index:
+            results[user] = {"stats": RunningStats().summary(), "correlations": correlations[user]}
+            continue
+
+        row = stats.loc[user]
+        results[user] = {
+            "stats": {
+                "count": int(row["count"]),
+                **{key: _none(row[key]) for key in ("mean", "median", "std", "ewma")},
+                "min": int(row["min"]),
+                "max": int(row["max"]),
+                "ecdf": {int(rating): float(ecdf.at[user, rating])
+                         for rating, count in histogram.loc[user].items() if count},
+                "weekdays": {WEEKDAYS[day]: {"count": int(day_row["count"]), "mean": float(day_row["mean"]),
+                                             "std": _none(day_row["std"])}
+                             for day, day_row in by_day.loc[user].iterrows()},
+            },
+            "correlations": correlations[user],
+        }
+    return results
+
+
+def write_results(results: Dict[str, dict], path: str = RESULTS_PATH) -> None:
+    """
+    Replace the stored results in a single write
+    :param results: user -> their results
+    :param path: The JSON file
+    :return: None
+    """
+    makedirs(os_path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, mode="w") as f:
+        json.dump({"created": strftime("%Y-%m-%d %H:%M:%S", gmtime()), "users": results}, f)
+        f.flush()
+        fsync(f.fileno())
+    replace(tmp, path)
+
+
+def read_results(path: str = RESULTS_PATH) -> dict | None:
+    """
+    :return: the stored results, None if there are none yet
+    """
+    try:
+        with open(path, mode="r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def analyse_population(db: DataFrame, path: str = RESULTS_PATH) -> dict:
+    """
+    Entry point of the worker processes: summarise everybody and store the results
+    :param db: as per summarise_population
+    :param path: where to store the results
+    :return: the number of users and rows analysed
+    """
+    write_results(summarise_population(db), path)
+    return {"users": int(db["user"].nunique()), "rows": len(db), "path": path}
@@ -1,31 +1,96 @@
 # Server related
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query
+from pydantic import BaseModel, ConfigDict, Field
+from concurrent.futures import Executor
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi import Request
-import httpx
+from contextlib import asynccontextmanager
+from collections import defaultdict
+import asyncio
+import re
 
 # parsing & IO
-from pandas import DataFrame
+from pandas import DataFrame, Series
+from pandas.util import hash_pandas_object
+from pyarrow import ipc
 
-app = FastAPI()
+# metrics, shared with the other services
+from common.instrumentation import instrument, timed
 
-# TODO: figure out how to transfer files (graphics)
+# typing related
+from typing import Any, Awaitable, Callable, Dict, Hashable, Mapping, Tuple
 
-def get_data(user: str) -> DataFrame:
+# the connection pool to the db_handler
+from data_analyzer.db_client import DBClient
+from data_analyzer.cache import AnalysisCache
+from data_analyzer.charts import CHARTS, FORMATS, ChartCache, ChartRenderer
+from data_analyzer.incremental import EWMA_ALPHA, RATING, RunningStats
+from data_analyzer.jobs import Job, JobScheduler
+from data_analyzer.models import MODELS, run, summarise
+from data_analyzer.population import RESULTS_PATH, analyse_population, read_results
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+DB_CLIENT = DBClient.from_env()
+
+# results per (user, data version, parameters), ANALYSIS_CACHE_TTL seconds without asking the db_handler
+ANALYSIS_CACHE = AnalysisCache.from_env()
+
+# running descriptive statistics per user, synced with the entries committed since the last request
+STATS: Dict[str, RunningStats] = {}
+STATS_LOCKS: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+# the "user" of the jobs analysing everybody at once
+POPULATION = "*"
+
+# charts rendered in CHART_WORKERS processes, kept on disk up to CHART_CACHE_BYTES
+CHART_RENDERER = ChartRenderer.from_env()
+CHART_CACHE = ChartCache.from_env()
+# user -> version (ETag) of the ratings the last chart was made of
+CHART_VERSIONS: Dict[str, str] = {}
+CHART_NAME = re.compile(rf"[0-9a-f]{{40}}\.({'|'.join(FORMATS)})")
+
+
+async def run_job(job: Job, executor: Executor) -> Any:
+    # the import is async, only the analysis itself goes to a worker process
+    loop = asyncio.get_running_loop()
+    if job.user == POPULATION:
+        data = await get_population()
+        return await loop.run_in_executor(executor, analyse_population, data, RESULTS_PATH)
+    return await analysed(job.user, (job.kind,), lambda data: loop.run_in_executor(executor, run, job.kind, data))
+
+
+# the heavy analyses, in ANALYSIS_WORKERS processes, at most ANALYSIS_QUEUE_DEPTH waiting
+JOBS = JobScheduler.from_env(run_job)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    JOBS.start()
+    CHART_RENDERER.start()
+    yield
+    await JOBS.close()
+    CHART_RENDERER.close()
+    await DB_CLIENT.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+instrument(app, "data_analyzer")
+
+def parse_data(response) -> DataFrame:
     """
-    Import the data from the database
-    :param user: the username
+    :param response: A successful response of the db_handler's /get
     :return: pandas.DataFrame of the data
-    :raises HTTPException: If the import of the database failed
+    :raises HTTPException: If the response can't be parsed
     """
-    response = httpx.post("http://db_handler/get", json={"user": user}) # TODO: not sure if this works
-    if response.status_code != 200:
-        raise HTTPException(status_code=502, detail=f"Connecting to the database failed: {response.json()}")
-
-    raw_data = response.json()
     try:
-        data = DataFrame(
+        if response.headers.get("content-type", "").startswith(ARROW_STREAM):
+            return ipc.open_stream(response.content).read_pandas()
+
+        # db_handler without pyarrow falls back to the split JSON
+        raw_data = response.json()
+        return DataFrame(
             raw_data["data"],
             index=raw_data["index"],
             columns=raw_data["columns"]
@@ -34,9 +99,185 @@ def get_data(user: str) -> DataFrame:
         raise HTTPException(status_code=500, detail=f"Failed to import the data from the database:"
                                                     f"\t{type(err).__name__} - {err}")
 
+
+@timed("routing.get_data")
+async def fetch_data(user: str, etag: str | None = None, **fields: Any) -> Tuple[DataFrame | None, Mapping[str, str]]:
+    """
+    Import the data from the database, without blocking the event loop, unless it is still the one of the etag.
+    The data is requested as an Arrow IPC stream, which is read straight into a DataFrame without any JSON parsing.
+    :param user: the username
+    :param etag: ETag of the copy the caller has, None to get the data anyway
+    :param fields: other fields of the /get payload, e.g. columns or since
+    :return: pandas.DataFrame of the data (None if the copy is current) and the response headers, e.g. the ETag
+    and the number of the user's rows (X-Data-Rows)
+    :raises HTTPException: If the import of the database failed
+    """
+    headers = {"Accept": f"{ARROW_STREAM}, application/json;q=0.5"}
+    if etag is not None:
+        headers["If-None-Match"] = etag
+
+    response = await DB_CLIENT.post("/get", json={"user": user, **fields}, headers=headers)
+    if response.status_code == 304:
+        return None, response.headers
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Connecting to the database failed: {response.text}")
+
+    # decoding is CPU bound, the other requests keep being served meanwhile
+    return await asyncio.to_thread(parse_data, response), response.headers
+
+
+async def get_data_if_changed(user: str, etag: str | None = None,
+                              **fields: Any) -> Tuple[DataFrame | None, str | None]:
+    """
+    Same as fetch_data, with the ETag only
+    :param user: the username
+    :param etag: ETag of the copy the caller has, None to get the data anyway
+    :param fields: other fields of the /get payload, e.g. columns or since
+    :return: pandas.DataFrame of the data (None if the copy is current) and its ETag
+    :raises HTTPException: same as fetch_data
+    """
+    data, headers = await fetch_data(user, etag, **fields)
+    return data, etag if data is None else headers.get("etag")
+
+
+@timed("routing.get_population")
+async def get_population() -> DataFrame:
+    """
+    Import everybody's data in one request, the db_handler reads its database once for all
+    :return: pandas.DataFrame of the data with a "user" column, sorted by user then datetime
+    :raises HTTPException: If the import of the database failed
+    """
+    response = await DB_CLIENT.post("/export", json={}, headers={"Accept": ARROW_STREAM})
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Exporting the database failed: {response.text}")
+    if not response.content:
+        return DataFrame(columns=["user"])
+    return await asyncio.to_thread(parse_data, response)
+
+
+async def get_data(user: str) -> DataFrame:
+    """
+    :param user: the username
+    :return: pandas.DataFrame of the data
+    :raises HTTPException: same as get_data_if_changed
+    """
+    data, _ = await get_data_if_changed(user)
     return data
 
 
+async def analysed(user: str, params: Hashable, analysis: Callable[[DataFrame], Awaitable[Any]]) -> Any:
+    """
+    Result of an analysis of the user's data, from the cache as long as the data didn't change
+    :param user: the username
+    :param params: the parameters of the analysis, part of the cache key
+    :param analysis: computes the result out of the data, off the event loop
+    :return: the result, shared with later calls: don't modify it
+    :raises HTTPException: same as get_data_if_changed
+    """
+    result = ANALYSIS_CACHE.fresh(user, params)
+    if result is not None:
+        return result
+
+    data, etag = await get_data_if_changed(user, ANALYSIS_CACHE.etag(user, params))
+    if data is None:
+        result = ANALYSIS_CACHE.revalidated(user, params)
+        if result is not None:
+            return result
+        # evicted by a concurrent request since the etag was taken
+        data, etag = await get_data_if_changed(user)
+
+    result = await analysis(data)
+    ANALYSIS_CACHE.put(user, etag, params, result)
+    return result
+
+
+async def synced_stats(user: str, rebuild: bool = False) -> RunningStats:
+    """
+    The running statistics of the user, after accounting the entries committed since the last sync.
+    Only the first sync (or a rebuild) imports the whole history, the later ones the new entries, if any.
+    Entries committed before the latest one seen (a backfill, the rating of a past day) are not among those: the state
+    is rebuilt when the db_handler counts more of the user's rows than it accounted.
+    :param user: the username
+    :param rebuild: build the state from a full import anyway
+    :return: the state
+    :raises HTTPException: same as fetch_data
+    """
+    # one sync per user at a time, two would account the same entries twice
+    async with STATS_LOCKS[user]:
+        state = STATS.get(user)
+        if state is not None and not rebuild:
+            data, headers = await fetch_data(user, state.etag, **state.request())
+            if data is not None:
+                state.apply(data)
+                # the ETag of the previous "since": if it moved, the next sync gets the entries at the latest datetime
+                # once more (skipped by apply) along with the new ETag, from then on it is revalidated without data
+                state.etag = headers.get("etag")
+            if in_sync(state, headers):
+                return state
+
+        state = RunningStats()
+        data, headers = await fetch_data(user, **state.request())
+        state.apply(data)
+        state.etag = headers.get("etag")
+        STATS[user] = state
+        return state
+
+
+def in_sync(state: RunningStats, headers: Mapping[str, str]) -> bool:
+    """
+    :param state: the running statistics after a sync
+    :param headers: the headers of the sync's /get
+    :return: whether the state accounted as many entries as the db_handler has rows of the user. True with
+    a db_handler which doesn't count them.
+    """
+    rows = headers.get("x-data-rows")
+    # the count is taken before the load: a commit in between only costs a needless rebuild
+    return rows is None or int(rows) == state.entries
+
+
+async def rendered(user: str, chart: str, fmt: str, params: Dict[str, Any]) -> Tuple[str, bytes]:
+    """
+    A chart of the user's ratings, from the disk as long as the ratings didn't change
+    :param user: the username
+    :param chart: one of charts.CHARTS
+    :param fmt: one of charts.FORMATS
+    :param params: keyword arguments of the chart
+    :return: the file name of the chart (its hash) and the chart
+    :raises HTTPException: 404 if the user has no ratings, else same as get_data_if_changed
+    """
+    data, etag = await get_data_if_changed(user, CHART_VERSIONS.get(user), columns=[RATING])
+    if data is not None and etag is None:
+        # a db_handler without ETags: the content is the version
+        etag = str(hash_pandas_object(data).sum())
+
+    name = ChartCache.name(chart, etag, fmt, params)
+    content = await asyncio.to_thread(CHART_CACHE.get, name)
+    if content is not None:
+        CHART_VERSIONS[user] = etag
+        return name, content
+
+    if data is None:
+        # the ratings didn't change but the chart isn't stored: another chart, or evicted
+        data, etag = await get_data_if_changed(user, columns=[RATING])
+        name = ChartCache.name(chart, etag, fmt, params)
+
+    ratings = data[RATING].dropna() if RATING in data.columns else Series(dtype=float)
+    if ratings.empty:
+        raise HTTPException(status_code=404, detail=f"The user {user} has no ratings to chart")
+
+    content = await CHART_RENDERER.render(chart, fmt, ratings, params)
+    await asyncio.to_thread(CHART_CACHE.put, name, content)
+    CHART_VERSIONS[user] = etag
+    return name, content
+
+
+def _matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
 # Override the default handler for pydantic ValidationError's
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError) -> JSONResponse:
@@ -48,8 +289,132 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 
 @app.get("/analyse", status_code=200)
 async def analyse(user: str) -> dict:
-    data = get_data(user)
-    return {"status": "analyzed", "database": data.shape}
+    return await analysed(user, ("summary",), lambda data: asyncio.to_thread(summarise, data))
+
+
+class JobPayload(BaseModel):
+    user: str
+    # one of models.MODELS
+    kind: str = "summary"
+    # lower runs first
+    priority: int = Field(10, ge=0, le=100)
+
+    model_config = ConfigDict(extra='forbid')
+
+
+@app.post("/analyse", status_code=202)
+async def submit_analysis(payload: JobPayload) -> dict:
+    """
+    Queue an analysis, its result is fetched from GET /analyse/{job_id} once done
+    :param payload: JSON as per the docs.md
+    :return: 202 and the job, the already queued / running one if it is identical
+    :raises 400: if the kind of analysis is unknown
+    :raises 429: if too many jobs are queued
+    """
+    if payload.kind not in MODELS:
+        raise HTTPException(status_code=400, detail=f"Unknown analysis {payload.kind}, expected one of {', '.join(MODELS)}")
+    return JOBS.submit(payload.user, payload.kind, payload.priority).describe()
+
+
+@app.post("/analyse/population", status_code=202)
+async def submit_population_analysis() -> dict:
+    """
+    Queue the analysis of every user in one pass, e.g. nightly. The results are read from GET /population once done.
+    :return: 202 and the job, the already queued / running one if there is any
+    :raises 429: if too many jobs are queued
+    """
+    return JOBS.submit(POPULATION, "population").describe()
+
+
+@app.get("/population", status_code=200)
+async def population_results(user: str | None = None) -> dict:
+    """
+    :param user: only the results of this user
+    :return: the results of the last population analysis, {"created": ..., "users": {user: {"stats", "correlations"}}}
+    :raises 404: if there are no results yet, or none for the user
+    """
+    results = await asyncio.to_thread(read_results, RESULTS_PATH)
+    if results is None:
+        raise HTTPException(status_code=404, detail="There are no results yet, POST /analyse/population first")
+    if user is None:
+        return results
+    if user not in results["users"]:
+        raise HTTPException(status_code=404, detail=f"There are no results for the user {user}")
+    return {"created": results["created"], "users": {user: results["users"][user]}}
+
+
+@app.get("/analyse/{job_id}", status_code=200)
+async def analysis_job(job_id: str) -> dict:
+    """
+    :return: the job's status, along with its result once done or its error if failed
+    :raises 404: if there is no such job
+    """
+    return JOBS.get(job_id).describe()
+
+
+@app.delete("/analyse/{job_id}", status_code=200)
+async def cancel_analysis(job_id: str) -> dict:
+    """
+    Cancel a queued job, a running one finishes but its result is dropped
+    :raises 404: if there is no such job
+    :raises 409: if it is finished already
+    """
+    return JOBS.cancel(job_id).describe()
+
+
+@app.get("/stats", status_code=200)
+async def stats(user: str, rebuild: bool = False) -> dict:
+    """
+    Descriptive statistics of the user's ratings, kept up to date incrementally
+    :param user: the username
+    :param rebuild: recompute them from the whole history
+    :return: see RunningStats.summary
+    """
+    return (await synced_stats(user, rebuild)).summary()
+
+
+@app.get("/chart/{chart}", status_code=200)
+async def chart(chart: str, user: str, format: str = "png", alpha: float = Query(EWMA_ALPHA, gt=0, le=1),
+                if_none_match: str | None = Header(None)) -> Response:
+    """
+    A chart of the user's ratings. Revalidated with If-None-Match: the ETag is the chart's hash,
+    the same chart is also served for good at its Content-Location (GET /charts/{name}).
+    :param chart: "box", "ecdf" or "ewma"
+    :param user: the username
+    :param format: "png" or "svg"
+    :param alpha: smoothing factor of the EWMA
+    :return: the image, 304 if the client's copy is current
+    :raises 400: if the chart or the format is unknown
+    :raises 404: if the user has no ratings
+    """
+    if chart not in CHARTS:
+        raise HTTPException(status_code=400, detail=f"Unknown chart {chart}, expected one of {', '.join(CHARTS)}")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format {format}, expected one of {', '.join(FORMATS)}")
+
+    params = {"alpha": alpha} if chart == "ewma" else {}
+    name, content = await rendered(user, chart, format, params)
+
+    headers = {"ETag": f'"{name}"', "Cache-Control": "no-cache", "Content-Location": f"/charts/{name}"}
+    if _matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content, media_type=FORMATS[format], headers=headers)
+
+
+@app.get("/charts/{name}", status_code=200)
+async def stored_chart(name: str) -> Response:
+    """
+    A chart by its hash: the name never holds other bytes, so it is cached by the clients for good
+    :param name: as in the Content-Location of GET /chart/{chart}
+    :return: the image
+    :raises 404: if there is no such chart, or not anymore
+    """
+    match = CHART_NAME.fullmatch(name)
+    content = await asyncio.to_thread(CHART_CACHE.get, name) if match else None
+    if content is None:
+        raise HTTPException(status_code=404, detail=f"There is no chart {name}")
+    return Response(content, media_type=FORMATS[match.group(1)],
+                    headers={"ETag": f'"{name}"', "Cache-Control": "public, max-age=31536000, immutable"})
 
 
 @app.get("/healthcheck", status_code=200)
@@ -60,3 +425,11 @@ async def heath_check_db() -> int:
     :raises 500, 204: same as load_db
     """
     return 200
+
+
+@app.get("/cache", status_code=200)
+async def cache_stats() -> dict:
+    """
+    :return: size and hit / revalidation / miss counters of the analysis cache, the jobs and the charts on disk
+    """
+    return {**ANALYSIS_CACHE.stats(), "jobs": JOBS.stats(), "charts": CHART_CACHE.stats()}
@@ -0,0 +1,140 @@
+# bridge to the fastapi
+from fastapi import FastAPI, Request, Response
+import httpx
+
+# tested objects
+import data_analyzer.routing as routing
+from data_analyzer.cache import AnalysisCache
+from data_analyzer.db_client import DBClient
+
+# testing related
+import pytest
+import asyncio
+
+"""
+No server needed to test, the db_handler is replaced by a local stand-in
+
+To test run
+docker container exec --tty data-analyser pytest /data_analyzer/tests/test_cache.py -vv --tb=line
+"""
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestAnalysisCache:
+    @pytest.fixture
+    def clock(self) -> Clock:
+        return Clock()
+
+    @pytest.fixture
+    def cache(self, clock) -> AnalysisCache:
+        return AnalysisCache(maxsize=2, ttl=5, clock=clock)
+
+    def test_fresh_within_ttl(self, cache, clock):
+        cache.put("me", '"v1"', (), "result")
+        assert cache.fresh("me", ()) == "result"
+
+        clock.now = 5
+        assert cache.fresh("me", ()) is None
+        assert cache.etag("me", ()) == '"v1"'
+
+    def test_revalidated(self, cache, clock):
+        cache.put("me", '"v1"', (), "result")
+        clock.now = 10
+        assert cache.revalidated("me", ()) == "result"
+        assert cache.fresh("me", ()) == "result"
+
+    def test_revalidated_after_eviction(self, cache):
+        cache.put("me", '"v1"', (), "me")
+        etag = cache.etag("me", ())
+        # while the request is in flight, other users' results evict all of mine
+        cache.put("you", '"v1"', (), "you")
+        cache.put("them", '"v1"', (), "them")
+
+        assert etag == '"v1"'
+        assert cache.revalidated("me", ()) is None
+
+    def test_params_apart(self, cache):
+        cache.put("me", '"v1"', ("a",), "a")
+        assert cache.fresh("me", ("b",)) is None
+        assert cache.etag("me", ("b",)) is None
+
+    def test_new_version_drops_older(self, cache):
+        cache.put("me", '"v1"', ("a",), "a1")
+        cache.put("me", '"v2"', ("b",), "b2")
+        assert cache.etag("me", ("a",)) is None
+        assert cache.stats()["size"] == 1
+
+    def test_lru(self, cache):
+        cache.put("me", '"v1"', (), "me")
+        cache.put("you", '"v1"', (), "you")
+        cache.fresh("me", ())
+        cache.put("them", '"v1"', (), "them")
+
+        assert cache.fresh("you", ()) is None
+        assert cache.fresh("me", ()) == "me"
+
+    def test_without_etag(self, cache):
+        cache.put("me", None, (), "result")
+        assert cache.fresh("me", ()) is None
+
+
+class StandIn:
+    """
+    Stand-in db_handler honouring If-None-Match, with an ETag changed by commit()
+    """
+
+    def __init__(self):
+        self.version = 1
+        self.full = 0
+        self.not_modified = 0
+        self.app = FastAPI()
+
+        @self.app.post("/get")
+        async def get(payload: dict, request: Request, response: Response):
+            etag = f'"v{self.version}"'
+            if request.headers.get("if-none-match") == etag:
+                self.not_modified += 1
+                return Response(status_code=304, headers={"ETag": etag})
+            self.full += 1
+            response.headers["ETag"] = etag
+            rows = [[7]] * self.version
+            return {"index": [f"2020-01-0{i + 1} 20:00:00" for i in range(self.version)],
+                    "columns": ["day_rank"], "data": rows, "next_cursor": None}
+
+    def commit(self) -> None:
+        self.version += 1
+
+
+def test_analyse_cached(monkeypatch):
+    stand_in = StandIn()
+    clock = Clock()
+    monkeypatch.setattr(routing, "ANALYSIS_CACHE", AnalysisCache(ttl=5, clock=clock))
+
+    async def run() -> None:
+        monkeypatch.setattr(routing, "DB_CLIENT", DBClient("http://db_handler",
+                                                           transport=httpx.ASGITransport(app=stand_in.app)))
+        assert (await routing.analyse("me"))["database"] == (1, 1)
+
+        # within the ttl: not even a request
+        await routing.analyse("me")
+        assert (stand_in.full, stand_in.not_modified) == (1, 0)
+
+        # past it: revalidated, no data transferred
+        clock.now = 10
+        assert (await routing.analyse("me"))["database"] == (1, 1)
+        assert (stand_in.full, stand_in.not_modified) == (1, 1)
+
+        # a commit: recomputed
+        stand_in.commit()
+        clock.now = 20
+        assert (await routing.analyse("me"))["database"] == (2, 1)
+        assert (stand_in.full, stand_in.not_modified) == (2, 1)
+
+    asyncio.run(run())
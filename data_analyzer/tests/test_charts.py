@@ -0,0 +1,127 @@
+# bridge to the fastapi
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+import httpx
+
+# tested objects
+import data_analyzer.routing as routing
+from data_analyzer.charts import CHARTS, ChartCache, ChartRenderer, render
+from data_analyzer.db_client import DBClient
+
+# testing related
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from os import listdir
+from pandas import Series, date_range
+
+"""
+No server needed to test, the db_handler is replaced by a local stand-in
+
+To test run
+docker container exec --tty data-analyser pytest /data_analyzer/tests/test_charts.py -vv --tb=line
+"""
+
+ratings = Series([7.0, 5.0, 8.0, 8.0, 3.0, 6.0], index=date_range("2024-01-01 20:00", periods=6, freq="D"))
+
+
+class TestRender:
+    @pytest.fixture(autouse=True)
+    def matplotlib(self):
+        pytest.importorskip("matplotlib")
+
+    @pytest.mark.parametrize("chart", list(CHARTS))
+    def test_png(self, chart):
+        assert render(chart, "png", ratings, {}).startswith(b"\x89PNG")
+
+    def test_svg(self):
+        content = render("ewma", "svg", ratings, {"alpha": 0.5})
+        assert b"<svg" in content
+        # the same chart is the same bytes
+        assert render("ewma", "svg", ratings, {"alpha": 0.5}) == content
+
+
+class TestChartCache:
+    def test_name(self):
+        name = ChartCache.name("ewma", '"v1"', "png", {"alpha": 0.1})
+        assert name.endswith(".png") and name == ChartCache.name("ewma", '"v1"', "png", {"alpha": 0.1})
+        assert name != ChartCache.name("ewma", '"v2"', "png", {"alpha": 0.1})
+        assert name != ChartCache.name("ewma", '"v1"', "png", {"alpha": 0.2})
+
+    def test_round_trip(self, tmp_path):
+        cache = ChartCache(str(tmp_path / "charts"))
+        assert cache.get("a.png") is None
+        cache.put("a.png", b"chart")
+        assert cache.get("a.png") == b"chart"
+        assert cache.stats() | {"max_bytes": 0} == {"files": 1, "bytes": 5, "max_bytes": 0,
+                                                     "hits": 1, "misses": 1, "evictions": 0}
+
+    def test_eviction(self, tmp_path):
+        cache = ChartCache(str(tmp_path), max_bytes=10)
+        cache.put("a.png", b"1234")
+        cache.put("b.png", b"1234")
+        # served, so b is the least recently used one
+        cache.get("a.png")
+        cache.put("c.png", b"1234")
+
+        assert sorted(listdir(tmp_path)) == ["a.png", "c.png"]
+        assert cache.get("b.png") is None and cache.size == 8 and cache.evictions == 1
+
+        # the new chart is kept even alone over the limit
+        cache.put("d.png", b"x" * 20)
+        assert listdir(tmp_path) == ["d.png"]
+
+    def test_reopen(self, tmp_path):
+        cache = ChartCache(str(tmp_path))
+        cache.put("a.png", b"1234")
+        reopened = ChartCache(str(tmp_path), max_bytes=4)
+        assert reopened.size == 4 and reopened.get("a.png") == b"1234"
+
+
+def test_api(tmp_path, monkeypatch):
+    pytest.importorskip("matplotlib")
+    stand_in = FastAPI()
+    version = {"etag": '"v1"', "requests": 0}
+
+    @stand_in.post("/get")
+    async def get(payload: dict, request: Request):
+        version["requests"] += 1
+        if request.headers.get("if-none-match") == version["etag"]:
+            return Response(status_code=304, headers={"ETag": version["etag"]})
+        return Response(f'{{"index": {[str(day) for day in ratings.index]}, "columns": ["day_rank"], '
+                        f'"data": {[[rating] for rating in ratings]}, "next_cursor": null}}'.replace("'", '"'),
+                        media_type="application/json", headers={"ETag": version["etag"]})
+
+    renderer = ChartRenderer(executor=ThreadPoolExecutor)
+    monkeypatch.setattr(routing, "CHART_RENDERER", renderer)
+    monkeypatch.setattr(routing, "CHART_CACHE", ChartCache(str(tmp_path)))
+    monkeypatch.setattr(routing, "CHART_VERSIONS", {})
+    monkeypatch.setattr(routing, "DB_CLIENT", DBClient("http://db_handler", transport=httpx.ASGITransport(app=stand_in)))
+
+    with TestClient(routing.app) as client:
+        response = client.get("/chart/box", params={"user": "me"})
+        assert response.status_code == 200, response.text
+        assert response.headers["content-type"] == "image/png" and response.content.startswith(b"\x89PNG")
+        etag, location = response.headers["etag"], response.headers["content-location"]
+
+        # the ratings didn't change: revalidated by the db_handler, served from the disk
+        again = client.get("/chart/box", params={"user": "me"}, headers={"If-None-Match": etag})
+        assert again.status_code == 304 and again.headers["etag"] == etag
+        assert routing.CHART_CACHE.stats()["hits"] == 1
+
+        stored = client.get(location)
+        assert stored.content == response.content
+        assert "immutable" in stored.headers["cache-control"]
+
+        # new ratings, new chart
+        version["etag"] = '"v2"'
+        response = client.get("/chart/box", params={"user": "me"}, headers={"If-None-Match": etag})
+        assert response.status_code == 200 and response.headers["etag"] != etag
+
+        svg = client.get("/chart/ewma", params={"user": "me", "format": "svg", "alpha": 0.5})
+        assert svg.headers["content-type"].startswith("image/svg+xml")
+
+        assert client.get("/chart/pie", params={"user": "me"}).status_code == 400
+        assert client.get("/chart/box", params={"user": "me", "format": "gif"}).status_code == 400
+        assert client.get("/charts/../routing.py").status_code == 404
+        assert client.get("/charts/" + "0" * 40 + ".png").status_code == 404
@@ -0,0 +1,105 @@
+# tested objects
+import data_analyzer.correlation as correlation
+from data_analyzer.correlation import batches, rank, spearman
+
+# testing related
+import pytest
+import numpy as np
+from pandas import DataFrame, Series
+
+"""
+No server needed to test, only pytest
+
+To test run
+docker container exec --tty data-analyser pytest /data_analyzer/tests/test_correlation.py -vv --tb=line
+"""
+
+
+def reference(a: Series, b: Series) -> float:
+    # Spearman as its definition: Pearson of the ranks over the rows where both are present
+    both = a.notna() & b.notna()
+    return a[both].rank().corr(b[both].rank())
+
+
+def weather(seed: int, rows: int) -> DataFrame:
+    rng = np.random.default_rng(seed)
+    temperature = rng.normal(10, 5, rows).round(0)
+    return DataFrame({
+        "day_rank": np.clip((temperature / 3 + rng.normal(3, 2, rows)).round(), 1, 10),
+        "temperature": temperature,
+        "humidity": rng.uniform(20, 100, rows).round(0),
+        "snow_intensity": np.zeros(rows),
+        "season": ["winter"] * rows,
+    })
+
+
+class TestRank:
+    def test_same_as_pandas(self):
+        values = np.array([[3, 1], [1, np.nan], [3, 2], [2, 2], [np.nan, 2]], dtype=float)
+        expected = DataFrame(values).rank().to_numpy()
+        np.testing.assert_array_equal(rank(values), expected)
+
+    def test_batched(self):
+        values = np.random.default_rng(0).integers(0, 5, (3, 20, 4)).astype(float)
+        for user in range(3):
+            np.testing.assert_array_equal(rank(values)[user], DataFrame(values[user]).rank().to_numpy())
+
+
+class TestSpearman:
+    def test_same_as_pandas(self):
+        db = weather(0, 300)
+        result = spearman({"me": db})["me"]
+
+        expected = {col: reference(db[col], db.day_rank) for col in ("temperature", "humidity")}
+        assert result["rating"] == pytest.approx(expected)
+        assert result["factors"]["temperature"]["humidity"] == pytest.approx(reference(db.temperature, db.humidity))
+
+    def test_constant(self):
+        result = spearman({"me": weather(0, 50)})["me"]
+        assert result["constant"] == ["snow_intensity"]
+        assert "snow_intensity" not in result["rating"]
+
+    def test_batch_same_as_one_by_one(self):
+        data = {"me": weather(0, 300), "you": weather(1, 40), "them": weather(2, 120).drop(columns="humidity")}
+        batched = spearman(data)
+        for user, db in data.items():
+            single = spearman({user: db})[user]
+            assert batched[user]["rating"] == pytest.approx(single["rating"])
+            assert batched[user]["constant"] == single["constant"]
+        assert "humidity" not in batched["them"]["rating"]
+
+    def test_batches(self):
+        data = {user: weather(0, rows) for user, rows in (("a", 300), ("b", 40), ("c", 260), ("d", 33), ("e", 600))}
+        # similar row counts together, never more cells than allowed unless a user alone has more
+        assert list(batches(data, columns=4)) == [["d", "b"], ["c", "a"], ["e"]]
+        assert list(batches(data, columns=4, max_cells=4 * 300)) == [["d", "b"], ["c"], ["a"], ["e"]]
+
+    def test_bounded_stacks(self, monkeypatch):
+        data = {f"user-{i}": weather(i, 20 + 15 * i) for i in range(8)}
+        expected = spearman(data)
+
+        stacked = []
+        correlate = correlation.correlate
+        monkeypatch.setattr(correlation, "MAX_CELLS", 4 * 100)
+        monkeypatch.setattr(correlation, "correlate", lambda values: stacked.append(values.shape) or correlate(values))
+        batched = spearman(data)
+
+        assert list(batched) == list(data)
+        assert all(users == 1 or users * rows * columns <= 4 * 100 for users, rows, columns in stacked)
+        for user in data:
+            assert batched[user]["rating"] == pytest.approx(expected[user]["rating"])
+
+    def test_missing_values(self):
+        db = weather(0, 100)
+        db.loc[::7, "day_rank"] = np.nan
+
+        db.loc[::5, "humidity"] = np.nan
+        result = spearman({"me": db})["me"]
+
+        # ranked again over the shared rows
+        assert result["rating"]["temperature"] == pytest.approx(reference(db.temperature, db.day_rank))
+        assert result["rating"]["humidity"] == pytest.approx(reference(db.humidity, db.day_rank))
+        assert result["factors"]["temperature"]["humidity"] == pytest.approx(reference(db.temperature, db.humidity))
+
+    def test_empty(self):
+        assert spearman({}) == {}
@@ -0,0 +1,130 @@
+# bridge to the fastapi
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+import httpx
+
+# tested objects
+import data_analyzer.routing as routing
+from data_analyzer.db_client import DBClient
+
+# testing related
+import pytest
+import asyncio
+from time import perf_counter
+
+"""
+No server needed to test, the db_handler is replaced by a local stand-in
+
+To test run
+docker container exec --tty data-analyser pytest /data_analyzer/tests/test_db_client.py -vv --tb=line
+"""
+
+
+class StandIn:
+    """
+    Stand-in db_handler: answers /get after a delay, optionally failing the first requests
+    """
+
+    def __init__(self, delay: float = 0.0, failures: int = 0, status: int = 503):
+        self.delay = delay
+        self.failures = failures
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.app = FastAPI()
+
+        @self.app.post("/get")
+        async def get(payload: dict):
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                await asyncio.sleep(self.delay)
+                if self.calls <= self.failures:
+                    return JSONResponse({"detail": "restarting"}, status_code=status)
+                return {"index": ["2020-01-01 20:00:00"], "columns": ["day_rank"], "data": [[7]], "next_cursor": None}
+            finally:
+                self.in_flight -= 1
+
+    def client(self, **kwargs) -> DBClient:
+        return DBClient("http://db_handler", transport=httpx.ASGITransport(app=self.app), backoff=0.001, **kwargs)
+
+
+def test_concurrent_requests_overlap(monkeypatch):
+    stand_in = StandIn(delay=0.2)
+
+    async def run() -> float:
+        monkeypatch.setattr(routing, "DB_CLIENT", stand_in.client())
+        start = perf_counter()
+        frames = await asyncio.gather(*(routing.get_data("me") for _ in range(5)))
+        assert all(frame.shape == (1, 1) for frame in frames)
+        return perf_counter() - start
+
+    assert asyncio.run(run()) < 0.2 * 3
+    assert stand_in.max_in_flight == 5
+
+
+def test_bounded_concurrency():
+    stand_in = StandIn(delay=0.05)
+
+    async def run() -> None:
+        client = stand_in.client(concurrency=2)
+        await asyncio.gather(*(client.post("/get", json={"user": "me"}) for _ in range(6)))
+        await client.aclose()
+
+    asyncio.run(run())
+    assert stand_in.max_in_flight == 2
+
+
+def test_retry_until_up():
+    stand_in = StandIn(failures=2)
+
+    async def run() -> int:
+        client = stand_in.client(retries=3)
+        response = await client.post("/get", json={"user": "me"})
+        await client.aclose()
+        return response.status_code
+
+    assert asyncio.run(run()) == 200
+    assert stand_in.calls == 3
+
+
+def test_no_retry_on_client_error():
+    stand_in = StandIn(failures=5, status=400)
+
+    async def run() -> int:
+        client = stand_in.client(retries=3)
+        return (await client.post("/get", json={"user": "me"})).status_code
+
+    assert asyncio.run(run()) == 400
+    assert stand_in.calls == 1
+
+
+class TimingOut(httpx.AsyncBaseTransport):
+    def __init__(self):
+        self.calls = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        raise httpx.ReadTimeout("timed out", request=request)
+
+
+def test_timeout():
+    transport = TimingOut()
+
+    async def run() -> None:
+        client = DBClient("http://db_handler", transport=transport, retries=2, backoff=0.001)
+        await client.post("/get", json={"user": "me"})
+
+    with pytest.raises(HTTPException, check=lambda err: err.status_code == 504):
+        asyncio.run(run())
+    assert transport.calls == 3
+
+
+def test_unreachable():
+    async def run() -> None:
+        client = DBClient("http://127.0.0.1:9", retries=1, backoff=0.001)
+        await client.post("/get", json={"user": "me"})
+
+    with pytest.raises(HTTPException, check=lambda err: err.status_code == 502):
+        asyncio.run(run())
@@ -0,0 +1,143 @@
+# bridge to the fastapi
+from fastapi import FastAPI, Response
+import httpx
+
+# tested objects
+import data_analyzer.routing as routing
+from data_analyzer.db_client import DBClient
+from data_analyzer.incremental import RunningStats, WEEKDAYS
+
+# testing related
+import pytest
+import asyncio
+import numpy as np
+from pandas import DataFrame, date_range
+
+"""
+No server needed to test, only pytest
+
+To test run
+docker container exec --tty data-analyser pytest /data_analyzer/tests/test_incremental.py -vv --tb=line
+"""
+
+
+@pytest.fixture
+def db() -> DataFrame:
+    rng = np.random.default_rng(0)
+    index = date_range("2024-01-01 20:00", periods=200, freq="D").rename("datetime")
+    ratings = rng.integers(1, 11, len(index)).astype(float)
+    ratings[::17] = np.nan
+    return DataFrame({"day_rank": ratings, "temperature": rng.normal(10, 5, len(index))}, index=index)
+
+
+class TestRunningStats:
+    def test_same_as_pandas(self, db):
+        summary = RunningStats.from_frame(db, alpha=0.1).summary()
+        ratings = db.day_rank.dropna()
+
+        assert summary["count"] == len(ratings)
+        assert summary["mean"] == pytest.approx(ratings.mean())
+        assert summary["median"] == ratings.median()
+        assert summary["std"] == pytest.approx(ratings.std())
+        assert (summary["min"], summary["max"]) == (ratings.min(), ratings.max())
+        assert summary["ewma"] == pytest.approx(db.day_rank.ewm(alpha=0.1, ignore_na=True).mean().iloc[-1])
+
+        ecdf = ratings.value_counts(normalize=True).sort_index().cumsum()
+        assert summary["ecdf"] == pytest.approx({int(rating): share for rating, share in ecdf.items()})
+
+        by_day = ratings.groupby(ratings.index.dayofweek).agg(["count", "mean", "std"])
+        for day, row in by_day.iterrows():
+            assert summary["weekdays"][WEEKDAYS[day]] == pytest.approx(dict(row))
+
+    def test_incremental_same_as_full(self, db):
+        state = RunningStats(alpha=0.1)
+        for start in range(0, len(db), 30):
+            # as the db_handler answers a since: from the latest datetime seen on
+            since = 0 if state.last is None else db.index.searchsorted(state.last)
+            state.apply(db.iloc[since:start + 30])
+
+        incremental, full = state.summary(), RunningStats.from_frame(db, alpha=0.1).summary()
+        for key in ("count", "mean", "median", "std", "min", "max", "ewma", "ecdf"):
+            assert incremental[key] == pytest.approx(full[key])
+        for day in WEEKDAYS:
+            assert incremental["weekdays"][day] == pytest.approx(full["weekdays"][day])
+
+    def test_same_datetime(self):
+        index = ["2024-01-01 20:00:00"] * 3
+        state = RunningStats()
+        state.apply(DataFrame({"day_rank": [1.0, 2.0]}, index=index[:2]))
+        assert state.apply(DataFrame({"day_rank": [1.0, 2.0, 9.0]}, index=index)) == 1
+        assert state.summary()["count"] == 3
+
+    def test_request(self, db):
+        state = RunningStats()
+        assert "since" not in state.request()
+        state.apply(db)
+        assert state.request()["since"] == "2024-07-18 20:00:00"
+
+    def test_empty(self):
+        assert RunningStats().summary()["mean"] is None
+
+
+class StandIn:
+    """
+    Stand-in db_handler answering /get with the entries since the given datetime
+    """
+
+    def __init__(self, db: DataFrame):
+        self.db = db
+        self.rows_sent = 0
+        self.app = FastAPI()
+
+        @self.app.post("/get")
+        async def get(payload: dict, response: Response):
+            response.headers["X-Data-Rows"] = str(len(self.db))
+            db = self.db if "since" not in payload else self.db[self.db.index >= payload["since"]]
+            self.rows_sent += len(db)
+            return {"index": list(db.index.strftime("%Y-%m-%d %H:%M:%S")), "columns": ["day_rank"],
+                    "data": [[value] for value in db.day_rank.fillna(-1)], "next_cursor": None}
+
+
+def test_synced_stats(monkeypatch, db):
+    db = db.dropna()
+    stand_in = StandIn(db.iloc[:100])
+    monkeypatch.setattr(routing, "STATS", {})
+
+    async def run() -> None:
+        monkeypatch.setattr(routing, "DB_CLIENT", DBClient("http://db_handler",
+                                                           transport=httpx.ASGITransport(app=stand_in.app)))
+        assert (await routing.stats("me"))["count"] == 100
+
+        stand_in.db = db
+        stand_in.rows_sent = 0
+        assert (await routing.stats("me"))["count"] == len(db)
+        # the new entries and the one at the latest datetime seen, not the history
+        assert stand_in.rows_sent == len(db) - 100 + 1
+
+        assert (await routing.stats("me", rebuild=True))["count"] == len(db)
+
+    asyncio.run(run())
+
+
+def test_backfill_rebuilds(monkeypatch, db):
+    db = db.dropna()
+    stand_in = StandIn(db.iloc[50:])
+    monkeypatch.setattr(routing, "STATS", {})
+
+    async def run() -> None:
+        monkeypatch.setattr(routing, "DB_CLIENT", DBClient("http://db_handler",
+                                                           transport=httpx.ASGITransport(app=stand_in.app)))
+        assert (await routing.stats("me"))["count"] == len(db) - 50
+
+        # entries before the latest one seen: not among those since it, the count tells them
+        stand_in.db = db
+        stats = await routing.stats("me")
+        assert stats["count"] == len(db)
+        assert stats["mean"] == pytest.approx(db.day_rank.mean())
+
+        stand_in.rows_sent = 0
+        assert (await routing.stats("me"))["count"] == len(db)
+        # in sync again: only the entry at the latest datetime seen
+        assert stand_in.rows_sent == 1
+
+    asyncio.run(run())
@@ -0,0 +1,201 @@
+# bridge to the fastapi
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+import httpx
+
+# tested objects
+import data_analyzer.routing as routing
+from data_analyzer.db_client import DBClient
+from data_analyzer.jobs import JobScheduler, process_pool
+from data_analyzer.models import run
+
+# testing related
+import pytest
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from pandas import DataFrame
+
+"""
+No server needed to test, the db_handler is replaced by a local stand-in
+
+To test run
+docker container exec --tty data-analyser pytest /data_analyzer/tests/test_jobs.py -vv --tb=line
+"""
+
+
+class Blocking:
+    """
+    Job runner which waits for release(), recording the order the jobs started in
+    """
+
+    def __init__(self):
+        self.started = []
+        self.release = None
+
+    async def __call__(self, job, executor):
+        if self.release is None:
+            self.release = asyncio.Event()
+        self.started.append(job.user)
+        await self.release.wait()
+        if job.kind == "bad":
+            raise ValueError("no such analysis")
+        return {"user": job.user}
+
+
+def scheduler(runner, **kwargs) -> JobScheduler:
+    return JobScheduler(runner, executor=ThreadPoolExecutor, **kwargs)
+
+
+async def settle() -> None:
+    # let the consumers take what they can
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class TestJobScheduler:
+    def test_result(self):
+        runner = Blocking()
+
+        async def test() -> None:
+            jobs = scheduler(runner, workers=1)
+            jobs.start()
+            job = jobs.submit("me", "summary")
+            assert jobs.submit("me", "summary") is job
+            assert jobs.submit("me", "gamma") is not job
+
+            await settle()
+            assert job.status == "running"
+            runner.release.set()
+            await settle()
+            assert jobs.get(job.id).describe()["result"] == {"user": "me"}
+            await jobs.close()
+
+        asyncio.run(test())
+
+    def test_priority(self):
+        runner = Blocking()
+
+        async def test() -> None:
+            jobs = scheduler(runner, workers=1)
+            jobs.start()
+            jobs.submit("first", "summary")
+            await settle()
+            jobs.submit("low", "summary", priority=20)
+            jobs.submit("high", "summary", priority=0)
+            runner.release.set()
+            await settle()
+            assert runner.started == ["first", "high", "low"]
+            await jobs.close()
+
+        asyncio.run(test())
+
+    def test_queue_full(self):
+        runner = Blocking()
+
+        async def test() -> None:
+            jobs = scheduler(runner, workers=1, max_queued=1)
+            jobs.start()
+            jobs.submit("running", "summary")
+            await settle()
+            jobs.submit("queued", "summary")
+
+            with pytest.raises(HTTPException, check=lambda err: err.status_code == 429):
+                jobs.submit("refused", "summary")
+            # an identical job isn't a new one
+            assert jobs.submit("queued", "summary").user == "queued"
+            await jobs.close()
+
+        asyncio.run(test())
+
+    def test_cancel(self):
+        runner = Blocking()
+
+        async def test() -> None:
+            jobs = scheduler(runner, workers=1)
+            jobs.start()
+            jobs.submit("running", "summary")
+            await settle()
+            job = jobs.submit("queued", "summary")
+            assert jobs.cancel(job.id).status == "cancelled"
+            assert jobs.queued == 0
+
+            with pytest.raises(HTTPException, check=lambda err: err.status_code == 409):
+                jobs.cancel(job.id)
+
+            runner.release.set()
+            await settle()
+            assert runner.started == ["running"]
+            # a cancelled job doesn't stand in the way of a new identical one
+            assert jobs.submit("queued", "summary").id != job.id
+            await jobs.close()
+
+        asyncio.run(test())
+
+    def test_failure(self):
+        runner = Blocking()
+
+        async def test() -> None:
+            jobs = scheduler(runner)
+            jobs.start()
+            job = jobs.submit("me", "bad")
+            await settle()
+            runner.release.set()
+            await settle()
+            assert job.status == "failed"
+            assert "no such analysis" in job.describe()["error"]
+            await jobs.close()
+
+        asyncio.run(test())
+
+    def test_unknown_job(self):
+        with pytest.raises(HTTPException, check=lambda err: err.status_code == 404):
+            scheduler(Blocking()).get("nope")
+
+    def test_process_pool(self):
+        data = DataFrame({"day_rank": [1, 5, 3, 8], "temperature": [0.5, 10.0, 4.0, 20.0]})
+
+        async def run_in_pool(job, executor):
+            return await asyncio.get_running_loop().run_in_executor(executor, run, job.kind, data)
+
+        async def test() -> dict:
+            jobs = JobScheduler(run_in_pool, workers=1, executor=process_pool)
+            jobs.start()
+            job = jobs.submit("me", "summary")
+            for _ in range(600):
+                if job.status in ("done", "failed"):
+                    break
+                await asyncio.sleep(0.05)
+            await jobs.close()
+            return job.describe()
+
+        described = asyncio.run(test())
+        assert described["status"] == "done", described
+        assert described["result"]["correlations"]["rating"]["temperature"] == pytest.approx(1.0)
+
+
+def test_api(monkeypatch):
+    stand_in = FastAPI()
+
+    @stand_in.post("/get")
+    async def get(payload: dict):
+        return {"index": ["2020-01-01 20:00:00", "2020-01-02 20:00:00"], "columns": ["day_rank"],
+                "data": [[7], [8]], "next_cursor": None}
+
+    monkeypatch.setattr(routing, "JOBS", JobScheduler(routing.run_job, executor=ThreadPoolExecutor))
+    monkeypatch.setattr(routing, "DB_CLIENT", DBClient("http://db_handler", transport=httpx.ASGITransport(app=stand_in)))
+
+    with TestClient(routing.app) as client:
+        response = client.post("/analyse", json={"user": "me"})
+        assert response.status_code == 202, response.text
+        job_id = response.json()["job_id"]
+
+        for _ in range(100):
+            described = client.get(f"/analyse/{job_id}").json()
+            if described["status"] == "done":
+                break
+            sleep(0.01)
+        assert described["result"]["database"] == [2, 1]
+
+        assert client.post("/analyse", json={"user": "me", "kind": "nope"}).status_code == 400
+        assert client.get("/analyse/nope").status_code == 404
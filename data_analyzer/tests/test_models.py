@@ -0,0 +1,56 @@
+# tested objects
+from data_analyzer.models import MODELS, fit_gam, fit_gamma, run
+
+# testing related
+import pytest
+import numpy as np
+from pandas import DataFrame
+
+"""
+No server needed to test, only pytest
+
+To test run
+docker container exec --tty data-analyser pytest /data_analyzer/tests/test_models.py -vv --tb=line
+"""
+
+
+@pytest.fixture
+def db() -> DataFrame:
+    rng = np.random.default_rng(0)
+    temperature = rng.normal(10, 5, 300)
+    return DataFrame({
+        "day_rank": np.clip(np.round(rng.gamma(7, 1, 300)), 1, 10),
+        "temperature": temperature,
+        "feels_like": temperature + rng.normal(0, 1, 300),
+        "snow_intensity": np.zeros(300),
+    })
+
+
+def test_summary(db):
+    assert run("summary", db)["database"] == (300, 4)
+
+
+def test_gamma(db):
+    pytest.importorskip("scipy")
+    fit = fit_gamma(db)
+    assert 5 < fit["mean"] < 8
+    assert fit["interval"][0] < fit["mean"] < fit["interval"][1]
+
+
+def test_gam(db):
+    pytest.importorskip("scipy")
+    fit = fit_gam(db)
+    # the constant factor is left out
+    assert set(fit["factors"]) == {"temperature", "feels_like"}
+    assert fit["days"] == 300
+    assert 0 <= fit["r2"] <= 1
+
+
+def test_too_few_days(db):
+    pytest.importorskip("scipy")
+    with pytest.raises(ValueError):
+        fit_gam(db.head(5))
+
+
+def test_kinds():
+    assert set(MODELS) == {"summary", "gamma", "gam"}
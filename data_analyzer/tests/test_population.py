@@ -0,0 +1,112 @@
+# bridge to the fastapi
+from fastapi import FastAPI
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+import httpx
+
+# tested objects
+import data_analyzer.routing as routing
+from data_analyzer.db_client import DBClient
+from data_analyzer.incremental import RunningStats
+from data_analyzer.correlation import spearman
+from data_analyzer.jobs import JobScheduler
+import data_analyzer.population as population
+from data_analyzer.population import analyse_population, read_results, summarise_population
+
+# testing related
+import pytest
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from os import path
+from pandas import DataFrame, concat, date_range
+
+"""
+No server needed to test, the db_handler is replaced by a local stand-in
+
+To test run
+docker container exec --tty data-analyser pytest /data_analyzer/tests/test_population.py -vv --tb=line
+"""
+
+
+@pytest.fixture
+def db() -> DataFrame:
+    rng = np.random.default_rng(0)
+    frames = []
+    for user, rows in (("me", 120), ("you", 45), ("them", 3)):
+        index = date_range("2024-01-01 20:00", periods=rows, freq="D").rename("datetime")
+        ratings = rng.integers(1, 11, rows).astype(float)
+        ratings[::11] = np.nan
+        frames.append(DataFrame({"user": user, "day_rank": ratings, "temperature": rng.normal(10, 5, rows)},
+                                index=index))
+    return concat(frames)
+
+
+def test_same_as_per_user(db):
+    results = summarise_population(db)
+    assert list(results) == ["me", "you", "them"]
+
+    for user, group in db.groupby("user"):
+        expected = RunningStats.from_frame(group).summary()
+        stats = results[user]["stats"]
+        for key in ("count", "mean", "median", "std", "min", "max", "ewma"):
+            assert stats[key] == pytest.approx(expected[key]), key
+        assert stats["ecdf"] == pytest.approx(expected["ecdf"])
+        assert stats["weekdays"].keys() == expected["weekdays"].keys()
+        assert results[user]["correlations"] == spearman({user: group.drop(columns="user")})[user]
+
+
+def test_write(db, tmp_path):
+    path = str(tmp_path / "population.json")
+    assert analyse_population(db, path) == {"users": 3, "rows": len(db), "path": path}
+    assert read_results(path)["users"]["them"]["stats"]["count"] == 2  # one of the 3 is not rated
+
+
+def test_results_path(db, tmp_path, monkeypatch):
+    # anchored to the service, whichever the working directory
+    monkeypatch.chdir(tmp_path)
+    assert path.isabs(population.RESULTS_PATH)
+
+    nested = str(tmp_path / "results" / "population.json")
+    analyse_population(db, nested)
+    assert read_results(nested)["users"]
+
+
+def test_empty():
+    assert summarise_population(DataFrame(columns=["user"])) == {}
+
+
+def test_api(db, tmp_path, monkeypatch):
+    ipc = pytest.importorskip("pyarrow.ipc")
+    import pyarrow
+
+    stand_in = FastAPI()
+    exports = []
+
+    @stand_in.post("/export")
+    async def export(payload: dict):
+        exports.append(payload)
+        table = pyarrow.Table.from_pandas(db, preserve_index=True)
+        sink = pyarrow.BufferOutputStream()
+        with ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(sink.getvalue().to_pybytes(), media_type=routing.ARROW_STREAM)
+
+    monkeypatch.setattr(routing, "RESULTS_PATH", str(tmp_path / "population.json"))
+    monkeypatch.setattr(routing, "JOBS", JobScheduler(routing.run_job, executor=ThreadPoolExecutor))
+    monkeypatch.setattr(routing, "DB_CLIENT", DBClient("http://db_handler", transport=httpx.ASGITransport(app=stand_in)))
+
+    with TestClient(routing.app) as client:
+        assert client.get("/population").status_code == 404
+
+        job_id = client.post("/analyse/population").json()["job_id"]
+        for _ in range(100):
+            described = client.get(f"/analyse/{job_id}").json()
+            if described["status"] in ("done", "failed"):
+                break
+            sleep(0.01)
+        assert described["result"]["users"] == 3, described
+
+        assert len(exports) == 1
+        assert client.get("/population", params={"user": "you"}).json()["users"]["you"]["stats"]["count"] > 0
+        assert client.get("/population", params={"user": "nobody"}).status_code == 404
@@ -0,0 +1,24 @@
+# tested objects
+from common.startup import budget, imported_by, measure
+
+"""
+No server needed to test, only pytest: the app is started in fresh interpreters, as a container restart would
+
+To test run
+docker container exec --tty data-analyser pytest /data_analyzer/tests/test_startup.py -vv --tb=line
+"""
+
+# seconds, about twice the cold start measured on a laptop (0.8 s and 20 ms): past them it is a regression
+IMPORT_BUDGET = 2.0
+HEALTHCHECK_BUDGET = 0.5
+
+
+def test_cold_start():
+    timings = measure("data_analyzer.routing", repeat=2)
+    assert timings["import_s"] < budget(IMPORT_BUDGET), timings
+    assert timings["healthcheck_s"] < budget(HEALTHCHECK_BUDGET), timings
+
+
+def test_heavy_imports_deferred():
+    # the charts' and the models' libraries are imported where they are used: by the worker processes
+    assert imported_by("data_analyzer.routing", ("matplotlib", "scipy", "statsmodels")) == []
@@ -0,0 +1,260 @@
+"""
+Benchmarks of the db_handler endpoints over synthetic databases with the daemon's entry schema.
+
+Every database size runs in a fresh process, so the peak RSS of one size doesn't leak into the next:
+python -m db_handler.benchmark --rows 1000 10000 100000 1000000 10000000 --output bench.json
+
+Comparing against an earlier run (exit code 1 if any case got slower or bigger than the tolerance):
+python -m db_handler.benchmark --rows 1000 10000 --output new.json --compare bench.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+from os import environ, path as os_path
+from platform import platform, python_version
+from resource import getrusage, RUSAGE_SELF
+from tempfile import TemporaryDirectory
+from time import perf_counter, strftime
+
+# parsing related
+import numpy as np
+from pandas import DataFrame, date_range, __version__ as pandas_version
+
+# typing related
+from typing import Callable, Dict, List
+
+# columns written by the daemon, in its order
+COLUMNS = (
+    "day_rank", "sunrise", "sunset", "season", "temperature", "cloud_cover", "humidity", "atm_pressure",
+    "wind_speed", "wind_direction", "feels_like", "rain_intensity", "sleet_intensity", "snow_intensity"
+)
+SEASONS = np.array(["winter", "winter", "spring", "spring", "spring", "summer",
+                    "summer", "summer", "autumn", "autumn", "autumn", "winter"])
+
+USER = "bench"
+BATCH_ROWS = 100
+PAGE_ROWS = 1_000
+
+# p50 and the peak RSS growth are compared, the tails are too noisy for a fixed tolerance
+COMPARED = ("p50_ms", "rss_growth_mb")
+
+
+def generate_db(path: str, rows: int, seed: int = 0, chunk_rows: int = 100_000) -> None:
+    """
+    Write a synthetic database, one entry per minute starting at 1970-01-01 (10M rows end in 1989)
+    :param path: The CSV to create
+    :param rows: Number of entries
+    :param seed: Seed of the random values, the same seed gives the same file
+    :param chunk_rows: Rows generated and written at once, bounds the memory needed
+    :return: None
+    """
+    rng = np.random.default_rng(seed)
+    with open(path, mode="w") as f:
+        for start in range(0, rows, chunk_rows):
+            n = min(chunk_rows, rows - start)
+            index = date_range("1970-01-01", periods=n, freq="min") + np.timedelta64(start, "m")
+            days = index.normalize()
+
+            chunk = DataFrame({
+                "day_rank": rng.integers(1, 11, n),
+                "sunrise": (days + np.timedelta64(5, "h")).strftime("%Y-%m-%d %H:%M:%S"),
+                "sunset": (days + np.timedelta64(19, "h")).strftime("%Y-%m-%d %H:%M:%S"),
+                "season": SEASONS[index.month - 1],
+                "temperature": rng.normal(10, 8, n).round(1),
+                "cloud_cover": rng.uniform(0, 100, n).round(1),
+                "humidity": rng.uniform(20, 100, n).round(1),
+                "atm_pressure": rng.normal(1013, 8, n).round(1),
+                "wind_speed": rng.gamma(2, 2, n).round(1),
+                "wind_direction": rng.uniform(0, 360, n).round(1),
+                "feels_like": rng.normal(9, 9, n).round(1),
+                "rain_intensity": rng.exponential(0.3, n).round(2),
+                "sleet_intensity": rng.exponential(0.05, n).round(2),
+                "snow_intensity": rng.exponential(0.1, n).round(2),
+            }, index=index.strftime("%Y-%m-%d %H:%M:%S").rename("datetime"), columns=COLUMNS)
+            chunk.to_csv(f, header=start == 0)
+
+
+def latency_stats(samples: List[float]) -> dict:
+    """
+    :param samples: Durations in seconds
+    :return: percentiles, mean and max in milliseconds, and operations per second
+    """
+    ms = np.array(samples) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "ops_per_s": round(len(samples) / float(sum(samples)), 2),
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return getrusage(RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(call: Callable[[int], None], repeat: int) -> dict:
+    """
+    Time a call, after a warm-up run
+    :param call: Called with the run number (the warm-up is -1)
+    :param repeat: Timed runs
+    :return: latency_stats, the process peak RSS after the runs and how much they raised it
+    """
+    before = peak_rss_mb()
+    call(-1)
+
+    samples = []
+    for i in range(repeat):
+        start = perf_counter()
+        call(i)
+        samples.append(perf_counter() - start)
+
+    after = peak_rss_mb()
+    return {**latency_stats(samples), "peak_rss_mb": round(after, 1), "rss_growth_mb": round(after - before, 1)}
+
+
+def run_cases(path: str, rows: int, repeat: int, full_get_max: int) -> Dict[str, dict]:
+    """
+    Benchmark the endpoints on an existing database. Imports the app, so run it once per process.
+    :param path: The database generated by generate_db
+    :param rows: Its number of rows
+    :param repeat: Timed runs per case
+    :param full_get_max: Largest database for which the whole table is requested from /get
+    :return: case name -> measure() results
+    """
+    environ["INTERNAL_DB_PATH"] = path
+    environ.setdefault("DEBUG", "False")
+
+    from fastapi.testclient import TestClient
+    from db_handler.utility import load_db
+    from db_handler.db_handler import app
+
+    def ok(response) -> None:
+        if not response.is_success:
+            raise RuntimeError(f"{response.request.url}: {response.status_code} - {response.text}")
+
+    results = {}
+    with TestClient(app) as client:
+        results["load_db"] = measure(lambda i: load_db(path), repeat)
+
+        if rows <= full_get_max:
+            results["get_full"] = measure(lambda i: ok(client.post("/get", json={"user": USER})), repeat)
+
+        results["get_page"] = measure(
+            lambda i: ok(client.post("/get", json={"user": USER, "limit": PAGE_ROWS})), repeat
+        )
+
+        # the same hour in the middle of the table, a range the cache and the partitions can answer without a scan
+        middle = (np.datetime64("1970-01-01T00:00") + np.timedelta64(rows // 2, "m")).astype("datetime64[h]")
+        window = {"since": str(middle).replace("T", " ") + ":00:00",
+                  "until": str(middle + np.timedelta64(1, "h")).replace("T", " ") + ":00:00"}
+        results["get_range"] = measure(lambda i: ok(client.post("/get", json={"user": USER, **window})), repeat)
+
+        # new entries after the last one, commits need unique datetimes
+        last = np.datetime64("1970-01-01T00:00") + np.timedelta64(rows, "m")
+
+        def stamp(minute: int) -> str:
+            return str(last + np.timedelta64(minute, "m")).replace("T", " ") + ":00"
+
+        data = {"day_rank": 7, "season": "spring", "temperature": 14.2}
+        results["commit"] = measure(
+            lambda i: ok(client.post("/commit", json={"user": USER, "datetime": stamp(i + 1), "data": data})), repeat
+        )
+
+        def batch(i: int) -> None:
+            first = (repeat + 1) + (i + 1) * BATCH_ROWS
+            rows_ = [{"datetime": stamp(first + j), "data": data} for j in range(BATCH_ROWS)]
+            ok(client.post("/commit/batch", json={"user": USER, "rows": rows_}))
+
+        results["commit_batch"] = measure(batch, repeat)
+        results["healthcheck"] = measure(lambda i: ok(client.get("/healthcheck")), repeat)
+
+    return results
+
+
+def compare(old: dict, new: dict, tolerance: float) -> List[str]:
+    """
+    :param old: An earlier output of the benchmark
+    :param new: The current output
+    :param tolerance: Allowed relative growth, e.g. 0.2 for +20%
+    :return: One line per regression, empty if there is none
+    """
+    regressions = []
+    for rows, cases in new["results"].items():
+        for case, result in cases.items():
+            baseline = old["results"].get(rows, {}).get(case)
+            if baseline is None:
+                continue
+            for metric in COMPARED:
+                # absolute floor, so that sub-millisecond / sub-megabyte jitter isn't reported
+                if result[metric] > baseline[metric] * (1 + tolerance) and result[metric] - baseline[metric] > 1:
+                    regressions.append(
+                        f"{rows} rows, {case}: {metric} {baseline[metric]} -> {result[metric]}"
+                    )
+    return regressions
+
+
+def _run_size(rows: int, repeat: int, full_get_max: int) -> Dict[str, dict]:
+    # the generation happens in the parent, only the benchmarked process is measured
+    with TemporaryDirectory() as directory:
+        path = os_path.join(directory, "db.csv")
+        generate_db(path, rows)
+
+        worker = subprocess.run(
+            [sys.executable, "-m", "db_handler.benchmark", "--worker", path,
+             "--rows", str(rows), "--repeat", str(repeat), "--full-get-max", str(full_get_max)],
+            capture_output=True, text=True, env={**environ, "DEBUG": "False"}
+        )
+        if worker.returncode != 0:
+            raise RuntimeError(f"The benchmark of {rows} rows failed:\n{worker.stderr}")
+        return json.loads(worker.stdout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the db_handler endpoints across database sizes")
+    parser.add_argument("--rows", "-r", type=int, nargs="+", default=[1_000, 10_000, 100_000], dest="rows")
+    parser.add_argument("--repeat", "-n", type=int, default=20, dest="repeat")
+    parser.add_argument("--full-get-max", type=int, default=1_000_000, dest="full_get_max", metavar="rows")
+    parser.add_argument("--output", "-o", default=None, dest="output", metavar="json-path")
+    parser.add_argument("--compare", "-c", default=None, dest="compare", metavar="json-path")
+    parser.add_argument("--tolerance", type=float, default=0.2, dest="tolerance")
+    parser.add_argument("--worker", default=None, dest="worker", help=argparse.SUPPRESS)
+    args = vars(parser.parse_args())
+
+    if args["worker"] is not None:
+        print(json.dumps(run_cases(args["worker"], args["rows"][0], args["repeat"], args["full_get_max"])))
+        sys.exit(0)
+
+    report = {
+        "meta": {
+            "created": strftime("%Y-%m-%d %H:%M:%S"),
+            "python": python_version(),
+            "pandas": pandas_version,
+            "platform": platform(),
+            "repeat": args["repeat"],
+        },
+        # json keys are strings, so are these, which keeps a loaded report comparable
+        "results": {str(rows): _run_size(rows, args["repeat"], args["full_get_max"]) for rows in args["rows"]},
+    }
+
+    output = json.dumps(report, indent=2)
+    if args["output"] is None:
+        print(output)
+    else:
+        with open(args["output"], mode="w") as f:
+            f.write(output)
+
+    for rows, cases in report["results"].items():
+        for case, result in cases.items():
+            print(f"{rows:>10} rows {case:<14} p50 {result['p50_ms']:>10} ms  p99 {result['p99_ms']:>10} ms  "
+                  f"{result['ops_per_s']:>10} ops/s  peak RSS {result['peak_rss_mb']:>8} MB", file=sys.stderr)
+
+    if args["compare"] is not None:
+        with open(args["compare"]) as f:
+            regressions = compare(json.load(f), report, args["tolerance"])
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,134 @@
+# file system related
+from os import stat
+
+# concurrency related
+from threading import Lock
+
+# parsing related
+from pandas import DataFrame, concat
+
+# typing related
+from typing import Dict, List, Tuple
+
+from db_handler.utility import load_db, index_by_datetime
+
+
+def file_signature(path: str) -> Tuple[int, int, int] | None:
+    """
+    Cheap fingerprint of a file, used to detect changes without reading it
+    :param path: Path to the file
+    :return: (inode, size, mtime in ns) or None if the file can't be stat'ed
+    """
+    try:
+        st = stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class DBCache:
+    """
+    Process-level cache of parsed databases, keyed by path.
+    An entry stays valid as long as the file signature (inode, size, mtime) is unchanged,
+    so a repeated read costs a stat call and a dictionary lookup instead of a full parse.
+    The frames are kept with a sorted DatetimeIndex (see index_by_datetime).
+
+    Rows appended by this process are kept aside and merged on the next read,
+    so a commit does not pay for copying the whole frame.
+
+    The cached DataFrames are shared between requests: treat them as read-only.
+    """
+
+    def __init__(self):
+        # path -> (signature, db, rows appended since the last read)
+        self._entries: Dict[str, Tuple[Tuple[int, int, int], DataFrame, List[DataFrame]]] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str) -> DataFrame:
+        """
+        Return the parsed database, reloading it only if the file has changed
+        :param path: Path to the db
+        :return: pandas DataFrame of the database
+        :raises 500, 204: same as load_db
+        """
+        with self._lock:
+            signature = file_signature(path)
+            entry = self._entries.get(path)
+            if signature is not None and entry is not None and entry[0] == signature:
+                self.hits += 1
+                db, pending = entry[1], entry[2]
+                if pending:
+                    db = index_by_datetime(concat([db, index_by_datetime(concat(pending))]))
+                    self._entries[path] = (signature, db, [])
+                return db
+
+            self.misses += 1
+            self._entries.pop(path, None)
+
+        # parsed without the lock: load_db waits for the file lock, which a writer holds while it calls extend / put
+        # errors are propagated as is and nothing is cached
+        db = index_by_datetime(load_db(path))
+
+        with self._lock:
+            # compare-and-swap: kept only if the file is still the one stat'ed before the parse,
+            # and nobody has put a fresher entry in the meantime
+            if signature is not None and file_signature(path) == signature and path not in self._entries:
+                self._entries[path] = (signature, db, [])
+        return db
+
+    def put(self, path: str, db: DataFrame, signature: Tuple[int, int, int] | None = None) -> None:
+        """
+        Refresh an entry in place after the file has been written by this process
+        :param path: Path to the db
+        :param db: The DataFrame that has just been written to the path
+        :param signature: file signature right after the write, taken under the file lock (now if not given)
+        :return: None
+        """
+        with self._lock:
+            signature = signature if signature is not None else file_signature(path)
+            if signature is None:
+                self._entries.pop(path, None)
+                return
+            self._entries[path] = (signature, index_by_datetime(db), [])
+
+    def extend(self, path: str, previous_signature: Tuple[int, int, int] | None, row: DataFrame,
+               signature: Tuple[int, int, int] | None = None) -> None:
+        """
+        Record a row appended to the file by this process
+        :param path: Path to the db
+        :param previous_signature: file signature right before the append
+        :param row: The appended row as a single-row DataFrame
+        :param signature: file signature right after the append, taken under the file lock (now if not given)
+        :return: None
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            signature = signature if signature is not None else file_signature(path)
+
+            # somebody else has touched the file in the meantime, a reload is due anyway
+            if entry is None or signature is None or entry[0] != previous_signature:
+                self._entries.pop(path, None)
+                return
+
+            self._entries[path] = (signature, entry[1], [*entry[2], row])
+
+    def invalidate(self, path: str | None = None) -> None:
+        """
+        Drop one entry or, if no path is passed, the whole cache
+        :param path: Path to the db
+        :return: None
+        """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+# one cache per process
+DB_CACHE = DBCache()
@@ -1,27 +1,79 @@
 # Server related
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-from fastapi import Request
-
-# parsing & IO
-from pandas import DataFrame, concat
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import HTTPException, Request, Response
 
 # for getting the db filepath
 from os import environ
 
+# concurrency related
+from asyncio import wrap_future
+from contextlib import asynccontextmanager
+
+# parsing related
+from pandas import Timestamp
+from itertools import chain
+
 # utility functions / objects
 from db_handler.utility import (
     GetPayload,
     CommitPayload,
+    BatchCommitPayload,
+    ExportPayload,
     validate_columns,
+    validate_batch,
     validate_post_data,
-    load_db
+    validate_get_data,
+    decode_cursor,
+    entity_tag,
+    etag_matches,
+    paginate,
+    to_payload
+)
+from db_handler.schema import validate_values
+from common.instrumentation import instrument
+from db_handler.cache import DB_CACHE
+from db_handler.storage import get_storage
+from db_handler.writer import Writer
+from db_handler.streaming import (
+    ARROW_AVAILABLE, ARROW_STREAM, NDJSON, negotiate, ndjson_chunks, arrow_chunks, export_ndjson, export_arrow
 )
 
-app = FastAPI()
 PATH = environ["INTERNAL_DB_PATH"]
 
+# "csv" (default), "parquet" or "sqlite", parquet expects INTERNAL_DB_PATH to be a directory
+BACKEND = environ.get("INTERNAL_DB_BACKEND", "csv")
+
+# csv only: "append" - add a single line per commit (default), "rewrite" - rewrite the whole file per commit
+COMMIT_MODE = environ.get("INTERNAL_COMMIT_MODE", "append")
+
+# "shared" (default) - one table for everybody, "per_user" - INTERNAL_DB_PATH is a directory with a partition per user
+LAYOUT = environ.get("INTERNAL_DB_LAYOUT", "shared")
+
+# sqlite only: connections per worker process
+POOL_SIZE = int(environ.get("DB_POOL_SIZE", 4))
+
+STORAGE = get_storage(PATH, BACKEND, COMMIT_MODE, LAYOUT, POOL_SIZE)
+
+# milliseconds the writer waits for more commits to merge into a single write, 0 writes as soon as possible
+GROUP_COMMIT_MS = float(environ.get("DB_GROUP_COMMIT_MS", 0))
+WRITER = Writer(STORAGE, GROUP_COMMIT_MS / 1000)
+
+# rows per chunk of the streamed /get responses
+STREAM_CHUNK_ROWS = int(environ.get("DB_STREAM_CHUNK_ROWS", 10_000))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # don't drop the queued commits on shutdown
+    WRITER.close()
+
+
+app = FastAPI(lifespan=lifespan)
+instrument(app, "db_handler")
+
 
 # Override the default handler for pydantic ValidationError's
 @app.exception_handler(RequestValidationError)
@@ -33,51 +85,139 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 
 
 # why: GET requests don't usually accept bodies as a convention
+# sync: a re-parse after a change must not stall the event loop, FastAPI runs it in the thread pool
 @app.post("/get", status_code=200)
-async def get_db(payload: GetPayload) -> dict:
+def get_db(payload: GetPayload, request: Request, response: Response) -> dict:
     """
-    Convert user's data into a json string.
-    :param payload: The JSON payload with fields "user" and "columns"
-    :return: a json like string with the following keys: columns, index, data.
+    Convert user's data into a json string, or stream it as NDJSON / Arrow IPC as per the Accept header.
+    Every response carries an ETag, derived from the user's data version: a request with a matching
+    If-None-Match is answered 304 without reading the database. The number of the user's rows comes along.
+    :param payload: The JSON payload with fields "user", "columns", "since", "until", "limit" and "cursor"
+    :param request: The raw request, for the Accept and If-None-Match headers
+    :param response: The response, for the ETag of the JSON one
+    :return: a json like string with the following keys: columns, index, data, next_cursor.
+    :raises 304: if the client's copy is current
     """
-    db = load_db(PATH)
-    validate_columns(payload, tuple(db.columns))
-
-    # in the GetPayload the columns are optional
-    columns = payload.columns or db.columns
+    media_type = negotiate(request.headers.get("accept"))
+    validate_columns(payload, STORAGE.columns())
+    validate_get_data(payload)
+
+    # taken before the load: a commit in between only costs the client one more fetch, never a stale copy
+    version = STORAGE.version(payload.user)
+    rows = str(STORAGE.rows(payload.user))
+    etag = entity_tag(version, payload, media_type)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "X-Data-Version": version, "X-Data-Rows": rows})
+
+    since = Timestamp(payload.since) if payload.since is not None else None
+    until = Timestamp(payload.until) if payload.until is not None else None
+    headers = {"ETag": etag, "X-Data-Version": version, "X-Data-Rows": rows}
+
+    if media_type == ARROW_STREAM and not ARROW_AVAILABLE:
+        raise HTTPException(status_code=406, detail=f"{ARROW_STREAM} is not available, pyarrow is not installed")
+    if media_type != "application/json" and payload.limit is None and payload.cursor is None:
+        # a whole range, streamed as it is read: only one chunk of it is in memory at a time
+        chunks = STORAGE.iter_load(payload.user, payload.columns, since, until, STREAM_CHUNK_ROWS)
+        # the first chunk is read before the response starts, a 204/404/500 still gets its status
+        chunks = chain([next(chunks)], chunks)
+        serialize = ndjson_chunks if media_type == NDJSON else arrow_chunks
+        return StreamingResponse(serialize(chunks, STREAM_CHUNK_ROWS), media_type=media_type, headers=headers)
+
+    # the storage only has to read from where the previous page stopped
+    load_since, skip = since, 0
+    if payload.cursor is not None:
+        position, skip = decode_cursor(payload.cursor)
+        load_since = position if since is None else max(since, position)
+
+    # and only up to the end of the page: the rows of the cursor's datetime already returned, the page,
+    # plus one telling whether there is a next page
+    load_limit = skip + payload.limit + 1 if payload.limit is not None else None
+
+    # in the GetPayload the columns are optional, only the requested ones are read
+    db = STORAGE.load(payload.user, columns=payload.columns, since=load_since, until=until, limit=load_limit)
+    page, next_cursor = paginate(db, since, until, payload.limit, payload.cursor)
+
+    if media_type == "application/json":
+        response.headers["ETag"] = etag
+        response.headers["X-Data-Version"] = version
+        response.headers["X-Data-Rows"] = rows
+        return {**to_payload(page), "next_cursor": next_cursor}
+
+    # a streamed page: the rows are serialized chunk by chunk, the cursor travels in a header
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+    if media_type == NDJSON:
+        return StreamingResponse(ndjson_chunks(page, STREAM_CHUNK_ROWS), media_type=NDJSON, headers=headers)
+    return StreamingResponse(arrow_chunks(page, STREAM_CHUNK_ROWS), media_type=ARROW_STREAM, headers=headers)
+
+
+@app.post("/export", status_code=200)
+def export_db(payload: ExportPayload, request: Request) -> StreamingResponse:
+    """
+    Stream the data of many users in a single pass over the database, one user after the other,
+    as an Arrow IPC stream (default) or NDJSON as per the Accept header, each row along with its user.
+    :param payload: The JSON payload with the optional fields "users" and "columns"
+    :param request: The raw request, for the Accept header
+    :return: the stream
+    :raises 400: if a column is unknown or the database doesn't tell users apart
+    :raises 406: if Arrow is asked for but pyarrow is not installed
+    """
+    media_type = negotiate(request.headers.get("accept"))
+    validate_columns(payload, STORAGE.columns())
+    # before the stream starts, afterwards an error can't change the status anymore
+    users = [user for user in STORAGE.users() if payload.users is None or user in payload.users]
+    # read chunk by chunk as the stream goes, never a whole user at once
+    groups = STORAGE.groups(users, payload.columns, chunk_rows=STREAM_CHUNK_ROWS)
 
-    return db.loc[:, columns].to_dict(orient="split")
+    if media_type == NDJSON:
+        return StreamingResponse(export_ndjson(groups, STREAM_CHUNK_ROWS), media_type=NDJSON)
+    if not ARROW_AVAILABLE:
+        raise HTTPException(status_code=406, detail=f"{ARROW_STREAM} is not available, pyarrow is not installed")
+    return StreamingResponse(export_arrow(groups, STREAM_CHUNK_ROWS), media_type=ARROW_STREAM)
 
 
-# Not async to avoid race conditions
+# the writes themselves are serialized by the writer thread, the request only waits for its own
 @app.post("/commit", status_code=201)
-def commit_db(payload: CommitPayload) -> None:
+async def commit_db(payload: CommitPayload) -> None:
     """
     Commit a change into the database
     :param payload: JSON as per the docs.md
     :return: 201 if success
     :raises 400, 500, 204: Same as load_db and validate_columns
     """
-    db = load_db(PATH)
-    validate_columns(payload, tuple(db.columns))
+    validate_columns(payload, STORAGE.columns())
     validate_post_data(payload)
-
-    new_row = DataFrame(payload.data, index=[payload.datetime])
-    db = concat([db, new_row])
+    validate_values(payload.data)
 
     # for purposes of testing the commit endpoints prevent writing into the db
     if eval(environ["DEBUG"]): return
 
-    db.to_csv(PATH, index=True, index_label="datetime")
+    await wrap_future(WRITER.submit(payload.user, [(payload.datetime, payload.data)]))
     return
 
 
+@app.post("/commit/batch", status_code=201)
+async def commit_batch_db(payload: BatchCommitPayload) -> dict:
+    """
+    Commit many rows of a user at once, e.g. for imports and backfills
+    :param payload: JSON as per the docs.md
+    :return: 201 and the number of committed rows if success
+    :raises 400, 500, 204: Same as load_db and validate_batch, nothing is committed if any row is bad
+    """
+    validate_batch(payload, STORAGE.columns())
+
+    if eval(environ["DEBUG"]): return {"rows": 0}
+
+    await wrap_future(WRITER.submit(payload.user, [(row.datetime, row.data) for row in payload.rows]))
+    return {"rows": len(payload.rows)}
+
+
 @app.get("/healthcheck", status_code=200)
-async def heath_check_db() -> dict:
+def heath_check_db(deep: bool = False) -> dict:
     """
-    Do a db healthcheck by importing it
-    :return: 200 if success
+    Do a db healthcheck from the metadata record, kept up to date by the commits, without reading the db
+    :param deep: do a full integrity scan of the db instead, and repair the metadata record if it is off
+    :return: 200 if success, along with the cache and writer counters
     :raises 500, 204: same as load_db
     """
-    db = load_db(PATH)
-    return {"columns": len(db.columns), "rows": len(db)}
+    return {**STORAGE.summary(deep), "cache": DB_CACHE.stats(), "writer": WRITER.stats()}
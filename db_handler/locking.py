@@ -0,0 +1,71 @@
+# concurrency related
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_SH, LOCK_UN
+from threading import Lock, RLock, local
+
+# typing related
+from typing import Dict, Iterator
+
+
+class FileLock:
+    """
+    Cross-process reader / writer lock on a database, backed by flock(2) on a "<path>.lock" sibling file.
+    Exclusive sections are re-entrant within a thread (append_rows calls repair_tail, both lock),
+    and a thread holding the exclusive lock may read without asking for the shared one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path + ".lock"
+        self._thread_lock = RLock()
+        self._local = local()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        with self._thread_lock:
+            depth = getattr(self._local, "depth", 0)
+            if depth == 0:
+                self._local.file = open(self.path, mode="a")
+                flock(self._local.file.fileno(), LOCK_EX)
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+                if self._local.depth == 0:
+                    flock(self._local.file.fileno(), LOCK_UN)
+                    self._local.file.close()
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        if getattr(self._local, "depth", 0) > 0:
+            yield
+            return
+
+        try:
+            f = open(self.path, mode="a")
+        except OSError:
+            # e.g. a read-only mount: nobody can write there either
+            yield
+            return
+
+        with f:
+            flock(f.fileno(), LOCK_SH)
+            try:
+                yield
+            finally:
+                flock(f.fileno(), LOCK_UN)
+
+
+_LOCKS: Dict[str, FileLock] = {}
+_LOCKS_LOCK = Lock()
+
+
+def lock_for(path: str) -> FileLock:
+    """
+    :param path: Path to the db (file or directory)
+    :return: the one FileLock of the process for that path
+    """
+    with _LOCKS_LOCK:
+        if path not in _LOCKS:
+            _LOCKS[path] = FileLock(path)
+        return _LOCKS[path]
@@ -0,0 +1,48 @@
+# IO related
+from os import fsync, replace
+import json
+from time import gmtime, strftime
+
+# typing related
+from typing import Tuple
+
+
+def now() -> str:
+    return strftime("%Y-%m-%d %H:%M:%S", gmtime())
+
+
+def signature_list(signature: Tuple[int, ...] | None) -> list | None:
+    # json has no tuples, the signatures are compared as stored
+    return list(signature) if signature is not None else None
+
+
+class MetadataStore:
+    """
+    Small JSON record next to a database ("<path>.meta.json"), describing it without reading it:
+    {"rows": int, "columns": [...], "last_commit": "Y-m-d H:M:S" (UTC) | None, "version": int, "signature": [...] | None}
+
+    "version" grows with every change of the content, "signature" is the file signature of the database
+    the record was made for, so that changes made behind the back of the storage are detected.
+    Written under the exclusive lock of the database, read without any (the file is replaced atomically).
+    """
+
+    def __init__(self, path: str):
+        self.path = path + ".meta.json"
+
+    def read(self) -> dict | None:
+        """
+        :return: the record, None if there is none or it is unreadable
+        """
+        try:
+            with open(self.path, mode="r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, record: dict) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, mode="w") as f:
+            json.dump(record, f)
+            f.flush()
+            fsync(f.fileno())
+        replace(tmp, self.path)
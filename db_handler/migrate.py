@@ -0,0 +1,58 @@
+"""
+One-shot migrations of the CSV database.
+
+Into the parquet backend:
+python -m db_handler.migrate --source /db/db.csv --target /db/db.parquet
+Afterwards point INTERNAL_DB_PATH to the target and set INTERNAL_DB_BACKEND=parquet
+
+Into the per-user layout, the rows of the source are assigned to the passed user:
+python -m db_handler.migrate --source /db/db.csv --target /db/users --user <user-name> [--backend csv|parquet]
+Afterwards point INTERNAL_DB_PATH to the target and set INTERNAL_DB_LAYOUT=per_user
+
+Into the sqlite backend, the rows of the source are assigned to the passed user (the database is created if missing):
+python -m db_handler.migrate --source /db/db.csv --target /db/db.sqlite --user <user-name> --backend sqlite
+Afterwards point INTERNAL_DB_PATH to the target and set INTERNAL_DB_BACKEND=sqlite
+The csv accepts several rows with the same datetime, sqlite doesn't: they are listed and nothing is migrated.
+"""
+import argparse
+import sys
+from os import path as os_path
+
+from fastapi import HTTPException
+
+from db_handler.utility import load_db
+from db_handler.storage import BACKENDS, ParquetStorage, PartitionedStorage, SQLiteStorage
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate the CSV database into another backend or layout")
+    parser.add_argument("--source", "-s", required=True, dest="source", metavar="csv-path")
+    parser.add_argument("--target", "-t", required=True, dest="target", metavar="directory")
+    parser.add_argument("--user", "-u", default=None, dest="user", metavar="user-name")
+    parser.add_argument("--backend", "-b", default="parquet", choices=BACKENDS, dest="backend")
+    args = vars(parser.parse_args())
+
+    if args["backend"] == "sqlite" and args["user"] is None:
+        parser.error("--backend sqlite needs a --user")
+
+    db = load_db(args["source"])
+    if args["backend"] == "sqlite":
+        duplicates = db.index[db.index.duplicated()].unique()
+        if len(duplicates):
+            print(f"Nothing migrated, {len(duplicates)} datetimes have several rows in {args['source']}, "
+                  f"keep one of each:", *(str(dt) for dt in duplicates), sep="\n", file=sys.stderr)
+            sys.exit(1)
+        try:
+            SQLiteStorage.from_frame(db, args["target"], args["user"])
+        except HTTPException as err:
+            print(f"Nothing migrated: {err.detail}", file=sys.stderr)
+            sys.exit(1)
+    elif args["user"] is None:
+        ParquetStorage.from_frame(db, args["target"])
+    else:
+        if os_path.exists(os_path.join(args["target"], PartitionedStorage.INDEX)):
+            storage = PartitionedStorage(args["target"], args["backend"])
+        else:
+            storage = PartitionedStorage.init(args["target"], tuple(db.columns), args["backend"])
+        storage.import_frame(args["user"], db)
+
+    print(f"Migrated {len(db)} rows and {len(db.columns)} columns into {args['target']}")
@@ -0,0 +1,160 @@
+# Network related
+from fastapi import HTTPException
+
+# parsing related
+from pandas import CategoricalDtype, DataFrame, DatetimeIndex, Series, to_datetime
+from pandas.api.types import is_datetime64_any_dtype, is_extension_array_dtype
+from datetime import datetime
+import numpy as np
+
+# typing related
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+SEASONS = ("winter", "spring", "summer", "autumn")
+WEATHER = (
+    "temperature", "cloud_cover", "humidity", "atm_pressure", "wind_speed", "wind_direction", "feels_like",
+    "rain_intensity", "sleet_intensity", "snow_intensity"
+)
+
+
+def _is_int8(value: Any) -> bool:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return type(value) is int and -128 <= value <= 127
+
+
+def _is_float32(value: Any) -> bool:
+    return type(value) in (int, float) and abs(value) <= np.finfo(np.float32).max
+
+
+def _is_season(value: Any) -> bool:
+    return value in SEASONS
+
+
+def _is_datetime(value: Any) -> bool:
+    try:
+        datetime.strptime(value, DATETIME_FORMAT)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+class Column:
+    """
+    Declared type of a column: the dtype it is kept in and the check every committed value has to pass
+    """
+    __slots__ = ("dtype", "check", "expected")
+
+    def __init__(self, dtype: Any, check: Callable[[Any], bool], expected: str):
+        self.dtype = dtype
+        self.check = check
+        self.expected = expected
+
+
+# the columns written by the daemon. The others are still accepted, their dtypes are left to pandas.
+# day_rank is the nullable Int8: a commit may leave columns empty.
+# Values of a categorical found in the database but not declared (written before the schema) are kept as extra categories
+SCHEMA: Dict[str, Column] = {
+    "day_rank": Column("Int8", _is_int8, "an integer within [-128; 127]"),
+    "sunrise": Column("datetime64[ns]", _is_datetime, f"a datetime as {DATETIME_FORMAT}"),
+    "sunset": Column("datetime64[ns]", _is_datetime, f"a datetime as {DATETIME_FORMAT}"),
+    "season": Column(CategoricalDtype(SEASONS), _is_season, f"one of {', '.join(SEASONS)}"),
+    **{name: Column("float32", _is_float32, "a number") for name in WEATHER},
+}
+
+
+def read_csv_types(columns: Tuple[str, ...]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    :param columns: Columns of a csv database (as per read_columns)
+    :return: the dtype and parse_dates arguments of read_csv for them. The index is always parsed as datetime.
+    """
+    # categoricals are read with the categories found, cast() orders them as declared
+    dtypes = {name: "category" if isinstance(SCHEMA[name].dtype, CategoricalDtype) else SCHEMA[name].dtype
+              for name in columns if name in SCHEMA and not str(SCHEMA[name].dtype).startswith("datetime")}
+    dates = ["datetime", *(name for name in columns
+                           if name in SCHEMA and str(SCHEMA[name].dtype).startswith("datetime"))]
+    return dtypes, dates
+
+
+def cast(db: DataFrame) -> DataFrame:
+    """
+    Bring the declared columns of a frame to their dtypes, e.g. after a read which inferred them
+    :param db: The frame
+    :return: the frame with its declared columns cast (the same frame if they already are)
+    :raises 400: if a value can't be cast
+    """
+    dtypes = {name: SCHEMA[name].dtype for name in db.columns
+              if name in SCHEMA and db.dtypes[name] != SCHEMA[name].dtype}
+    if not dtypes:
+        return db
+
+    try:
+        converted = {}
+        for name, dtype in dtypes.items():
+            if isinstance(dtype, CategoricalDtype):
+                converted[name] = _categorical(db[name], dtype)
+            elif str(dtype).startswith("datetime"):
+                converted[name] = to_datetime(db[name], format="ISO8601")
+            else:
+                converted[name] = db[name].astype(dtype)
+        return db.assign(**converted)
+    except (TypeError, ValueError) as err:
+        raise HTTPException(
+            status_code=400,
+            detail=f"The data does not match the column types: {type(err).__name__} - {err}"
+        )
+
+
+def _categorical(column: Series, dtype: CategoricalDtype) -> Series:
+    present = column.cat.categories if isinstance(column.dtype, CategoricalDtype) else column.dropna().unique()
+    extra = sorted(str(value) for value in present if value not in dtype.categories)
+    return column.astype(CategoricalDtype([*dtype.categories, *extra]) if extra else dtype)
+
+
+def check_values(rows: Iterable[Tuple[int, Dict[str, Union[int, float, str]]]]) -> List[str]:
+    """
+    Check committed values against the declared column types, in a single pass over the rows
+    :param rows: (row number, column -> value) pairs
+    :return: one message per bad value, empty if all are good
+    """
+    errors = []
+    for i, data in rows:
+        for name, value in data.items():
+            column = SCHEMA.get(name)
+            if column is not None and not column.check(value):
+                errors.append(f"row {i}: {name} expects {column.expected}, got {value!r}")
+    return errors
+
+
+def validate_values(data: Dict[str, Union[int, float, str]]) -> None:
+    """
+    :param data: column -> value of a single commit
+    :return: None
+    :raises 400: if a value doesn't match the declared type of its column
+    """
+    errors = [error.removeprefix("row 0: ") for error in check_values([(0, data)])]
+    if errors:
+        raise HTTPException(status_code=400, detail=f"Values don't match the schema: {'; '.join(errors)}")
+
+
+def plain(db: DataFrame) -> DataFrame:
+    """
+    JSON friendly copy of a (partial) database: datetimes as strings, float32 as the float64 of their
+    shortest representation (14.2 and not 14.199999809265137), categoricals and nullable integers as objects, NA as None
+    :param db: The frame
+    :return: the converted frame, with a string index if it was a DatetimeIndex
+    """
+    if isinstance(db.index, DatetimeIndex):
+        db = db.set_axis(db.index.strftime(DATETIME_FORMAT), axis="index")
+
+    converted = {}
+    for name, dtype in db.dtypes.items():
+        column = db[name]
+        if is_datetime64_any_dtype(dtype):
+            converted[name] = column.dt.strftime(DATETIME_FORMAT).astype(object).where(column.notna(), None)
+        elif dtype == np.float32:
+            converted[name] = Series(column.to_numpy().astype(str), index=column.index).astype("float64")
+        elif is_extension_array_dtype(dtype):
+            converted[name] = column.astype(object).where(column.notna(), None)
+    return db.assign(**converted) if converted else db
@@ -0,0 +1,1204 @@
+# Network related
+from fastapi import HTTPException
+
+# parsing related
+from pandas import DataFrame, Timestamp, concat, to_datetime
+
+# IO related
+from os import fsync, listdir, makedirs, path as os_path, remove, replace, stat
+import json
+import logging
+from hashlib import sha1
+from time import time
+
+# embedded database related
+import sqlite3
+from queue import Empty, Queue
+from contextlib import contextmanager
+
+# typing related
+from typing import Dict, Iterator, List, Tuple, Union
+
+# utility functions / objects
+from db_handler.utility import append_rows, load_db, read_columns, index_by_datetime, paginate
+from db_handler.locking import lock_for
+from db_handler.cache import DB_CACHE, file_signature
+from db_handler.metadata import MetadataStore, now, signature_list
+from db_handler.schema import cast, plain
+
+BACKENDS = ("csv", "parquet", "sqlite")
+
+LOGGER = logging.getLogger(__name__)
+
+# numbers of fragments after which the parquet dataset is merged into a single file
+COMPACT_AFTER = 64
+ROW_GROUP_SIZE = 65_536
+
+# seconds for which the files replaced by a compaction are kept for the readers of the previous manifest
+GC_GRACE = 60
+
+# sqlite: seconds a request waits for a pooled connection before giving up with 503
+POOL_TIMEOUT = 30.0
+
+
+class Rejected(HTTPException):
+    """
+    The rows were refused before anything was written (a value doesn't fit its column, a datetime is taken):
+    the commit failed as a whole, the other rows of a group may be written without it
+    """
+
+
+class Storage:
+    """
+    Interface of a database backend. All endpoints talk to the database through it.
+    Frames returned by load() are indexed by "datetime" and must be treated as read-only.
+    Single-table backends ignore the user, PartitionedStorage routes on it.
+    """
+
+    def columns(self) -> Tuple[str, ...]:
+        """
+        :return: the columns of the database, without the index
+        """
+        raise NotImplementedError
+
+    def load(self, user: str | None = None, columns: List[str] | None = None,
+             since: Timestamp | None = None, until: Timestamp | None = None, limit: int | None = None) -> DataFrame:
+        """
+        :param user: whose rows to load
+        :param columns: project only these columns, all if None or empty
+        :param since: only rows with datetime >= since
+        :param until: only rows with datetime < until
+        :param limit: only the first rows by datetime, read without going through the rest where the backend allows
+        :return: pandas DataFrame of the (partial) database with a sorted DatetimeIndex
+        :raises 500: if the database can't be read
+        :raises 204: if the database is empty
+        """
+        raise NotImplementedError
+
+    def iter_load(self, user: str | None = None, columns: List[str] | None = None, since: Timestamp | None = None,
+                  until: Timestamp | None = None, chunk_rows: int = 10_000) -> Iterator[DataFrame]:
+        """
+        The rows of load(), read chunk by chunk where the backend allows, so that the memory needed
+        is bounded by the chunk rather than the whole result
+        :param chunk_rows: rows per chunk (a chunk may be a bit longer, see ParquetStorage)
+        :return: iterator over the chunks, in datetime order; a single empty one if there are no rows
+        :raises 500, 204: same as load, by the first next()
+        """
+        db = self.load(user, columns, since, until)
+        # slices of the frame, which is shared (the process cache): nothing is copied
+        for start in range(0, max(len(db), 1), chunk_rows):
+            yield db.iloc[start:start + chunk_rows]
+
+    def users(self) -> List[str]:
+        """
+        :return: the users with data, sorted
+        :raises 400: if the storage doesn't tell users apart (the shared csv and parquet files)
+        """
+        raise HTTPException(
+            status_code=400,
+            detail="The shared database doesn't tell users apart, use the sqlite backend or the per_user layout"
+        )
+
+    def groups(self, users: List[str] | None = None, columns: List[str] | None = None,
+               chunk_rows: int | None = None) -> Iterator[Tuple[str, DataFrame]]:
+        """
+        Every user's data, one user after the other: a single pass over the database
+        :param users: only these users, all of them if None. Unknown ones are skipped.
+        :param columns: only these columns, all of them if None
+        :param chunk_rows: read each user's data in chunks of that many rows (see iter_load), several pairs per user;
+        None for a single frame per user
+        :return: iterator over (user, their data as per load) pairs, users without rows are skipped
+        :raises 400: same as users
+        :raises 500: same as load
+        """
+        known = set(self.users())
+        for user in sorted(known.intersection(users)) if users is not None else sorted(known):
+            chunks = None
+            try:
+                if chunk_rows:
+                    chunks = self.iter_load(user, columns, chunk_rows=chunk_rows)
+                    first = next(chunks)
+                else:
+                    first = self.load(user, columns)
+            except HTTPException as err:
+                if err.status_code not in (204, 404):
+                    raise
+                continue
+            if first.empty:
+                continue
+            yield user, first
+            for chunk in chunks or ():
+                yield user, chunk
+
+    def append(self, user: str | None, index: str, data: Dict[str, Union[int, float, str]]) -> None:
+        """
+        Persist a single, already validated row
+        :param user: whose row it is
+        :param index: The datetime of the row
+        :param data: column -> value
+        :return: None
+        :raises 500: if the write failed
+        """
+        self.append_many(user, [(index, data)])
+
+    def append_many(self, user: str | None, rows: List[Tuple[str, Dict[str, Union[int, float, str]]]]) -> None:
+        """
+        Persist many already validated rows in one write
+        :param user: whose rows these are
+        :param rows: (datetime, column -> value) pairs
+        :return: None
+        :raises Rejected: if the rows were refused, nothing is written then
+        :raises 500: if the write failed, some rows may be on disk
+        """
+        raise NotImplementedError
+
+    # metadata related. Backends with a path on disk implement _signature() and get the rest
+
+    def _signature(self) -> list | None:
+        """
+        :return: fingerprint of the database on disk, changes with every write
+        """
+        raise NotImplementedError
+
+    def _scan(self) -> DataFrame:
+        """
+        :return: the whole database read from disk, bypassing any cache
+        """
+        return self.load()
+
+    def _metadata_store(self) -> MetadataStore:
+        return MetadataStore(self.path)
+
+    def _rebuild_metadata(self, previous: dict | None, db: DataFrame | None = None) -> dict:
+        # under the exclusive lock of the database, by a full scan
+        if db is None:
+            try:
+                db = self._scan()
+            except HTTPException as err:
+                if err.status_code != 204:
+                    raise
+                db = DataFrame()
+
+        return {
+            "rows": len(db),
+            "columns": list(self.columns()),
+            "last_commit": previous["last_commit"] if previous else None,
+            "version": previous["version"] + 1 if previous else 1,
+            "signature": self._signature(),
+        }
+
+    def _record_commit(self, previous_signature: list | None, rows: int) -> None:
+        """
+        Account a commit in the metadata record, O(1) unless the record was already out of date
+        Call under the exclusive lock of the database, right after the write.
+        :param previous_signature: _signature() before the write
+        :param rows: number of rows written
+        :return: None
+        """
+        store = self._metadata_store()
+        record = store.read()
+        if record is None or record["signature"] != previous_signature:
+            # somebody else changed the database before: only a scan tells where it is now
+            record = self._rebuild_metadata(record)
+        else:
+            record = {**record, "rows": record["rows"] + rows, "version": record["version"] + 1,
+                      "signature": self._signature()}
+        store.write({**record, "last_commit": now()})
+
+    def metadata(self) -> dict:
+        """
+        Row count, columns, last commit and content version of the database, read from the metadata record.
+        The record is rebuilt by a full scan only if it is missing or the database changed behind the storage's back.
+        :return: the record, see MetadataStore
+        :raises 500: if the database can't be read for the rebuild
+        """
+        store = self._metadata_store()
+        record = store.read()
+        if record is None or record["signature"] != self._signature():
+            with lock_for(self.path).exclusive():
+                record = store.read()
+                if record is None or record["signature"] != self._signature():
+                    record = self._rebuild_metadata(record)
+                    store.write(record)
+        return record
+
+    def version(self, user: str | None = None) -> str:
+        """
+        Opaque token of the content a load of the user would return, changed by every commit which may change it.
+        Answered from the metadata record, without reading the database.
+        :param user: The user, the storages shared by everybody change their version with any commit
+        :return: the token, e.g. for an ETag
+        :raises 500: same as metadata
+        """
+        record = self.metadata()
+        # the signature tells apart two databases whose records restarted from the same version
+        return ":".join(map(str, [record["version"], *(record.get("signature") or [])]))
+
+    def rows(self, user: str | None = None) -> int:
+        """
+        Number of rows a load of the user would return, answered from the metadata record like version.
+        Tells a client keeping a running state that rows were committed before the latest datetime it has seen.
+        :param user: The user, the storages shared by everybody count all the rows
+        :return: the number of rows
+        :raises 500: same as metadata
+        """
+        return self.metadata()["rows"]
+
+    def check(self) -> dict:
+        """
+        Full integrity scan: read the whole database from disk and compare it to the metadata record,
+        which is repaired if it doesn't match
+        :return: the record, plus the number of duplicated datetimes and whether the record was right
+        :raises 500: if the database can't be read
+        """
+        with lock_for(self.path).exclusive():
+            store = self._metadata_store()
+            record = store.read()
+            try:
+                db = self._scan()
+            except HTTPException as err:
+                if err.status_code != 204:
+                    raise
+                db = DataFrame()
+
+            consistent = (record is not None and record["signature"] == self._signature()
+                          and record["rows"] == len(db) and record["columns"] == list(self.columns()))
+            if not consistent:
+                record = self._rebuild_metadata(record, db)
+                store.write(record)
+
+        return {**record, "duplicates": int(db.index.duplicated().sum()), "consistent": consistent}
+
+    def summary(self, deep: bool = False) -> dict:
+        """
+        :param deep: answer from a full integrity scan (check) instead of the metadata record
+        :return: number of columns and rows, column names, last commit and content version of the database
+        :raises 204: if the database is empty
+        :raises 500: same as load
+        """
+        report = self.check() if deep else self.metadata()
+        if not report["rows"]:
+            raise HTTPException(status_code=204, detail="The database is empty")
+
+        summary = {key: value for key, value in report.items() if key not in ("columns", "signature")}
+        return {"columns": len(report["columns"]), "column_names": report["columns"], **summary}
+
+
+def rows_to_frame(rows: List[Tuple[str, Dict[str, Union[int, float, str]]]]) -> DataFrame:
+    # typed as declared, so that merging them into a loaded database keeps its dtypes
+    return cast(DataFrame([data for _, data in rows], index=[index for index, _ in rows]))
+
+
+class CSVStorage(Storage):
+    """
+    The CSV file at INTERNAL_DB_PATH, parsed as a whole and kept in the process cache
+    """
+
+    def __init__(self, path: str, commit_mode: str = "append"):
+        if commit_mode not in ("append", "rewrite"):
+            raise ValueError(f"Invalid commit mode '{commit_mode}', expected 'append' or 'rewrite'")
+        self.path = path
+        self.commit_mode = commit_mode
+
+    def columns(self) -> Tuple[str, ...]:
+        # only the header is needed, the rows are never touched
+        return read_columns(self.path)
+
+    def _signature(self) -> list | None:
+        return signature_list(file_signature(self.path))
+
+    def _scan(self) -> DataFrame:
+        return index_by_datetime(load_db(self.path))
+
+    def load(self, user: str | None = None, columns: List[str] | None = None,
+             since: Timestamp | None = None, until: Timestamp | None = None, limit: int | None = None) -> DataFrame:
+        db = DB_CACHE.get(self.path)
+        if since is not None or until is not None:
+            db, _ = paginate(db, since, until)
+        if limit is not None:
+            db = db.iloc[:limit]
+        return db.loc[:, columns] if columns else db
+
+    def append_many(self, user: str | None, rows: List[Tuple[str, Dict[str, Union[int, float, str]]]]) -> None:
+        # all the columns, typed: merged into the cached frame without changing its dtypes
+        new_rows = cast(rows_to_frame(rows).reindex(columns=self.columns()))
+
+        # the cache is updated after the file lock is released: a reader holds the cache's lock
+        # while it waits for the file lock, taking them the other way round would deadlock
+        if self.commit_mode == "rewrite":
+            # legacy: load the whole database, add the rows and write everything back. O(N) per commit.
+            with lock_for(self.path).exclusive():
+                previous_signature = self._signature()
+                db = concat([DB_CACHE.get(self.path), index_by_datetime(new_rows)])
+                self._rewrite(db)
+                signature = file_signature(self.path)
+                self._record_commit(previous_signature, len(rows))
+
+            # the next read is served from memory instead of re-parsing what was just written
+            DB_CACHE.put(self.path, db, signature)
+            return
+
+        with lock_for(self.path).exclusive():
+            previous_signature = file_signature(self.path)
+            append_rows(self.path, rows, self.columns())
+            signature = file_signature(self.path)
+            self._record_commit(signature_list(previous_signature), len(rows))
+        DB_CACHE.extend(self.path, previous_signature, new_rows, signature)
+
+    def _rewrite(self, db: DataFrame) -> None:
+        # a crash mid-write leaves the previous file in place, never a half-written one
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, mode="w", newline="") as f:
+                db.to_csv(f, index=True, index_label="datetime")
+                f.flush()
+                fsync(f.fileno())
+            replace(tmp, self.path)
+        except Exception as err:
+            raise HTTPException(
+                status_code=500,
+                detail="An error occurred while writing to the database:\n"
+                       f"{type(err).__name__} - {err}"
+            )
+
+
+class ParquetStorage(Storage):
+    """
+    A directory of parquet files, listed in a manifest.json.
+    A commit writes one small fragment and swaps the manifest atomically, so a crash never exposes a partial write.
+    Once there are COMPACT_AFTER fragments, they are merged into a single file sorted by datetime,
+    whose row group statistics let reads skip everything outside the requested time range.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, path: str):
+        # an optional dependency, only needed if this backend is selected
+        try:
+            import pyarrow
+            import pyarrow.dataset
+            import pyarrow.parquet
+        except ImportError as err:
+            raise ImportError("The parquet backend requires pyarrow, see requirements.txt") from err
+
+        self._pa = pyarrow
+        self._ds = pyarrow.dataset
+        self._pq = pyarrow.parquet
+        self.path = path
+
+    # manifest related
+
+    def _manifest(self) -> dict:
+        try:
+            with open(os_path.join(self.path, self.MANIFEST), mode="r") as f:
+                return json.load(f)
+        except Exception as err:
+            raise HTTPException(
+                status_code=500,
+                detail="An error occurred while importing the database:\n"
+                       f"{type(err).__name__} - {err}"
+            )
+
+    def _write_manifest(self, manifest: dict) -> None:
+        tmp = os_path.join(self.path, self.MANIFEST + ".tmp")
+        with open(tmp, mode="w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            fsync(f.fileno())
+        replace(tmp, os_path.join(self.path, self.MANIFEST))
+
+    def _write_file(self, table, name: str) -> None:
+        tmp = os_path.join(self.path, name + ".tmp")
+        self._pq.write_table(table, tmp, row_group_size=ROW_GROUP_SIZE)
+        with open(tmp, mode="rb") as f:
+            fsync(f.fileno())
+        replace(tmp, os_path.join(self.path, name))
+
+    def _dataset(self, manifest: dict):
+        files = [os_path.join(self.path, name) for name in manifest["files"]]
+        return self._ds.dataset(files, format="parquet")
+
+    # Storage interface
+
+    def columns(self) -> Tuple[str, ...]:
+        manifest = self._manifest()
+        return tuple(name for name in manifest["schema"] if name != "datetime")
+
+    def _signature(self) -> list | None:
+        # every write swaps the manifest
+        return signature_list(file_signature(os_path.join(self.path, self.MANIFEST)))
+
+    def _condition(self, since: Timestamp | None, until: Timestamp | None):
+        condition = None
+        if since is not None:
+            condition = self._ds.field("datetime") >= since.to_pydatetime()
+        if until is not None:
+            upper = self._ds.field("datetime") < until.to_pydatetime()
+            condition = upper if condition is None else condition & upper
+        return condition
+
+    def _head(self, manifest: dict, columns: List[str] | None, condition, limit: int):
+        """
+        The first `limit` rows by datetime. The first file of the manifest is sorted (written by from_frame or
+        compact): its batches are read in order until there are enough, the row groups after them are never read.
+        The fragments committed since are small, they are read whole.
+        """
+        base, *fragments = manifest["files"]
+        scanner = self._ds.dataset(os_path.join(self.path, base), format="parquet").scanner(
+            columns=columns, filter=condition
+        )
+        batches, rows = [], 0
+        for batch in scanner.to_batches():
+            batches.append(batch)
+            rows += batch.num_rows
+            if rows >= limit:
+                break
+
+        tables = [self._pa.Table.from_batches(batches, schema=scanner.projected_schema)]
+        if fragments:
+            files = [os_path.join(self.path, name) for name in fragments]
+            tables.append(self._ds.dataset(files, format="parquet").to_table(columns=columns, filter=condition))
+        return self._pa.concat_tables(tables).sort_by("datetime").slice(0, limit)
+
+    @staticmethod
+    def _frame(table) -> DataFrame:
+        return index_by_datetime(cast(table.to_pandas(ignore_metadata=True).set_index("datetime")))
+
+    def iter_load(self, user: str | None = None, columns: List[str] | None = None, since: Timestamp | None = None,
+                  until: Timestamp | None = None, chunk_rows: int = 10_000) -> Iterator[DataFrame]:
+        # the sorted base file batch by batch, the few rows of the fragments merged into the batches they fall in
+        manifest = self._manifest()
+        if not manifest["files"]:
+            raise HTTPException(status_code=204, detail=f"The database at {self.path} is empty")
+        condition = self._condition(since, until)
+        projection = ["datetime", *columns] if columns else None
+
+        base, *fragments = manifest["files"]
+        try:
+            scanner = self._ds.dataset(os_path.join(self.path, base), format="parquet").scanner(
+                columns=projection, filter=condition, batch_size=chunk_rows
+            )
+            if fragments:
+                files = [os_path.join(self.path, name) for name in fragments]
+                pending = self._frame(self._ds.dataset(files, format="parquet").to_table(columns=projection,
+                                                                                        filter=condition))
+            else:
+                pending = self._frame(scanner.projected_schema.empty_table())
+            batches = (self._frame(self._pa.Table.from_batches([batch], schema=scanner.projected_schema))
+                       for batch in scanner.to_batches() if batch.num_rows)
+            db = next(batches, None)
+        except Exception as err:
+            raise HTTPException(
+                status_code=500,
+                detail="An error occurred while importing the database:\n"
+                       f"{type(err).__name__} - {err}"
+            )
+
+        if db is None and pending.empty and since is None and until is None:
+            raise HTTPException(status_code=204, detail=f"The database at {self.path} is empty")
+
+        yielded = False
+        while db is not None:
+            # the fragments' rows before the batch's last datetime; those at it come after the base's, as in load()
+            cut = pending.index.searchsorted(db.index[-1], side="left")
+            if cut:
+                db, pending = index_by_datetime(concat([db, pending.iloc[:cut]])), pending.iloc[cut:]
+            yield db
+            yielded = True
+            db = next(batches, None)
+        if not pending.empty or not yielded:
+            yield pending
+
+    def load(self, user: str | None = None, columns: List[str] | None = None,
+             since: Timestamp | None = None, until: Timestamp | None = None, limit: int | None = None) -> DataFrame:
+        manifest = self._manifest()
+        condition = self._condition(since, until)
+        projection = ["datetime", *columns] if columns else None
+
+        try:
+            if limit is not None and manifest["files"]:
+                table = self._head(manifest, projection, condition, limit)
+            else:
+                table = self._dataset(manifest).to_table(columns=projection, filter=condition)
+            db = self._frame(table)
+        except Exception as err:
+            raise HTTPException(
+                status_code=500,
+                detail="An error occurred while importing the database:\n"
+                       f"{type(err).__name__} - {err}"
+            )
+
+        if not manifest["files"] or (db.empty and since is None and until is None):
+            raise HTTPException(status_code=204, detail=f"The database at {self.path} is empty")
+
+        return db
+
+    def append_many(self, user: str | None, rows: List[Tuple[str, Dict[str, Union[int, float, str]]]]) -> None:
+        with lock_for(self.path).exclusive():
+            previous_signature = self._signature()
+            manifest = self._manifest()
+            schema = self._dataset(manifest).schema
+
+            try:
+                frame = cast(rows_to_frame(rows).reindex(columns=[name for name in schema.names if name != "datetime"]))
+                # files written before the schema keep plain strings
+                frame = frame.astype({name: object for name in frame.columns if frame.dtypes[name] == "category"
+                                      and not self._pa.types.is_dictionary(schema.field(name).type)})
+                frame = frame.set_axis(to_datetime(frame.index).rename("datetime"), axis="index").reset_index()
+                table = self._pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+            except (self._pa.ArrowInvalid, self._pa.ArrowTypeError, TypeError, ValueError) as err:
+                raise Rejected(
+                    status_code=400,
+                    detail=f"The data does not match the column types: {type(err).__name__} - {err}"
+                )
+
+            name = f"part-{manifest['next']:08d}.parquet"
+            self._write_file(table, name)
+            manifest = {**manifest, "files": [*manifest["files"], name], "next": manifest["next"] + 1}
+            self._write_manifest(manifest)
+            self._record_commit(previous_signature, len(rows))
+
+        if len(manifest["files"]) >= COMPACT_AFTER:
+            # the commit is saved whatever happens here: a failed compaction only leaves the fragments,
+            # the next commit tries again
+            try:
+                self.compact()
+            except Exception:
+                LOGGER.exception("Compacting the parquet database at %s failed", self.path)
+
+    def compact(self) -> None:
+        """
+        Merge all files into a single one sorted by datetime. Readers keep using the old manifest until the swap.
+        :return: None
+        """
+        with lock_for(self.path).exclusive():
+            manifest = self._manifest()
+            table = self._dataset(manifest).to_table().sort_by("datetime")
+
+            previous_signature = self._signature()
+            name = f"part-{manifest['next']:08d}.parquet"
+            self._write_file(table, name)
+            self._write_manifest({**manifest, "files": [name], "next": manifest["next"] + 1})
+
+            # same content, only the signature of the metadata record moves on
+            store = self._metadata_store()
+            record = store.read()
+            if record is not None and record["signature"] == previous_signature:
+                store.write({**record, "signature": self._signature()})
+
+            # garbage: files which are not in the manifest anymore. Readers don't lock,
+            # so the files are left alone for a while in case somebody still reads an older manifest
+            for old in listdir(self.path):
+                old_path = os_path.join(self.path, old)
+                if old.endswith(".parquet") and old != name and time() - os_path.getmtime(old_path) > GC_GRACE:
+                    remove(old_path)
+
+    @classmethod
+    def from_frame(cls, db: DataFrame, path: str) -> "ParquetStorage":
+        """
+        Create a new parquet database out of a frame indexed by datetime
+        :param db: The data
+        :param path: The directory to create, must not contain a database yet
+        :return: The storage of the new database
+        """
+        storage = cls(path)
+        makedirs(path, exist_ok=True)
+        if os_path.exists(os_path.join(path, cls.MANIFEST)):
+            raise FileExistsError(f"There already is a database at {path}")
+
+        db = db.copy()
+        db.index = to_datetime(db.index)
+        db.index.name = "datetime"
+        table = storage._pa.Table.from_pandas(db.sort_index().reset_index(), preserve_index=False)
+
+        name = "part-00000000.parquet"
+        storage._write_file(table, name)
+        storage._write_manifest({"schema": table.schema.names, "files": [name], "next": 1})
+        return storage
+
+
+class PartitionedStorage(Storage):
+    """
+    One partition (a csv file or a parquet directory) per user under the root directory INTERNAL_DB_PATH,
+    plus an index.json mapping users to partitions and holding the columns shared by all of them,
+    along with the totals of the database (rows, users, last commit, version) updated by every commit.
+    A request only ever touches the partition of its user, so its I/O is proportional to that user's history.
+    """
+
+    INDEX = "index.json"
+
+    def __init__(self, root: str, backend: str = "csv", commit_mode: str = "append"):
+        if backend not in BACKENDS:
+            raise ValueError(f"Invalid backend '{backend}', expected one of {', '.join(BACKENDS)}")
+        if backend == "sqlite":
+            raise ValueError("The sqlite backend is partitioned by its (user, datetime) index already")
+        self.root = root
+        self.backend = backend
+        self.commit_mode = commit_mode
+        self._partitions: Dict[str, Storage] = {}
+
+    # index related
+
+    def _index(self) -> dict:
+        try:
+            with open(os_path.join(self.root, self.INDEX), mode="r") as f:
+                return json.load(f)
+        except Exception as err:
+            raise HTTPException(
+                status_code=500,
+                detail="An error occurred while importing the database index:\n"
+                       f"{type(err).__name__} - {err}"
+            )
+
+    def _write_index(self, index: dict) -> None:
+        tmp = os_path.join(self.root, self.INDEX + ".tmp")
+        with open(tmp, mode="w") as f:
+            json.dump(index, f)
+            f.flush()
+            fsync(f.fileno())
+        replace(tmp, os_path.join(self.root, self.INDEX))
+
+    @staticmethod
+    def partition_name(user: str) -> str:
+        # user names are not trusted as file names
+        return "user-" + sha1(user.encode()).hexdigest()[:16]
+
+    def _path(self, name: str) -> str:
+        return os_path.join(self.root, name + (".csv" if self.backend == "csv" else ".parquet"))
+
+    def partition(self, user: str) -> Storage:
+        """
+        :param user: The user
+        :return: the storage of the user's partition
+        :raises 404: if the user has no partition yet
+        """
+        if user not in self._partitions:
+            name = self._index()["users"].get(user)
+            if name is None:
+                raise HTTPException(status_code=404, detail=f"There is no data for the user {user}")
+            self._partitions[user] = get_storage(self._path(name), self.backend, self.commit_mode)
+        return self._partitions[user]
+
+    def _create(self, user: str, db: DataFrame) -> None:
+        """
+        Create the partition of a new user out of a frame and register it in the index
+        """
+        with lock_for(self.root).exclusive():
+            index = self._index()
+            name = self.partition_name(user)
+            if name in index["users"].values():
+                raise HTTPException(status_code=500, detail=f"Partition name clash for the user {user}")
+            db = db.reindex(columns=index["columns"])
+
+            if self.backend == "csv":
+                db.to_csv(self._path(name), index=True, index_label="datetime")
+            else:
+                ParquetStorage.from_frame(db, self._path(name))
+
+            self._write_index({**index, "users": {**index["users"], user: name}})
+
+            partition = self.partition(user)
+            with lock_for(partition.path).exclusive():
+                partition._record_commit(None, len(db))
+            self._record_totals(len(db), new_users=1)
+
+    # Storage interface
+
+    def columns(self) -> Tuple[str, ...]:
+        return tuple(self._index()["columns"])
+
+    def load(self, user: str | None = None, columns: List[str] | None = None,
+             since: Timestamp | None = None, until: Timestamp | None = None, limit: int | None = None) -> DataFrame:
+        if user is None:
+            raise ValueError("A partitioned database can only be loaded per user")
+        return self.partition(user).load(user, columns, since, until, limit)
+
+    def iter_load(self, user: str | None = None, columns: List[str] | None = None, since: Timestamp | None = None,
+                  until: Timestamp | None = None, chunk_rows: int = 10_000) -> Iterator[DataFrame]:
+        if user is None:
+            raise ValueError("A partitioned database can only be loaded per user")
+        return self.partition(user).iter_load(user, columns, since, until, chunk_rows)
+
+    def append_many(self, user: str | None, rows: List[Tuple[str, Dict[str, Union[int, float, str]]]]) -> None:
+        if user is None:
+            raise ValueError("A partitioned database can only be written per user")
+
+        if user in self._partitions or user in self._index()["users"]:
+            self.partition(user).append_many(user, rows)
+            self._record_totals(len(rows))
+            return
+
+        with lock_for(self.root).exclusive():
+            # another worker may have created it in the meantime
+            if user in self._index()["users"]:
+                self.partition(user).append_many(user, rows)
+                self._record_totals(len(rows))
+                return
+
+            self._create(user, rows_to_frame(rows))
+
+    # the records are kept per partition, so that commits of different users never contend for them,
+    # only the totals in the index are shared: updated once the partition is written and its lock released
+
+    def _record_totals(self, rows: int, new_users: int = 0) -> None:
+        """
+        Account a commit in the totals of the index, O(1) unless they are missing (an index written before them).
+        A crash between the partition's write and this update leaves them behind, check() repairs them.
+        :param rows: number of rows written
+        :param new_users: 1 if the commit created the partition of its user
+        :return: None
+        """
+        with lock_for(self.root).exclusive():
+            index = self._index()
+            totals = index.get("totals")
+            if totals is None:
+                # from the records of the partitions, which already count this commit
+                totals = self._totals(index)
+            else:
+                totals = {"rows": totals["rows"] + rows, "users": totals["users"] + new_users,
+                          "last_commit": now(), "version": totals["version"] + 1}
+            self._write_index({**index, "totals": totals})
+
+    def _totals(self, index: dict) -> dict:
+        record = self._aggregate([self.partition(user).metadata() for user in index["users"]])
+        return {key: value for key, value in record.items() if key != "columns"}
+
+    def _aggregate(self, records: List[dict]) -> dict:
+        return {
+            "rows": sum(record["rows"] for record in records),
+            "columns": list(self.columns()),
+            "users": len(records),
+            "last_commit": max((record["last_commit"] for record in records if record["last_commit"]), default=None),
+            "version": sum(record["version"] for record in records),
+        }
+
+    def metadata(self) -> dict:
+        """
+        Same as Storage.metadata plus the number of users, read from the totals of the index: O(1) in the users
+        """
+        index = self._index()
+        if index.get("totals") is None:
+            with lock_for(self.root).exclusive():
+                index = self._index()
+                if index.get("totals") is None:
+                    index = {**index, "totals": self._totals(index)}
+                    self._write_index(index)
+        return {**index["totals"], "columns": list(index["columns"])}
+
+    def users(self) -> List[str]:
+        return sorted(self._index()["users"])
+
+    def version(self, user: str | None = None) -> str:
+        if user is None:
+            raise ValueError("A partitioned database is only versioned per user")
+        return self.partition(user).version(user)
+
+    def rows(self, user: str | None = None) -> int:
+        if user is None:
+            return self.metadata()["rows"]
+        return self.partition(user).rows(user)
+
+    def check(self) -> dict:
+        """
+        Same as Storage.check, partition by partition, the totals of the index are repaired too
+        """
+        with lock_for(self.root).exclusive():
+            index = self._index()
+            reports = [self.partition(user).check() for user in index["users"]]
+            record = self._aggregate(reports)
+            totals = index.get("totals")
+            consistent = totals is not None and (totals["rows"], totals["users"]) == (record["rows"], record["users"])
+            if not consistent:
+                totals = {"rows": record["rows"], "users": record["users"], "last_commit": record["last_commit"],
+                          "version": totals["version"] + 1 if totals is not None else record["version"]}
+                self._write_index({**index, "totals": totals})
+
+        return {
+            **record,
+            **totals,
+            "duplicates": sum(report["duplicates"] for report in reports),
+            "consistent": consistent and all(report["consistent"] for report in reports),
+        }
+
+    @classmethod
+    def init(cls, root: str, columns: Tuple[str, ...] | List[str], backend: str = "csv") -> "PartitionedStorage":
+        """
+        Create an empty partitioned database
+        :param root: The directory to create, must not contain a database yet
+        :param columns: Columns shared by all the partitions
+        :param backend: one of BACKENDS, the format of the partitions
+        :return: The storage of the new database
+        """
+        makedirs(root, exist_ok=True)
+        if os_path.exists(os_path.join(root, cls.INDEX)):
+            raise FileExistsError(f"There already is a database at {root}")
+
+        storage = cls(root, backend)
+        storage._write_index({"columns": list(columns), "users": {},
+                              "totals": {"rows": 0, "users": 0, "last_commit": None, "version": 0}})
+        return storage
+
+    def import_frame(self, user: str, db: DataFrame) -> None:
+        """
+        Import the existing rows of a user, e.g. the former shared database
+        :param user: The user, must not have a partition yet
+        :param db: The data, indexed by datetime
+        :return: None
+        """
+        if user in self._index()["users"]:
+            raise FileExistsError(f"The user {user} already has a partition")
+        self._create(user, db)
+
+
+class ConnectionPool:
+    """
+    Fixed-size pool of connections to an SQLite file.
+    Each connection keeps its own cache of prepared statements, so reusing connections reuses the statements.
+    A pooled connection is only held for the duration of a query or a transaction: the streams, whose pace is
+    the client's, read through a dedicated connection.
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self._connections: Queue = Queue(maxsize=size)
+        for _ in range(size):
+            self._connections.put(self._open())
+
+    def _open(self) -> sqlite3.Connection:
+        # the connections are handed between the threads of the pool, never used by two at once
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=64)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        :return: a pooled connection, given back on exit
+        :raises 503: if none was given back within POOL_TIMEOUT seconds
+        """
+        try:
+            connection = self._connections.get(timeout=POOL_TIMEOUT)
+        except Empty:
+            raise HTTPException(status_code=503, detail="All the database connections are busy",
+                                headers={"Retry-After": "1"})
+        try:
+            yield connection
+        finally:
+            self._connections.put(connection)
+
+    def close(self) -> None:
+        # the last connection to close checkpoints the WAL into the database file
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+    @contextmanager
+    def dedicated(self) -> Iterator[sqlite3.Connection]:
+        """
+        :return: a connection of its own, outside the pool, closed on exit
+        """
+        connection = self._open()
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+
+class SQLiteStorage(Storage):
+    """
+    An SQLite file in WAL mode with a single "entries" table keyed by (user, datetime).
+    The key is the composite index serving every lookup, so reads and inserts are O(log N),
+    and a second row of a user with the same datetime is rejected by it.
+    Readers don't block the writer and vice versa (WAL).
+    The metadata record is a one-row "meta" table, updated in the transaction of every commit,
+    along with the version and the row count of the committing user in the "versions" table.
+    """
+
+    TABLE = "entries"
+    META = "meta"
+    VERSIONS = "versions"
+    # the rows of the user of a "versions" row
+    USER_ROWS = f'(SELECT COUNT(*) FROM {TABLE} WHERE {TABLE}."user" = {VERSIONS}."user")'
+
+    def __init__(self, path: str, pool_size: int = 4):
+        self.path = path
+        if not os_path.exists(path):
+            raise HTTPException(status_code=500, detail=f"There is no database at {path}, see the migration in docs.md")
+
+        self._pool = ConnectionPool(path, pool_size)
+        with self._pool.connection() as connection:
+            info = connection.execute(f"PRAGMA table_info({self.TABLE})").fetchall()
+        self._columns = tuple(row[1] for row in info if row[1] not in ("user", "datetime"))
+
+        # built once: identical SQL text is what makes sqlite reuse the prepared statement
+        names = ", ".join(f'"{col}"' for col in self._columns)
+        marks = ", ".join("?" for _ in self._columns)
+        self._insert = f'INSERT INTO {self.TABLE} ("user", "datetime", {names}) VALUES (?, ?, {marks})'
+
+        # databases created before the metadata record get it counted once
+        with self._pool.connection() as connection, connection:
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.META} (id INTEGER PRIMARY KEY CHECK (id = 0), '
+                '"rows" INTEGER NOT NULL, users INTEGER NOT NULL, last_commit TEXT, version INTEGER NOT NULL)'
+            )
+            connection.execute(
+                f'INSERT OR IGNORE INTO {self.META} SELECT 0, COUNT(*), COUNT(DISTINCT "user"), NULL, 1 FROM {self.TABLE}'
+            )
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.VERSIONS} ("user" TEXT PRIMARY KEY, version INTEGER NOT NULL, '
+                '"rows" INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID'
+            )
+            # and those created before the per-user row counts get them counted once
+            if "rows" not in (row[1] for row in connection.execute(f"PRAGMA table_info({self.VERSIONS})")):
+                connection.execute(f'ALTER TABLE {self.VERSIONS} ADD COLUMN "rows" INTEGER NOT NULL DEFAULT 0')
+                connection.execute(f'UPDATE {self.VERSIONS} SET "rows" = {self.USER_ROWS}')
+            connection.execute(
+                f'INSERT OR IGNORE INTO {self.VERSIONS} SELECT "user", 1, COUNT(*) FROM {self.TABLE} GROUP BY "user"'
+            )
+
+        # a database recreated at the same path restarts its versions, its inode tells it apart
+        self._epoch = stat(path).st_ino
+
+    @staticmethod
+    def _quote(columns: Tuple[str, ...] | List[str]) -> str:
+        return ", ".join(f'"{col}"' for col in columns)
+
+    def columns(self) -> Tuple[str, ...]:
+        return self._columns
+
+    def _select(self, user: str | None, columns: List[str], since: Timestamp | None, until: Timestamp | None,
+                limit: int | None) -> Tuple[str, list]:
+        where, params = [], []
+        if user is not None:
+            where.append('"user" = ?')
+            params.append(user)
+        if since is not None:
+            where.append('"datetime" >= ?')
+            params.append(since.strftime("%Y-%m-%d %H:%M:%S"))
+        if until is not None:
+            where.append('"datetime" < ?')
+            params.append(until.strftime("%Y-%m-%d %H:%M:%S"))
+
+        # the (user, datetime) key serves the range and the order: a page costs O(log N + k)
+        query = (f'SELECT "datetime", {self._quote(columns)} FROM {self.TABLE}'
+                 f'{" WHERE " + " AND ".join(where) if where else ""} ORDER BY "datetime"')
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return query, params
+
+    @staticmethod
+    def _frame(rows: List[tuple], columns: List[str]) -> DataFrame:
+        return index_by_datetime(cast(DataFrame.from_records(rows, columns=["datetime", *columns]).set_index("datetime")))
+
+    def load(self, user: str | None = None, columns: List[str] | None = None,
+             since: Timestamp | None = None, until: Timestamp | None = None, limit: int | None = None) -> DataFrame:
+        columns = list(columns) if columns else list(self._columns)
+        query, params = self._select(user, columns, since, until, limit)
+        try:
+            with self._pool.connection() as connection:
+                rows = connection.execute(query, params).fetchall()
+        except sqlite3.Error as err:
+            raise HTTPException(
+                status_code=500,
+                detail="An error occurred while importing the database:\n"
+                       f"{type(err).__name__} - {err}"
+            )
+
+        if not rows and since is None and until is None:
+            raise HTTPException(status_code=204, detail=f"The database at {self.path} is empty")
+
+        return self._frame(rows, columns)
+
+    def iter_load(self, user: str | None = None, columns: List[str] | None = None, since: Timestamp | None = None,
+                  until: Timestamp | None = None, chunk_rows: int = 10_000) -> Iterator[DataFrame]:
+        # the connection is the iterator's until it is exhausted or closed (e.g. the client went away):
+        # a connection of its own, a slow reader never holds one the commits and the other requests need
+        columns = list(columns) if columns else list(self._columns)
+        query, params = self._select(user, columns, since, until, None)
+        with self._pool.dedicated() as connection:
+            cursor = None
+            try:
+                cursor = connection.execute(query, params)
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows and since is None and until is None:
+                    raise HTTPException(status_code=204, detail=f"The database at {self.path} is empty")
+                yield self._frame(rows, columns)
+                while rows := cursor.fetchmany(chunk_rows):
+                    yield self._frame(rows, columns)
+            except sqlite3.Error as err:
+                raise HTTPException(
+                    status_code=500,
+                    detail="An error occurred while importing the database:\n"
+                           f"{type(err).__name__} - {err}"
+                )
+            finally:
+                if cursor is not None:
+                    cursor.close()
+
+    def append_many(self, user: str | None, rows: List[Tuple[str, Dict[str, Union[int, float, str]]]]) -> None:
+        params = [(user, index, *(data.get(col) for col in self._columns)) for index, data in rows]
+        try:
+            with self._pool.connection() as connection, connection:
+                # taken right away, so that two writers can't both count the same new user
+                connection.execute("BEGIN IMMEDIATE")
+                new_user = connection.execute(
+                    f'SELECT NOT EXISTS (SELECT 1 FROM {self.TABLE} WHERE "user" = ?)', (user,)
+                ).fetchone()[0]
+                connection.executemany(self._insert, params)
+                connection.execute(
+                    f'UPDATE {self.META} SET "rows" = "rows" + ?, users = users + ?, '
+                    'last_commit = ?, version = version + 1 WHERE id = 0',
+                    (len(params), new_user, now())
+                )
+                connection.execute(
+                    f'INSERT INTO {self.VERSIONS} VALUES (?, 1, ?) ON CONFLICT ("user") '
+                    'DO UPDATE SET version = version + 1, "rows" = "rows" + excluded."rows"',
+                    (user, len(params))
+                )
+        except sqlite3.IntegrityError as err:
+            # the transaction is rolled back: nothing is written
+            raise Rejected(status_code=409, detail=f"There already is an entry with this datetime: {err}")
+        except sqlite3.Error as err:
+            raise HTTPException(
+                status_code=500,
+                detail="An error occurred while writing to the database:\n"
+                       f"{type(err).__name__} - {err}"
+            )
+
+    def metadata(self) -> dict:
+        with self._pool.connection() as connection:
+            rows, users, last_commit, version = connection.execute(
+                f'SELECT "rows", users, last_commit, version FROM {self.META}'
+            ).fetchone()
+        return {"rows": rows, "columns": list(self._columns), "users": users,
+                "last_commit": last_commit, "version": version}
+
+    def users(self) -> List[str]:
+        with self._pool.connection() as connection:
+            return [row[0] for row in connection.execute(f'SELECT "user" FROM {self.VERSIONS} ORDER BY "user"')]
+
+    def version(self, user: str | None = None) -> str:
+        if user is None:
+            return f"{self._epoch}:{self.metadata()['version']}"
+        with self._pool.connection() as connection:
+            row = connection.execute(f'SELECT version FROM {self.VERSIONS} WHERE "user" = ?', (user,)).fetchone()
+        # a user without rows yet: their first commit makes it 1
+        return f"{self._epoch}:{row[0] if row else 0}"
+
+    def rows(self, user: str | None = None) -> int:
+        if user is None:
+            return self.metadata()["rows"]
+        with self._pool.connection() as connection:
+            row = connection.execute(f'SELECT "rows" FROM {self.VERSIONS} WHERE "user" = ?', (user,)).fetchone()
+        return row[0] if row else 0
+
+    def check(self) -> dict:
+        with self._pool.connection() as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            integrity = connection.execute("PRAGMA integrity_check").fetchone()[0]
+            rows, users = connection.execute(f'SELECT COUNT(*), COUNT(DISTINCT "user") FROM {self.TABLE}').fetchone()
+            record_rows, record_users = connection.execute(f'SELECT "rows", users FROM {self.META}').fetchone()
+            miscounted = connection.execute(
+                f'SELECT COUNT(*) FROM {self.VERSIONS} WHERE "rows" != {self.USER_ROWS}'
+            ).fetchone()[0]
+
+            consistent = integrity == "ok" and (rows, users) == (record_rows, record_users) and not miscounted
+            if (rows, users) != (record_rows, record_users):
+                connection.execute(f'UPDATE {self.META} SET "rows" = ?, users = ?, version = version + 1',
+                                   (rows, users))
+                connection.execute(f'UPDATE {self.VERSIONS} SET version = version + 1')
+            if miscounted:
+                connection.execute(f'UPDATE {self.VERSIONS} SET "rows" = {self.USER_ROWS}, version = version + 1 '
+                                   f'WHERE "rows" != {self.USER_ROWS}')
+
+        # duplicates are impossible, the key rejects them
+        return {**self.metadata(), "duplicates": 0, "consistent": consistent}
+
+    @classmethod
+    def from_frame(cls, db: DataFrame, path: str, user: str, pool_size: int = 4) -> "SQLiteStorage":
+        """
+        Create a new SQLite database, or add to an existing one, out of the rows of a user.
+        A new database is built in a temporary file, renamed into place once all the rows are in:
+        a failed migration never leaves an empty or partial database behind. Adding to an existing one is a single
+        transaction.
+        :param db: The data, indexed by datetime
+        :param path: The database file
+        :param user: whose rows these are
+        :param pool_size: connections of the returned storage
+        :return: The storage of the database
+        :raises Rejected: 409 if a datetime is there twice, or already has a row of the user
+        """
+        if os_path.exists(path):
+            storage = cls(path, pool_size)
+            storage._import(db, user)
+            return storage
+
+        tmp = path + ".tmp"
+        cls._remove(tmp)
+        try:
+            cls._create(db, tmp)
+            storage = cls(tmp, pool_size)
+            try:
+                storage._import(db, user)
+            finally:
+                storage._pool.close()
+        except BaseException:
+            cls._remove(tmp)
+            raise
+        replace(tmp, path)
+        return cls(path, pool_size)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        for name in (path, path + "-wal", path + "-shm"):
+            if os_path.exists(name):
+                remove(name)
+
+    @classmethod
+    def _create(cls, db: DataFrame, path: str) -> None:
+        affinity = {"i": "INTEGER", "u": "INTEGER", "b": "INTEGER", "f": "REAL"}
+        columns = ", ".join(f'"{col}" {affinity.get(dtype.kind, "TEXT")}' for col, dtype in db.dtypes.items())
+
+        with sqlite3.connect(path) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {cls.TABLE} ("user" TEXT NOT NULL, "datetime" TEXT NOT NULL, {columns}, '
+                'PRIMARY KEY ("user", "datetime")) WITHOUT ROWID'
+            )
+        connection.close()
+
+    def _import(self, db: DataFrame, user: str) -> None:
+        db = plain(index_by_datetime(db))
+        self.append_many(user, [
+            (dt, {col: None if value != value else value for col, value in row.items()})
+            for dt, row in zip(db.index, db.to_dict(orient="records"))
+        ])
+
+
+def get_storage(path: str, backend: str = "csv", commit_mode: str = "append", layout: str = "shared",
+                pool_size: int = 4) -> Storage:
+    """
+    Storage factory
+    :param path: INTERNAL_DB_PATH
+    :param backend: one of BACKENDS
+    :param commit_mode: "append" or "rewrite", only used by the csv backend
+    :param layout: "shared" - one table for everybody, "per_user" - one partition per user under the path.
+    The sqlite backend is always per user, through its index.
+    :param pool_size: connections per process, only used by the sqlite backend
+    :return: the storage
+    :raises ValueError: if the backend or the layout is unknown
+    """
+    if backend == "sqlite":
+        return SQLiteStorage(path, pool_size)
+
+    if layout == "per_user":
+        return PartitionedStorage(path, backend, commit_mode)
+    if layout != "shared":
+        raise ValueError(f"Invalid layout '{layout}', expected 'shared' or 'per_user'")
+
+    if backend == "csv":
+        return CSVStorage(path, commit_mode)
+    if backend == "parquet":
+        return ParquetStorage(path)
+    raise ValueError(f"Invalid backend '{backend}', expected one of {', '.join(BACKENDS)}")
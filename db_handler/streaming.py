@@ -0,0 +1,152 @@
+# parsing related
+from pandas import DataFrame
+from io import BytesIO
+from db_handler.schema import SCHEMA, plain
+
+# typing related
+from typing import Iterable, Iterator, Tuple
+
+# optional dependency of the Arrow format
+from importlib.util import find_spec
+
+NDJSON = "application/x-ndjson"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+ARROW_AVAILABLE = find_spec("pyarrow") is not None
+
+
+def negotiate(accept: str | None) -> str:
+    """
+    Pick the /get response format out of the Accept header
+    :param accept: The header value, e.g. "application/x-ndjson"
+    :return: NDJSON, ARROW_STREAM or "application/json" (the default)
+    """
+    offered = [part.split(";")[0].strip() for part in (accept or "").split(",")]
+    for media_type in offered:
+        if media_type in (NDJSON, ARROW_STREAM):
+            return media_type
+    return "application/json"
+
+
+def _chunks(db: DataFrame | Iterable[DataFrame], chunk_rows: int) -> Iterator[DataFrame]:
+    if not isinstance(db, DataFrame):
+        # chunks read from the storage (Storage.iter_load), only one of them is in memory at a time
+        yield from db
+        return
+    # positional slices are views, nothing is copied until a chunk gets serialized
+    for start in range(0, len(db), chunk_rows):
+        yield db.iloc[start:start + chunk_rows]
+
+
+def _schema(db: DataFrame):
+    """
+    :param db: the first chunk of a stream, every batch has to agree with its schema
+    :return: the schema with the declared types (see schema.SCHEMA), those of the chunk for the other columns
+    """
+    import pyarrow
+
+    declared = {"Int8": pyarrow.int8(), "float32": pyarrow.float32(), "category": pyarrow.string()}
+    schema = pyarrow.Schema.from_pandas(db, preserve_index=True)
+    for i, field in enumerate(schema):
+        dtype = "category" if field.name == "user" else str(getattr(SCHEMA.get(field.name), "dtype", ""))
+        if dtype in declared:
+            schema = schema.set(i, pyarrow.field(field.name, declared[dtype]))
+        elif pyarrow.types.is_null(field.type):
+            # nothing but missing values in the first chunk: the next ones may have strings
+            schema = schema.set(i, pyarrow.field(field.name, pyarrow.string()))
+    return schema
+
+
+def ndjson_chunks(db: DataFrame | Iterable[DataFrame], chunk_rows: int) -> Iterator[bytes]:
+    """
+    Serialize a frame as one JSON object per line ({"datetime": ..., "col1": ..., ...}), chunk by chunk
+    :param db: The (partial) database, or its chunks as read from the storage
+    :param chunk_rows: Rows per chunk of a frame, bounds the memory needed on top of the frame itself
+    :return: iterator over the encoded chunks
+    """
+    for chunk in _chunks(db, chunk_rows):
+        if not chunk.empty:
+            yield plain(chunk).rename_axis("datetime").reset_index().to_json(orient="records", lines=True).encode()
+
+
+def arrow_chunks(db: DataFrame | Iterable[DataFrame], chunk_rows: int) -> Iterator[bytes]:
+    """
+    Serialize a frame as an Arrow IPC stream, one record batch per chunk.
+    The datetime index is sent as a timestamp column named "datetime", pyarrow's read_pandas() restores it as the index.
+    :param db: The (partial) database, or its chunks as read from the storage (at least one, possibly empty)
+    :param chunk_rows: Rows per record batch of a frame
+    :return: iterator over the encoded stream
+    :raises ImportError: if pyarrow is not installed
+    """
+    import pyarrow
+    import pyarrow.ipc
+
+    writer, sink = None, BytesIO()
+    for chunk in _chunks(db, chunk_rows):
+        if writer is None:
+            # fixed by the first chunk, so that all the batches agree
+            schema = _schema(chunk)
+            writer = pyarrow.ipc.new_stream(sink, schema)
+        if chunk.empty:
+            continue
+        writer.write_batch(pyarrow.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=True))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+
+    if writer is None:
+        # an empty frame: the stream still carries its schema
+        writer = pyarrow.ipc.new_stream(sink, _schema(db))
+    writer.close()
+    yield sink.getvalue()
+
+
+def _with_user(user: str, db: DataFrame) -> DataFrame:
+    # the user first, categoricals as their values: the categories differ from user to user
+    categorical = {col: db[col].astype(object) for col, dtype in db.dtypes.items() if dtype == "category"}
+    return db.assign(**categorical).assign(user=user)[["user", *db.columns]]
+
+
+def export_ndjson(groups: Iterable[Tuple[str, DataFrame]], chunk_rows: int) -> Iterator[bytes]:
+    """
+    NDJSON of many users' data, as ndjson_chunks with the user in every line ({"user": ..., "datetime": ..., ...})
+    :param groups: (user, their data) pairs, e.g. Storage.groups()
+    :param chunk_rows: Rows per chunk
+    :return: iterator over the encoded chunks
+    """
+    for user, db in groups:
+        yield from ndjson_chunks(_with_user(user, db), chunk_rows)
+
+
+def export_arrow(groups: Iterable[Tuple[str, DataFrame]], chunk_rows: int) -> Iterator[bytes]:
+    """
+    A single Arrow IPC stream of many users' data, with a "user" column next to the datetime index.
+    The types are the declared ones (see schema.SCHEMA), the others are those of the first user's data.
+    :param groups: (user, their data) pairs, e.g. Storage.groups(), several consecutive ones per user if chunked
+    :param chunk_rows: Rows per record batch
+    :return: iterator over the encoded stream, empty if there are no groups
+    :raises ImportError: if pyarrow is not installed
+    """
+    import pyarrow
+    import pyarrow.ipc
+
+    writer, sink = None, BytesIO()
+    for user, db in groups:
+        db = _with_user(user, db)
+        if writer is None:
+            # fixed by the first group, every batch has to agree with it
+            schema = _schema(db)
+            writer = pyarrow.ipc.new_stream(sink, schema)
+            columns = list(db.columns)
+        else:
+            # the columns the first user lacks are left out, the ones this user lacks are null
+            db = db.reindex(columns=columns).astype({column: object for column in columns if column not in db})
+
+        for chunk in _chunks(db, chunk_rows):
+            writer.write_batch(pyarrow.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=True))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+
+    if writer is not None:
+        writer.close()
+        yield sink.getvalue()
@@ -7,6 +7,7 @@ import pytest
 
 # debug variables
 from os import environ
+import json
 
 """
 No server needed to test, only pytest
@@ -38,6 +39,19 @@ def test_healthcheck():
         pytest.fail(f"Healthcheck failed: {parse_response(response)}")
 
 
+def test_metrics():
+    client.request("POST", "/get", json={"user": "me"})
+    text = client.request("GET", "/metrics").text
+    assert 'route="/get"' in text
+    assert 'span_duration_seconds_count{span="load_db"}' in text or 'span="to_dict"' in text
+
+
+def test_deep_healthcheck():
+    response = client.request("GET", "/healthcheck", params={"deep": True})
+    assert response.status_code == 200, f"Deep healthcheck failed: {parse_response(response)}"
+    assert response.json()["rows"] == client.request("GET", "/healthcheck").json()["rows"]
+
+
 class TestGetDB:
     # why .request and not .get => .get does not support (json) body in the request
     def test_good_request(self):
@@ -72,6 +86,68 @@ class TestGetDB:
         )
         assert response.status_code != 200, f"Expected rejection, got {parse_response(response)}"
 
+    def test_pagination(self):
+        response = client.request("POST", "/get", json={"user": "me", "limit": 1})
+        assert response.status_code == 200, f"Expected success, got {parse_response(response)}"
+        first = response.json()
+        assert len(first["data"]) == 1
+
+        response = client.request("POST", "/get", json={"user": "me", "limit": 1, "cursor": first["next_cursor"]})
+        assert response.status_code == 200, f"Expected success, got {parse_response(response)}"
+        assert response.json()["index"] != first["index"]
+
+    def test_ndjson(self):
+        response = client.request("POST", "/get", json={"user": "me", "columns": ["day_rank"]},
+                                  headers={"Accept": "application/x-ndjson"})
+        assert response.status_code == 200, f"Expected success, got {parse_response(response)}"
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert rows and set(rows[0]) == {"datetime", "day_rank"}
+
+    def test_arrow(self):
+        ipc = pytest.importorskip("pyarrow.ipc")
+        response = client.request("POST", "/get", json={"user": "me"},
+                                  headers={"Accept": "application/vnd.apache.arrow.stream"})
+        assert response.status_code == 200, f"Expected success, got {response.status_code}"
+
+        data = ipc.open_stream(response.content).read_pandas()
+        expected = client.request("POST", "/get", json={"user": "me"}).json()
+        assert list(data.columns) == expected["columns"]
+        assert len(data) == len(expected["index"])
+
+    def test_bad_limit(self):
+        response = client.request("POST", "/get", json={"user": "me", "limit": 0})
+        assert response.status_code == 400, f"Expected rejection, got {parse_response(response)}"
+
+    def test_etag(self):
+        response = client.request("POST", "/get", json={"user": "me"})
+        assert response.status_code == 200, f"Expected success, got {parse_response(response)}"
+        etag, rows = response.headers["etag"], len(response.json()["index"])
+        assert response.headers["x-data-rows"] == str(rows)
+
+        response = client.request("POST", "/get", json={"user": "me"}, headers={"If-None-Match": etag})
+        assert response.status_code == 304, f"Expected not modified, got {response.status_code}"
+        assert response.headers["etag"] == etag and not response.content
+        assert response.headers["x-data-rows"] == str(rows)
+
+        # another request or another format is another entity
+        response = client.request("POST", "/get", json={"user": "me", "limit": 1}, headers={"If-None-Match": etag})
+        assert response.status_code == 200 and response.headers["etag"] != etag
+        response = client.request("POST", "/get", json={"user": "me"},
+                                  headers={"If-None-Match": etag, "Accept": "application/x-ndjson"})
+        assert response.status_code == 200 and response.headers["etag"] != etag
+
+    def test_stale_etag(self):
+        response = client.request("POST", "/get", json={"user": "me"}, headers={"If-None-Match": '"stale", W/"old"'})
+        assert response.status_code == 200, f"Expected success, got {response.status_code}"
+
+
+def test_export_shared():
+    # the test database is a shared csv: it doesn't tell users apart
+    response = client.request("POST", "/export", json={})
+    assert response.status_code == 400, f"Expected rejection, got {response.status_code}"
+
 
 class TestCommitDB:
     @classmethod
@@ -111,6 +187,34 @@ class TestCommitDB:
         })
         assert response.status_code == 201, f"Expected success, got {parse_response(response)}"
 
+    def test_zero_values(self):
+        response = client.request("POST", "/commit", json={
+            "user": "me",
+            "datetime": "2020-05-03 20:30:45",
+            "data": {"day_rank": 0, "temperature": 0.0}
+        })
+        assert response.status_code == 201, f"Expected success, got {parse_response(response)}"
+
+    def test_good_batch(self):
+        response = client.request("POST", "/commit/batch", json={
+            "user": "me",
+            "rows": [
+                {"datetime": "2020-05-01 20:30:45", "data": {"day_rank": 8, "temperature": 25}},
+                {"datetime": "2020-05-02 20:30:45", "data": {"day_rank": 6}}
+            ]
+        })
+        assert response.status_code == 201, f"Expected success, got {parse_response(response)}"
+
+    def test_bad_batch(self):
+        response = client.request("POST", "/commit/batch", json={
+            "user": "me",
+            "rows": [
+                {"datetime": "2020-05-01 20:30:45", "data": {"day_rank": 8}},
+                {"datetime": "2020-05-02 20:30:45", "data": {"bad_column": 6}}
+            ]
+        })
+        assert response.status_code == 400, f"Expected rejection, got {parse_response(response)}"
+
     @classmethod
     def teardown_class(cls):
         environ["DEBUG"] = "False"
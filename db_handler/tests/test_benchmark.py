@@ -0,0 +1,54 @@
+# tested objects
+from db_handler.benchmark import COLUMNS, compare, generate_db, latency_stats
+from db_handler.utility import load_db, read_columns
+
+# testing related
+import pytest
+
+"""
+No server needed to test, only pytest
+
+To test run
+docker container exec --tty db_handler pytest /app/db_handler/tests/test_benchmark.py -vv --tb=line
+"""
+
+
+def report(p50: float, rss: float = 10.0) -> dict:
+    return {"results": {"1000": {"get_full": {"p50_ms": p50, "rss_growth_mb": rss}}}}
+
+
+class TestGenerate:
+    def test_daemon_schema(self, tmp_path):
+        path = str(tmp_path / "db.csv")
+        generate_db(path, 250, chunk_rows=100)
+
+        assert read_columns(path) == COLUMNS
+        db = load_db(path)
+        assert len(db) == 250
+        assert db.index.is_unique
+        assert db.day_rank.between(1, 10).all()
+
+    def test_reproducible(self, tmp_path):
+        generate_db(str(tmp_path / "a.csv"), 50, seed=3)
+        generate_db(str(tmp_path / "b.csv"), 50, seed=3)
+        assert (tmp_path / "a.csv").read_text() == (tmp_path / "b.csv").read_text()
+
+
+class TestReport:
+    def test_latency_stats(self):
+        stats = latency_stats([0.001] * 99 + [0.101])
+        assert stats["p50_ms"] == pytest.approx(1.0)
+        assert stats["max_ms"] == pytest.approx(101.0)
+        assert stats["ops_per_s"] == pytest.approx(500.0)
+
+    def test_no_regression(self):
+        assert compare(report(10.0), report(11.0), tolerance=0.2) == []
+
+    def test_slower(self):
+        assert len(compare(report(10.0), report(20.0), tolerance=0.2)) == 1
+
+    def test_bigger(self):
+        assert len(compare(report(10.0), report(10.0, rss=50.0), tolerance=0.2)) == 1
+
+    def test_new_case_ignored(self):
+        assert compare({"results": {}}, report(10.0), tolerance=0.2) == []
@@ -0,0 +1,125 @@
+# bridge to the fastapi
+from fastapi import HTTPException
+
+# tested objects
+from db_handler.cache import DBCache, file_signature
+from db_handler.locking import lock_for
+from db_handler.utility import append_row, read_columns
+
+# testing related
+import pytest
+from os import utime, stat
+from threading import Thread
+from time import sleep
+from pandas import DataFrame
+
+"""
+No server needed to test, only pytest
+
+To test run
+docker container exec --tty db_handler pytest /app/db_handler/tests/test_cache.py -vv --tb=line
+"""
+
+CSV = "datetime,day_rank,temperature\n2020-01-01 20:00:00,5,10.5\n2020-01-02 20:00:00,7,12.0\n"
+
+
+def write_db(path, content: str = CSV) -> str:
+    path.write_text(content)
+    return str(path)
+
+
+class TestDBCache:
+    def test_repeated_reads_hit(self, tmp_path):
+        path = write_db(tmp_path / "db.csv")
+        cache = DBCache()
+
+        first = cache.get(path)
+        second = cache.get(path)
+
+        assert first is second
+        assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+    def test_invalidated_on_change(self, tmp_path):
+        path = write_db(tmp_path / "db.csv")
+        cache = DBCache()
+        cache.get(path)
+
+        write_db(tmp_path / "db.csv", CSV + "2020-01-03 20:00:00,9,15.0\n")
+        assert len(cache.get(path)) == 3
+        assert cache.misses == 2
+
+    def test_invalidated_on_mtime(self, tmp_path):
+        path = write_db(tmp_path / "db.csv")
+        cache = DBCache()
+        cache.get(path)
+
+        st = stat(path)
+        utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+        cache.get(path)
+        assert cache.misses == 2
+
+    def test_put_refreshes_in_place(self, tmp_path):
+        path = write_db(tmp_path / "db.csv")
+        cache = DBCache()
+        db = cache.get(path)
+
+        write_db(tmp_path / "db.csv", CSV + "2020-01-03 20:00:00,9,15.0\n")
+        cache.put(path, db)
+        assert cache.get(path) is db
+        assert cache.hits == 1
+
+    def test_extend_after_append(self, tmp_path):
+        path = write_db(tmp_path / "db.csv")
+        cache = DBCache()
+        cache.get(path)
+
+        before = file_signature(path)
+        append_row(path, "2020-01-03 20:00:00", {"day_rank": 9}, read_columns(path))
+        cache.extend(path, before, DataFrame({"day_rank": 9}, index=["2020-01-03 20:00:00"]))
+
+        db = cache.get(path)
+        assert len(db) == 3
+        assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+    def test_extend_after_foreign_change(self, tmp_path):
+        path = write_db(tmp_path / "db.csv")
+        cache = DBCache()
+        cache.get(path)
+
+        write_db(tmp_path / "db.csv", CSV + "2020-01-03 20:00:00,9,15.0\n")
+        before = file_signature(path)
+        append_row(path, "2020-01-04 20:00:00", {"day_rank": 1}, read_columns(path))
+        cache.extend(path, before, DataFrame({"day_rank": 1}, index=["2020-01-04 20:00:00"]))
+
+        assert len(cache.get(path)) == 4
+        assert cache.misses == 2
+
+    def test_errors_not_cached(self, tmp_path):
+        cache = DBCache()
+        with pytest.raises(HTTPException):
+            cache.get(str(tmp_path / "missing.csv"))
+        assert cache.stats()["entries"] == 0
+
+    def test_no_deadlock_with_a_writer(self, tmp_path):
+        path = write_db(tmp_path / "db.csv")
+        cache = DBCache()
+        cache.get(path)
+
+        with lock_for(path).exclusive():
+            before = file_signature(path)
+            append_row(path, "2020-01-03 20:00:00", {"day_rank": 9}, read_columns(path))
+            # a cache miss, waiting for the file lock to parse the file
+            reader = Thread(target=cache.get, args=(path,), daemon=True)
+            reader.start()
+            sleep(0.1)
+
+            # the reader doesn't hold the cache's lock while it waits
+            writer = Thread(target=cache.extend, args=(path, before, DataFrame({"day_rank": 9}, index=["2020-01-03"])),
+                            daemon=True)
+            writer.start()
+            writer.join(5)
+            assert not writer.is_alive()
+
+        reader.join(5)
+        assert not reader.is_alive()
+        assert len(cache.get(path)) == 3
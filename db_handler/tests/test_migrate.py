@@ -0,0 +1,40 @@
+# tested objects
+from db_handler.storage import SQLiteStorage
+
+# testing related
+import subprocess
+import sys
+from os import path
+
+"""
+No server needed to test, only pytest
+
+To test run
+docker container exec --tty db_handler pytest /app/db_handler/tests/test_migrate.py -vv --tb=line
+"""
+
+ROOT = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+CSV = ("datetime,day_rank,season,temperature\n"
+       "2020-01-01 20:00:00,5,winter,1.5\n"
+       "2020-01-02 20:00:00,7,winter,2.5\n"
+       "2020-01-02 20:00:00,6,winter,-0.5\n")
+
+
+def migrate(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, "-m", "db_handler.migrate", *args],
+                          cwd=ROOT, capture_output=True, text=True)
+
+
+def test_sqlite_duplicates(tmp_path):
+    source, target = tmp_path / "db.csv", tmp_path / "db.sqlite"
+    source.write_text(CSV)
+
+    process = migrate("--source", str(source), "--target", str(target), "--user", "me", "--backend", "sqlite")
+    assert process.returncode == 1
+    assert "2020-01-02 20:00:00" in process.stderr and "Traceback" not in process.stderr
+    assert not target.exists()
+
+    source.write_text(CSV.rsplit("2020-01-02", 1)[0])
+    process = migrate("--source", str(source), "--target", str(target), "--user", "me", "--backend", "sqlite")
+    assert process.returncode == 0, process.stderr
+    assert len(SQLiteStorage(str(target)).load("me")) == 2
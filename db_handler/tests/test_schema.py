@@ -0,0 +1,102 @@
+# bridge to the fastapi
+from fastapi import HTTPException
+
+# tested objects
+from db_handler.schema import cast, check_values, plain, validate_values
+from db_handler.storage import CSVStorage
+from db_handler.benchmark import generate_db
+from db_handler.utility import load_db
+
+# testing related
+import pytest
+from pandas import DataFrame, read_csv
+
+"""
+No server needed to test, only pytest
+
+To test run
+docker container exec --tty db_handler pytest /app/db_handler/tests/test_schema.py -vv --tb=line
+"""
+
+
+@pytest.fixture
+def daemon_db(tmp_path) -> str:
+    path = str(tmp_path / "db.csv")
+    generate_db(path, 1_000)
+    return path
+
+
+class TestTypedLoad:
+    def test_declared_dtypes(self, daemon_db):
+        dtypes = load_db(daemon_db).dtypes
+        assert str(dtypes["day_rank"]) == "Int8"
+        assert str(dtypes["season"]) == "category"
+        assert list(dtypes["season"].categories) == ["winter", "spring", "summer", "autumn"]
+        assert str(dtypes["sunrise"]) == "datetime64[ns]"
+        assert str(dtypes["temperature"]) == "float32"
+
+    def test_smaller_than_inferred(self, daemon_db):
+        typed = load_db(daemon_db).memory_usage(deep=True).sum()
+        inferred = read_csv(daemon_db, index_col="datetime").memory_usage(deep=True).sum()
+        assert typed < inferred / 2
+
+    def test_undeclared_columns_inferred(self, tmp_path):
+        path = tmp_path / "db.csv"
+        path.write_text("datetime,mood\n2020-01-01 20:00:00,3\n")
+        assert str(load_db(str(path)).dtypes["mood"]) == "int64"
+
+    def test_legacy_float_rank(self, tmp_path):
+        path = tmp_path / "db.csv"
+        path.write_text("datetime,day_rank\n2020-01-01 20:00:00,7.0\n2020-01-02 20:00:00,\n")
+
+        db = load_db(str(path))
+        assert str(db.dtypes["day_rank"]) == "Int8"
+        assert db.day_rank.iloc[0] == 7
+
+    def test_undeclared_season_kept(self, tmp_path):
+        path = tmp_path / "db.csv"
+        path.write_text("datetime,season\n2020-01-01 20:00:00,monsoon\n2020-01-02 20:00:00,winter\n")
+        assert list(load_db(str(path)).season) == ["monsoon", "winter"]
+
+    def test_append_keeps_dtypes(self, daemon_db):
+        storage = CSVStorage(daemon_db)
+        storage.load()
+        storage.append(None, "2030-01-01 20:00:00", {"day_rank": 3, "season": "winter", "temperature": 1.5})
+
+        dtypes = storage.load().dtypes
+        assert str(dtypes["day_rank"]) == "Int8"
+        assert str(dtypes["season"]) == "category"
+        assert str(dtypes["temperature"]) == "float32"
+
+
+class TestValues:
+    def test_good(self):
+        data = {"day_rank": 7, "season": "spring", "temperature": 14, "sunrise": "2020-01-01 05:00:00", "mood": "x"}
+        assert check_values([(0, data)]) == []
+
+    @pytest.mark.parametrize("data", [
+        {"day_rank": 1.5},
+        {"day_rank": 300},
+        {"season": "monsoon"},
+        {"temperature": "warm"},
+        {"sunrise": "at dawn"},
+    ])
+    def test_bad(self, data):
+        check = lambda err: err.status_code == 400 and "Values don't match the schema" in err.detail
+        with pytest.raises(HTTPException, check=check):
+            validate_values(data)
+
+    def test_row_numbers(self):
+        errors = check_values([(0, {"day_rank": 1}), (1, {"day_rank": "a"}), (2, {"season": "b"})])
+        assert [error.split(":")[0] for error in errors] == ["row 1", "row 2"]
+
+    def test_cast_bad_value(self):
+        with pytest.raises(HTTPException, check=lambda err: err.status_code == 400):
+            cast(DataFrame({"day_rank": ["very good"]}))
+
+
+class TestPlain:
+    def test_json_friendly(self, daemon_db):
+        row = plain(load_db(daemon_db).iloc[:1]).to_dict(orient="split")
+        original = read_csv(daemon_db, index_col="datetime", nrows=1).to_dict(orient="split")
+        assert row == original
@@ -0,0 +1,19 @@
+# tested objects
+from common.startup import budget, measure
+
+"""
+No server needed to test, only pytest: the app is started in fresh interpreters, as a container restart would
+
+To test run
+docker container exec --tty db_handler pytest /app/db_handler/tests/test_startup.py -vv --tb=line
+"""
+
+# seconds, about twice the cold start measured on a laptop (0.6 s and 15 ms): past them it is a regression
+IMPORT_BUDGET = 1.5
+HEALTHCHECK_BUDGET = 0.5
+
+
+def test_cold_start():
+    timings = measure("db_handler.db_handler", repeat=2)
+    assert timings["import_s"] < budget(IMPORT_BUDGET), timings
+    assert timings["healthcheck_s"] < budget(HEALTHCHECK_BUDGET), timings
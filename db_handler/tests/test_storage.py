@@ -0,0 +1,485 @@
+# bridge to the fastapi
+from fastapi import HTTPException
+
+# tested objects
+import db_handler.storage as storage_module
+from db_handler.storage import CSVStorage, ParquetStorage, PartitionedStorage, SQLiteStorage, get_storage
+from db_handler.utility import load_db
+
+# testing related
+import pytest
+import sqlite3
+from os import listdir
+from pandas import Timestamp, concat
+
+"""
+No server needed to test, only pytest
+
+To test run
+docker container exec --tty db_handler pytest /app/db_handler/tests/test_storage.py -vv --tb=line
+"""
+
+CSV = ("datetime,day_rank,season,temperature\n"
+       "2020-01-01 20:00:00,5,winter,1.5\n"
+       "2020-01-02 20:00:00,7,winter,2.5\n"
+       "2020-01-03 20:00:00,6,winter,-0.5\n")
+
+
+@pytest.fixture
+def csv_path(tmp_path) -> str:
+    path = tmp_path / "db.csv"
+    path.write_text(CSV)
+    return str(path)
+
+
+@pytest.fixture
+def parquet_path(tmp_path, csv_path) -> str:
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "db.parquet")
+    ParquetStorage.from_frame(load_db(csv_path), path)
+    return path
+
+
+def test_unknown_backend(csv_path):
+    with pytest.raises(ValueError):
+        get_storage(csv_path, "xlsx")
+
+
+class TestCSVStorage:
+    def test_columns(self, csv_path):
+        assert CSVStorage(csv_path).columns() == ("day_rank", "season", "temperature")
+
+    def test_projection(self, csv_path):
+        db = CSVStorage(csv_path).load(columns=["day_rank"])
+        assert list(db.columns) == ["day_rank"]
+        assert len(db) == 3
+
+    def test_time_range(self, csv_path):
+        db = CSVStorage(csv_path).load(since=Timestamp("2020-01-02"), until=Timestamp("2020-01-03"))
+        assert list(db.index) == [Timestamp("2020-01-02 20:00:00")]
+
+    def test_append(self, csv_path):
+        storage = CSVStorage(csv_path)
+        storage.load()
+        storage.append(None, "2020-01-04 20:00:00", {"day_rank": 9})
+        assert len(storage.load()) == 4
+        assert len(load_db(csv_path)) == 4
+
+    def test_limit(self, csv_path):
+        db = CSVStorage(csv_path).load(since=Timestamp("2020-01-02"), limit=1)
+        assert list(db.day_rank) == [7]
+
+    def test_iter_load(self, csv_path):
+        chunks = list(CSVStorage(csv_path).iter_load(since=Timestamp("2020-01-02"), chunk_rows=1))
+        assert [list(chunk.day_rank) for chunk in chunks] == [[7], [6]]
+
+    def test_no_users(self, csv_path):
+        check = lambda err: err.status_code == 400
+        with pytest.raises(HTTPException, check=check):
+            list(CSVStorage(csv_path).groups())
+
+    def test_rewrite(self, csv_path):
+        storage = CSVStorage(csv_path, commit_mode="rewrite")
+        storage.append(None, "2020-01-04 20:00:00", {"day_rank": 9})
+        assert len(load_db(csv_path)) == 4
+
+    def test_rewrite_crash_keeps_the_file(self, csv_path, monkeypatch):
+        storage = CSVStorage(csv_path, commit_mode="rewrite")
+
+        def crash(*args, **kwargs):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(storage_module, "fsync", crash)
+        with pytest.raises(HTTPException, check=lambda err: err.status_code == 500):
+            storage.append(None, "2020-01-04 20:00:00", {"day_rank": 9})
+        assert open(csv_path).read() == CSV
+
+
+class TestParquetStorage:
+    def test_columns(self, parquet_path):
+        assert ParquetStorage(parquet_path).columns() == ("day_rank", "season", "temperature")
+
+    def test_same_as_csv(self, parquet_path, csv_path):
+        db = ParquetStorage(parquet_path).load()
+        assert db.shape == load_db(csv_path).shape
+        assert list(db.day_rank) == [5, 7, 6]
+
+    def test_projection(self, parquet_path):
+        db = ParquetStorage(parquet_path).load(columns=["temperature"])
+        assert list(db.columns) == ["temperature"]
+
+    def test_time_range(self, parquet_path):
+        db = ParquetStorage(parquet_path).load(since=Timestamp("2020-01-02"), until=Timestamp("2020-01-03"))
+        assert list(db.day_rank) == [7]
+
+    def test_append(self, parquet_path):
+        storage = ParquetStorage(parquet_path)
+        storage.append(None, "2020-01-04 20:00:00", {"day_rank": 9, "season": "winter"})
+
+        db = storage.load()
+        assert len(db) == 4
+        assert db.temperature.isna().iloc[-1]
+
+    def test_append_many(self, parquet_path):
+        storage = ParquetStorage(parquet_path)
+        storage.append_many(None, [("2020-01-05 20:00:00", {"day_rank": 1}), ("2020-01-04 20:00:00", {"day_rank": 2})])
+        assert list(storage.load().day_rank) == [5, 7, 6, 2, 1]
+
+    def test_limit(self, parquet_path, monkeypatch):
+        # a row group per row: the base file is read until the limit only
+        monkeypatch.setattr(storage_module, "ROW_GROUP_SIZE", 1)
+        storage = ParquetStorage(parquet_path)
+        storage.compact()
+        # a fragment with a row before the base file's ones
+        storage.append(None, "2019-12-31 20:00:00", {"day_rank": 1})
+
+        assert list(storage.load(limit=2).day_rank) == [1, 5]
+        assert list(storage.load(columns=["day_rank"], since=Timestamp("2020-01-02"), limit=5).day_rank) == [7, 6]
+
+    def test_iter_load(self, parquet_path, monkeypatch):
+        monkeypatch.setattr(storage_module, "ROW_GROUP_SIZE", 1)
+        storage = ParquetStorage(parquet_path)
+        storage.compact()
+        # fragments before, between and after the base file's rows: merged in datetime order
+        storage.append_many(None, [("2019-12-31 20:00:00", {"day_rank": 1}), ("2020-01-02 08:00:00", {"day_rank": 2}),
+                                   ("2020-01-09 20:00:00", {"day_rank": 3})])
+
+        chunks = list(storage.iter_load(columns=["day_rank"], chunk_rows=1))
+        assert [row for chunk in chunks for row in chunk.day_rank] == [1, 5, 2, 7, 6, 3]
+        assert all(chunk.index.is_monotonic_increasing for chunk in chunks)
+        # a range with nothing in it: a single empty chunk
+        empty = list(storage.iter_load(since=Timestamp("2021-01-01"), chunk_rows=1))
+        assert len(empty) == 1 and empty[0].empty
+
+    def test_append_bad_type(self, parquet_path):
+        check = lambda err: err.status_code == 400
+        with pytest.raises(HTTPException, check=check):
+            ParquetStorage(parquet_path).append(None, "2020-01-04 20:00:00", {"day_rank": "very good"})
+
+    def test_compaction(self, parquet_path, monkeypatch):
+        monkeypatch.setattr(storage_module, "COMPACT_AFTER", 3)
+        monkeypatch.setattr(storage_module, "GC_GRACE", -1)
+        storage = ParquetStorage(parquet_path)
+        storage.append(None, "2020-01-05 20:00:00", {"day_rank": 1})
+        storage.append(None, "2020-01-04 20:00:00", {"day_rank": 2})
+
+        assert len([name for name in listdir(parquet_path) if name.endswith(".parquet")]) == 1
+        assert list(storage.load().day_rank) == [5, 7, 6, 2, 1]
+
+    def test_compaction_failure(self, parquet_path, monkeypatch):
+        monkeypatch.setattr(storage_module, "COMPACT_AFTER", 2)
+        storage = ParquetStorage(parquet_path)
+        compact = ParquetStorage.compact
+
+        def fail(self):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(ParquetStorage, "compact", fail)
+        # saved, the failed compaction isn't the commit's
+        storage.append(None, "2020-01-04 20:00:00", {"day_rank": 9})
+        assert list(storage.load().day_rank) == [5, 7, 6, 9]
+
+        monkeypatch.setattr(ParquetStorage, "compact", compact)
+        storage.append(None, "2020-01-05 20:00:00", {"day_rank": 1})
+        assert list(storage.load().day_rank) == [5, 7, 6, 9, 1]
+        assert len(storage._manifest()["files"]) == 1
+
+    def test_migration_twice(self, parquet_path, csv_path):
+        with pytest.raises(FileExistsError):
+            ParquetStorage.from_frame(load_db(csv_path), parquet_path)
+
+
+class TestPartitionedStorage:
+    @pytest.fixture(params=["csv", "parquet"])
+    def storage(self, request, tmp_path, csv_path) -> PartitionedStorage:
+        if request.param == "parquet":
+            pytest.importorskip("pyarrow")
+
+        storage = PartitionedStorage.init(str(tmp_path / "users"), ("day_rank", "season", "temperature"), request.param)
+        storage.import_frame("me", load_db(csv_path))
+        return storage
+
+    def test_columns(self, storage):
+        assert storage.columns() == ("day_rank", "season", "temperature")
+
+    def test_load_own_rows(self, storage):
+        assert len(storage.load("me")) == 3
+
+    def test_unknown_user(self, storage):
+        check = lambda err: err.status_code == 404
+        with pytest.raises(HTTPException, check=check):
+            storage.load("you")
+
+    def test_new_user(self, storage):
+        storage.append("you", "2020-01-04 20:00:00", {"day_rank": 9, "season": "winter", "temperature": 0.5})
+
+        assert list(storage.load("you").day_rank) == [9]
+        assert len(storage.load("me")) == 3
+        summary = storage.summary()
+        assert (summary["columns"], summary["rows"], summary["users"]) == (3, 4, 2)
+
+    def test_append_existing_user(self, storage):
+        storage.append("me", "2020-01-04 20:00:00", {"day_rank": 9})
+        assert len(storage.load("me")) == 4
+
+    def test_reopen(self, storage):
+        storage.append("you", "2020-01-04 20:00:00", {"day_rank": 9, "season": "winter", "temperature": 0.5})
+        reopened = PartitionedStorage(storage.root, storage.backend)
+        assert len(reopened.load("you")) == 1
+
+    def test_groups(self, storage):
+        storage.append("you", "2020-01-04 20:00:00", {"day_rank": 9, "season": "winter", "temperature": 0.5})
+        groups = dict(storage.groups(columns=["day_rank"]))
+        assert list(groups) == ["me", "you"]
+        assert list(groups["you"].columns) == ["day_rank"]
+        assert list(dict(storage.groups(["you", "nobody"]))) == ["you"]
+
+    def test_metadata_from_the_index(self, storage, monkeypatch):
+        storage.append("you", "2020-01-04 20:00:00", {"day_rank": 9, "season": "winter", "temperature": 0.5})
+        storage.append("me", "2020-01-05 20:00:00", {"day_rank": 8})
+
+        def partition(self, user):
+            raise AssertionError("partition read")
+        with monkeypatch.context() as patch:
+            patch.setattr(PartitionedStorage, "partition", partition)
+            record = storage.metadata()
+        assert (record["rows"], record["users"]) == (5, 2)
+
+    def test_totals_repaired(self, storage):
+        # an index written before the totals, then totals left behind (a crash after a partition's write)
+        index = storage._index()
+        storage._write_index({key: value for key, value in index.items() if key != "totals"})
+        assert storage.metadata()["rows"] == 3
+        storage._write_index({**index, "totals": {**index["totals"], "rows": 2}})
+
+        report = storage.check()
+        assert not report["consistent"]
+        assert report["rows"] == 3
+        assert storage.metadata()["rows"] == 3
+        assert storage.check()["consistent"]
+
+    def test_user_not_a_path(self, storage):
+        storage.append("../../etc", "2020-01-04 20:00:00", {"day_rank": 9, "season": "winter", "temperature": 0.5})
+        assert PartitionedStorage.partition_name("../../etc").startswith("user-")
+        assert len(storage.load("../../etc")) == 1
+
+
+class TestSQLiteStorage:
+    @pytest.fixture
+    def storage(self, tmp_path, csv_path) -> SQLiteStorage:
+        return SQLiteStorage.from_frame(load_db(csv_path), str(tmp_path / "db.sqlite"), "me", pool_size=2)
+
+    def test_columns(self, storage):
+        assert storage.columns() == ("day_rank", "season", "temperature")
+
+    def test_same_as_csv(self, storage, csv_path):
+        db = storage.load("me")
+        assert db.shape == load_db(csv_path).shape
+        assert list(db.day_rank) == [5, 7, 6]
+        assert list(db.season) == ["winter"] * 3
+
+    def test_time_range(self, storage):
+        db = storage.load("me", columns=["day_rank"], since=Timestamp("2020-01-02"), until=Timestamp("2020-01-03"))
+        assert list(db.columns) == ["day_rank"]
+        assert list(db.day_rank) == [7]
+
+    def test_limit(self, storage):
+        db = storage.load("me", since=Timestamp("2020-01-02"), limit=1)
+        assert list(db.day_rank) == [7]
+
+    def test_iter_load(self, storage):
+        chunks = list(storage.iter_load("me", columns=["day_rank"], chunk_rows=2))
+        assert [list(chunk.day_rank) for chunk in chunks] == [[5, 7], [6]]
+        check = lambda err: err.status_code == 204
+        with pytest.raises(HTTPException, check=check):
+            next(storage.iter_load("nobody"))
+
+    def test_slow_streams(self, storage):
+        # as many half-read streams as pooled connections: the commits and the other reads still get one
+        streams = [storage.iter_load("me", chunk_rows=1) for _ in range(2)]
+        assert [len(next(stream)) for stream in streams] == [1, 1]
+
+        storage.append("me", "2020-01-04 20:00:00", {"day_rank": 9})
+        assert storage.summary()["rows"] == 4
+        assert [len(chunk) for chunk in streams[0]] == [1, 1]
+
+    def test_pool_busy(self, storage, monkeypatch):
+        monkeypatch.setattr(storage_module, "POOL_TIMEOUT", 0.05)
+        check = lambda err: err.status_code == 503
+        with storage._pool.connection(), storage._pool.connection():
+            with pytest.raises(HTTPException, check=check):
+                storage.summary()
+        assert storage.summary()["rows"] == 3
+
+    def test_users_apart(self, storage):
+        storage.append("you", "2020-01-04 20:00:00", {"day_rank": 9})
+
+        assert list(storage.load("you").day_rank) == [9]
+        assert len(storage.load("me")) == 3
+        summary = storage.summary()
+        assert (summary["columns"], summary["rows"], summary["users"]) == (3, 4, 2)
+
+    def test_duplicate_datetime(self, storage):
+        check = lambda err: err.status_code == 409
+        with pytest.raises(HTTPException, check=check):
+            storage.append("me", "2020-01-01 20:00:00", {"day_rank": 9})
+
+    def test_batch_all_or_nothing(self, storage):
+        with pytest.raises(HTTPException):
+            storage.append_many("me", [("2020-01-04 20:00:00", {"day_rank": 1}),
+                                       ("2020-01-01 20:00:00", {"day_rank": 2})])
+        assert len(storage.load("me")) == 3
+
+    def test_migration_failed(self, tmp_path, csv_path):
+        db = load_db(csv_path)
+        path = str(tmp_path / "new.sqlite")
+        check = lambda err: err.status_code == 409
+        with pytest.raises(HTTPException, check=check):
+            SQLiteStorage.from_frame(concat([db, db.iloc[:1]]), path, "me")
+        # neither an empty database nor a temporary one is left
+        assert not [name for name in listdir(tmp_path) if name.startswith("new.sqlite")]
+
+        assert len(SQLiteStorage.from_frame(db, path, "me").load("me")) == 3
+        assert not [name for name in listdir(tmp_path) if name.startswith("new.sqlite.tmp")]
+
+    def test_rows_counted_once(self, storage):
+        # a database from before the per-user row counts
+        storage._pool.close()
+        with sqlite3.connect(storage.path) as connection:
+            connection.execute("DROP TABLE versions")
+            connection.execute('CREATE TABLE versions ("user" TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID')
+            connection.execute("INSERT INTO versions VALUES ('me', 1)")
+        connection.close()
+        assert SQLiteStorage(storage.path).rows("me") == 3
+
+    def test_rows_repaired(self, storage):
+        with storage._pool.connection() as connection, connection:
+            connection.execute('UPDATE versions SET "rows" = 1')
+        report = storage.check()
+        assert not report["consistent"]
+        assert storage.rows("me") == 3
+        assert storage.check()["consistent"]
+
+    def test_factory(self, storage):
+        assert get_storage(storage.path, "sqlite").columns() == storage.columns()
+
+    def test_groups(self, storage):
+        storage.append("you", "2020-01-04 20:00:00", {"day_rank": 9})
+        assert storage.users() == ["me", "you"]
+        assert {user: len(db) for user, db in storage.groups()} == {"me": 3, "you": 1}
+        # chunked: consecutive groups of the same user
+        assert [(user, len(db)) for user, db in storage.groups(chunk_rows=2)] == [("me", 2), ("me", 1), ("you", 1)]
+
+    def test_not_partitioned(self, tmp_path):
+        with pytest.raises(ValueError):
+            PartitionedStorage(str(tmp_path), "sqlite")
+
+
+class TestMetadata:
+    @pytest.fixture(params=["csv", "parquet", "sqlite", "per_user"])
+    def storage(self, request, tmp_path, csv_path):
+        if request.param in ("parquet", "per_user"):
+            pytest.importorskip("pyarrow")
+
+        db = load_db(csv_path)
+        if request.param == "csv":
+            return CSVStorage(csv_path)
+        if request.param == "parquet":
+            return ParquetStorage.from_frame(db, str(tmp_path / "db.parquet"))
+        if request.param == "sqlite":
+            return SQLiteStorage.from_frame(db, str(tmp_path / "db.sqlite"), "me")
+
+        storage = PartitionedStorage.init(str(tmp_path / "users"), tuple(db.columns), "parquet")
+        storage.import_frame("me", db)
+        return storage
+
+    def test_initial_record(self, storage):
+        record = storage.metadata()
+        assert record["rows"] == 3
+        assert record["columns"] == ["day_rank", "season", "temperature"]
+
+    def test_commit_without_scan(self, storage, monkeypatch):
+        storage.metadata()
+        version = storage.metadata()["version"]
+
+        def scan(self):
+            raise AssertionError("full scan")
+        monkeypatch.setattr(storage_module.Storage, "_scan", scan)
+        monkeypatch.setattr(storage_module.Storage, "load", scan)
+
+        storage.append("me", "2020-01-04 20:00:00", {"day_rank": 9})
+        record = storage.metadata()
+        assert record["rows"] == 4
+        assert record["version"] == version + 1
+        assert record["last_commit"] is not None
+
+    def test_deep(self, storage):
+        storage.metadata()
+        report = storage.summary(deep=True)
+        assert report["rows"] == 3
+        assert report["consistent"]
+        assert report["duplicates"] == 0
+
+    def test_version(self, storage):
+        version = storage.version("me")
+        assert storage.version("me") == version
+
+        storage.append("me", "2020-01-04 20:00:00", {"day_rank": 9})
+        assert storage.version("me") != version
+
+    def test_version_per_user(self, storage):
+        if isinstance(storage, (CSVStorage, ParquetStorage)):
+            pytest.skip("shared by everybody, any commit changes the version")
+
+        version = storage.version("me")
+        storage.append("you", "2020-01-04 20:00:00", {"day_rank": 9})
+        assert storage.version("me") == version
+
+    def test_rows(self, storage):
+        assert storage.rows("me") == 3
+        # before the latest datetime, as a backfill
+        storage.append("me", "2019-12-31 20:00:00", {"day_rank": 9})
+        assert storage.rows("me") == 4
+
+        if not isinstance(storage, (CSVStorage, ParquetStorage)):
+            storage.append("you", "2020-01-04 20:00:00", {"day_rank": 9})
+            assert storage.rows("me") == 4 and storage.rows("you") == 1
+
+
+class TestStaleMetadata:
+    def test_changed_behind_the_back(self, csv_path):
+        storage = CSVStorage(csv_path)
+        version = storage.metadata()["version"]
+
+        with open(csv_path, mode="a") as f:
+            f.write("2020-01-04 20:00:00,9,winter,0.5\n")
+
+        record = storage.metadata()
+        assert record["rows"] == 4
+        assert record["version"] == version + 1
+
+    def test_deep_repairs(self, csv_path):
+        storage = CSVStorage(csv_path)
+        store = storage._metadata_store()
+        store.write({**storage.metadata(), "rows": 100})
+
+        report = storage.summary(deep=True)
+        assert not report["consistent"]
+        assert storage.metadata()["rows"] == 3
+
+    def test_empty(self, tmp_path):
+        path = tmp_path / "db.csv"
+        path.write_text("datetime,day_rank\n")
+
+        check = lambda err: err.status_code == 204
+        with pytest.raises(HTTPException, check=check):
+            CSVStorage(str(path)).summary()
+
+    def test_compaction_keeps_record(self, parquet_path, monkeypatch):
+        monkeypatch.setattr(storage_module, "COMPACT_AFTER", 2)
+        storage = ParquetStorage(parquet_path)
+        storage.metadata()
+        storage.append(None, "2020-01-04 20:00:00", {"day_rank": 2})
+
+        monkeypatch.setattr(ParquetStorage, "_scan", lambda self: pytest.fail("full scan"))
+        assert storage.metadata()["rows"] == 4
@@ -0,0 +1,97 @@
+# tested objects
+from db_handler.streaming import (
+    ARROW_STREAM, NDJSON, negotiate, ndjson_chunks, arrow_chunks, export_ndjson, export_arrow
+)
+from db_handler.utility import index_by_datetime
+from db_handler.schema import cast
+
+# testing related
+import pytest
+import json
+from pandas import DataFrame
+
+"""
+No server needed to test, only pytest
+
+To test run
+docker container exec --tty db_handler pytest /app/db_handler/tests/test_streaming.py -vv --tb=line
+"""
+
+db = index_by_datetime(DataFrame(
+    {"day_rank": [1, 2, 3, 4, 5], "season": ["winter", None, "winter", "winter", "spring"]},
+    index=[f"2020-01-0{i} 20:00:00" for i in range(1, 6)]
+))
+
+
+def test_negotiate():
+    assert negotiate(None) == "application/json"
+    assert negotiate("*/*") == "application/json"
+    assert negotiate(f"{NDJSON}") == NDJSON
+    assert negotiate(f"text/html, {ARROW_STREAM};q=0.9") == ARROW_STREAM
+
+
+def test_ndjson_chunked():
+    chunks = list(ndjson_chunks(db, chunk_rows=2))
+    assert len(chunks) == 3
+
+    rows = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+    assert rows[0] == {"datetime": "2020-01-01 20:00:00", "day_rank": 1, "season": "winter"}
+    assert rows[1]["season"] is None
+    assert len(rows) == 5
+
+
+def test_arrow_chunked():
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+
+    reader = pyarrow.ipc.open_stream(b"".join(arrow_chunks(db, chunk_rows=2)))
+    batches = list(reader)
+    assert [batch.num_rows for batch in batches] == [2, 2, 1]
+
+    got = pyarrow.Table.from_batches(batches).to_pandas()
+    assert list(got.index) == list(db.index)
+    assert list(got.day_rank) == [1, 2, 3, 4, 5]
+
+
+def test_from_storage_chunks():
+    ipc = pytest.importorskip("pyarrow.ipc")
+    # as read by Storage.iter_load: the first chunk fixes the schema, its seasons all missing
+    chunks = [cast(db.iloc[1:2].assign(season=[None])), cast(db.iloc[2:])]
+
+    data = ipc.open_stream(b"".join(arrow_chunks(iter(chunks), chunk_rows=2))).read_pandas()
+    assert list(data.day_rank) == [2, 3, 4, 5]
+    assert list(data.season) == [None, "winter", "winter", "spring"]
+    assert len(b"".join(ndjson_chunks(iter(chunks), chunk_rows=2)).splitlines()) == 4
+
+
+def test_export_ndjson():
+    rows = [json.loads(line) for line in b"".join(export_ndjson([("me", db), ("you", db.head(1))], 2)).splitlines()]
+    assert [row["user"] for row in rows] == ["me"] * 5 + ["you"]
+    assert rows[-1] == {"user": "you", "datetime": "2020-01-01 20:00:00", "day_rank": 1, "season": "winter"}
+
+
+def test_export_arrow():
+    ipc = pytest.importorskip("pyarrow.ipc")
+    typed = cast(db)
+    # the second user's seasons are all missing: the types are still the declared ones
+    other = cast(db.head(2).assign(season=[None, None]))
+
+    data = ipc.open_stream(b"".join(export_arrow([("me", typed), ("you", other)], 2))).read_pandas()
+    assert list(data.columns) == ["user", "day_rank", "season"]
+    assert list(data.user) == ["me"] * 5 + ["you"] * 2
+    assert list(data.season[:2]) == ["winter", None]
+
+
+def test_export_other_columns():
+    ipc = pytest.importorskip("pyarrow.ipc")
+    # the first user fixes the columns: the ones the next lack are null, the extra ones are left out
+    first = cast(db.head(2))
+    other = cast(db.head(1)[["day_rank"]]).assign(temperature=[20.5])
+
+    data = ipc.open_stream(b"".join(export_arrow([("me", first), ("you", other)], 2))).read_pandas()
+    assert list(data.columns) == ["user", "day_rank", "season"]
+    assert data.season.iloc[-1] is None
+
+
+def test_export_nothing():
+    assert b"".join(export_arrow([], 2)) == b""
@@ -12,6 +12,14 @@ from db_handler.utility import (
     load_db,
     validate_columns,
     validate_post_data,
+    read_columns,
+    append_row,
+    repair_tail,
+    index_by_datetime,
+    paginate,
+    validate_get_data,
+    validate_batch,
+    BatchCommitPayload,
     GetPayload,
     CommitPayload
 )
@@ -19,6 +27,7 @@ from db_handler.utility import (
 # testing related
 import pytest
 from random import sample
+from pandas import DataFrame, Timestamp
 
 """
 No server needed to test, only pytest
@@ -207,3 +216,156 @@ class TestCommitDataValidator:
     def test_everything_good(self):
         model = CommitPayload(user="me", datetime="2020-01-01 20:00:00", data={"a": "A", "b": "B"})
         validate_post_data(model)
+
+    def test_zero_values(self):
+        model = CommitPayload(user="me", datetime="2020-01-01 20:00:00", data={"temperature": 0.0, "day_rank": 0})
+        validate_post_data(model)
+
+
+class TestAppend:
+    header = "datetime,day_rank,season,temperature\n"
+    row = "2020-01-01 20:00:00,5,winter,1.5\n"
+
+    def test_append_ordered_as_header(self, tmp_path):
+        path = tmp_path / "db.csv"
+        path.write_text(self.header + self.row)
+
+        columns = read_columns(str(path))
+        append_row(str(path), "2020-01-02 20:00:00", {"temperature": 2.5, "day_rank": 7}, columns)
+
+        assert path.read_text().endswith("2020-01-02 20:00:00,7,,2.5\n")
+        assert len(load_db(str(path))) == 2
+
+    def test_append_quotes(self, tmp_path):
+        path = tmp_path / "db.csv"
+        path.write_text(self.header + self.row)
+
+        append_row(str(path), "2020-01-02 20:00:00", {"season": "early, cold \"spring\""}, read_columns(str(path)))
+        assert load_db(str(path)).iloc[-1]["season"] == 'early, cold "spring"'
+
+    def test_append_to_unterminated_header(self, tmp_path):
+        path = tmp_path / "db.csv"
+        path.write_text(self.header.strip())
+
+        append_row(str(path), "2020-01-02 20:00:00", {"day_rank": 7}, read_columns(str(path)))
+        assert len(load_db(str(path))) == 1
+
+    def test_repair_torn_line(self, tmp_path):
+        path = tmp_path / "db.csv"
+        path.write_text(self.header + self.row + "2020-01-02 20:0")
+
+        assert repair_tail(str(path))
+        assert path.read_text() == self.header + self.row
+
+    def test_repair_unterminated_line(self, tmp_path):
+        # as many fields as the header, but the last one may be cut short: "1.5" of "1.55"
+        path = tmp_path / "db.csv"
+        path.write_text(self.header + self.row + self.row.strip())
+
+        assert repair_tail(str(path))
+        assert path.read_text() == self.header + self.row
+
+    def test_repair_on_load(self, tmp_path):
+        path = tmp_path / "db.csv"
+        path.write_text(self.header + self.row + "2020-01-02 20:00:00,7")
+
+        assert len(load_db(str(path))) == 1
+
+    def test_no_repair_needed(self, tmp_path):
+        path = tmp_path / "db.csv"
+        path.write_text(self.header + self.row)
+
+        assert not repair_tail(str(path))
+        assert path.read_text() == self.header + self.row
+
+    def test_bad_header(self, tmp_path):
+        path = tmp_path / "db.csv"
+        path.write_text("index,a,b\n")
+        check = check_factory(500, "no datetime index")
+
+        with pytest.raises(HTTPException, check=check):
+            read_columns(str(path))
+
+
+class TestPaginate:
+    db = index_by_datetime(DataFrame(
+        {"day_rank": [1, 2, 3, 4, 5, 6]},
+        index=["2020-01-03 20:00:00", "2020-01-01 20:00:00", "2020-01-02 20:00:00",
+               "2020-01-02 20:00:00", "2020-01-02 20:00:00", "2020-01-04 20:00:00"]
+    ))
+
+    def test_sorted_stable(self):
+        assert list(self.db.day_rank) == [2, 3, 4, 5, 1, 6]
+
+    def test_time_range(self):
+        page, cursor = paginate(self.db, Timestamp("2020-01-02"), Timestamp("2020-01-04"))
+        assert list(page.day_rank) == [3, 4, 5, 1]
+        assert cursor is None
+
+    def test_all_pages(self):
+        for limit in range(1, 8):
+            got, cursor = [], None
+            while True:
+                page, cursor = paginate(self.db, None, None, limit, cursor)
+                got.extend(page.day_rank)
+                if cursor is None:
+                    break
+            assert got == [2, 3, 4, 5, 1, 6], f"limit {limit}"
+
+    def test_pages_within_range(self):
+        page, cursor = paginate(self.db, Timestamp("2020-01-02"), None, 2)
+        assert list(page.day_rank) == [3, 4]
+
+        page, cursor = paginate(self.db, Timestamp("2020-01-02"), None, 2, cursor)
+        assert list(page.day_rank) == [5, 1]
+
+        page, cursor = paginate(self.db, Timestamp("2020-01-02"), None, 2, cursor)
+        assert list(page.day_rank) == [6]
+        assert cursor is None
+
+    def test_bad_cursor(self):
+        check = check_factory(400, "Bad cursor")
+        with pytest.raises(HTTPException, check=check):
+            validate_get_data(GetPayload(user="me", cursor="hello world"))
+
+    def test_bad_since(self):
+        check = check_factory(400, "Bad since")
+        with pytest.raises(HTTPException, check=check):
+            validate_get_data(GetPayload(user="me", since="yesterday-ish"))
+
+
+class TestBatchValidator:
+    db_columns = ("a", "b", "c")
+
+    @staticmethod
+    def payload(*rows) -> BatchCommitPayload:
+        return BatchCommitPayload(user="me", rows=[{"datetime": dt, "data": data} for dt, data in rows])
+
+    def test_good(self):
+        validate_batch(self.payload(("2020-01-01 20:00:00", {"a": 1}), ("2020-01-02 20:00:00", {"b": 2, "c": "C"})),
+                       self.db_columns)
+
+    def test_zero_values(self):
+        validate_batch(self.payload(("2020-01-01 20:00:00", {"a": 0.0}), ("2020-01-02 20:00:00", {"b": 0, "c": 0.0})),
+                       self.db_columns)
+
+    def test_no_rows(self):
+        check = check_factory(400, "No rows to commit")
+        with pytest.raises(HTTPException, check=check):
+            validate_batch(self.payload(), self.db_columns)
+
+    def test_bad_columns(self):
+        check = check_factory(400, "Some columns in the payload are not in the database: x,y")
+        with pytest.raises(HTTPException, check=check):
+            validate_batch(self.payload(("2020-01-01 20:00:00", {"a": 1, "y": 2}), ("2020-01-02 20:00:00", {"x": 2})),
+                           self.db_columns)
+
+    def test_bad_index(self):
+        check = check_factory(400, "Bad index in the rows: [1]")
+        with pytest.raises(HTTPException, check=check):
+            validate_batch(self.payload(("2020-01-01 20:00:00", {"a": 1}), ("hello world", {"b": 2})), self.db_columns)
+
+    def test_empty_data(self):
+        check = check_factory(400, "Columns (data) are empty in the rows: [0]")
+        with pytest.raises(HTTPException, check=check):
+            validate_batch(self.payload(("2020-01-01 20:00:00", {})), self.db_columns)
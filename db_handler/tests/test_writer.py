@@ -0,0 +1,141 @@
+# bridge to the fastapi
+from fastapi import HTTPException
+
+# tested objects
+from db_handler.writer import Writer
+from db_handler.storage import CSVStorage, PartitionedStorage, Rejected
+from db_handler.locking import lock_for
+from db_handler.utility import load_db
+
+# testing related
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+"""
+No server needed to test, only pytest
+
+To test run
+docker container exec --tty db_handler pytest /app/db_handler/tests/test_writer.py -vv --tb=line
+"""
+
+CSV = "datetime,day_rank,temperature\n2020-01-01 20:00:00,5,10.5\n"
+
+
+class CountingStorage(CSVStorage):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.writes = 0
+
+    def append_many(self, user, rows):
+        self.writes += 1
+        if any(data.get("day_rank") == "bad" for _, data in rows):
+            raise Rejected(status_code=400, detail="bad row")
+        super().append_many(user, rows)
+
+
+@pytest.fixture
+def storage(tmp_path) -> CountingStorage:
+    path = tmp_path / "db.csv"
+    path.write_text(CSV)
+    return CountingStorage(str(path))
+
+
+def test_commits_in_order(storage):
+    writer = Writer(storage)
+    futures = [writer.submit("me", [(f"2020-02-{i + 1:02d} 20:00:00", {"day_rank": i})]) for i in range(5)]
+    for future in futures:
+        future.result(timeout=5)
+    writer.close()
+
+    assert list(load_db(storage.path).day_rank) == [5, 0, 1, 2, 3, 4]
+
+
+def test_concurrent_commits_merged(storage):
+    writer = Writer(storage, window=0.2)
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        list(pool.map(
+            lambda i: writer.submit("me", [(f"2020-02-{i + 1:02d} 20:00:00", {"day_rank": i})]).result(timeout=5),
+            range(10)
+        ))
+    writer.close()
+
+    assert len(load_db(storage.path)) == 11
+    assert storage.writes < 10
+    assert writer.stats()["commits"] == 10
+
+
+def test_bad_commit_isolated(storage):
+    writer = Writer(storage, window=0.2)
+    futures = [
+        writer.submit("me", [(f"2020-02-{i + 1:02d} 20:00:00", {"day_rank": "bad" if i == 0 else i})])
+        for i in range(4)
+    ]
+
+    with pytest.raises(HTTPException):
+        futures[0].result(timeout=5)
+    for future in futures[1:]:
+        future.result(timeout=5)
+    writer.close()
+
+    assert len(load_db(storage.path)) == 4
+
+
+def test_failure_after_the_write(storage, monkeypatch):
+    # the rows are on disk when the metadata record fails to be written
+    record_commit = CSVStorage._record_commit
+
+    def fail_once(self, *args):
+        monkeypatch.setattr(CSVStorage, "_record_commit", record_commit)
+        raise HTTPException(status_code=500, detail="disk full")
+
+    monkeypatch.setattr(CSVStorage, "_record_commit", fail_once)
+    writer = Writer(storage, window=0.2)
+    futures = [writer.submit("me", [(f"2020-02-{i + 1:02d} 20:00:00", {"day_rank": i})]) for i in range(3)]
+
+    for future in futures:
+        with pytest.raises(HTTPException, check=lambda err: err.status_code == 500):
+            future.result(timeout=5)
+    writer.close()
+
+    # written once, never again
+    assert storage.writes == 1
+    assert list(load_db(storage.path).day_rank) == [5, 0, 1, 2]
+
+
+def test_failure_after_a_partition_write(storage, tmp_path, monkeypatch):
+    partitioned = PartitionedStorage.init(str(tmp_path / "users"), ("day_rank", "temperature"))
+    partitioned.import_frame("me", load_db(storage.path))
+    record_totals = PartitionedStorage._record_totals
+
+    def fail_once(self, *args, **kwargs):
+        monkeypatch.setattr(PartitionedStorage, "_record_totals", record_totals)
+        raise OSError("disk full")
+
+    monkeypatch.setattr(PartitionedStorage, "_record_totals", fail_once)
+    writer = Writer(partitioned, window=0.2)
+    futures = [writer.submit("me", [(f"2020-02-{i + 1:02d} 20:00:00", {"day_rank": i})]) for i in range(2)]
+    for future in futures:
+        with pytest.raises(OSError):
+            future.result(timeout=5)
+    writer.close()
+
+    assert list(partitioned.load("me").day_rank) == [5, 0, 1]
+
+
+def test_snapshot_reads_during_write(storage):
+    snapshot = storage.load()
+    writer = Writer(storage)
+
+    # a commit of another process holds the file lock, the reader is served from the snapshot meanwhile
+    with lock_for(storage.path).exclusive():
+        future = writer.submit("me", [("2020-02-01 20:00:00", {"day_rank": 1})])
+        sleep(0.1)
+        assert not future.done()
+        assert storage.load() is snapshot
+
+    future.result(timeout=5)
+    writer.close()
+    assert len(storage.load()) == 2
+    assert len(snapshot) == 1
@@ -1,9 +1,24 @@
 # Network related
 from fastapi import HTTPException
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 # parsing related
-from pandas import read_csv, DataFrame
+from pandas import read_csv, DataFrame, DatetimeIndex, Series, Timestamp, to_datetime
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from hashlib import sha1
+import csv
+from io import StringIO
+
+# IO related
+from os import fsync, SEEK_END
+from db_handler.locking import lock_for
+
+# hot path timing
+from common.instrumentation import span, timed
+
+# declared column types
+from db_handler.schema import cast, check_values, plain, read_csv_types
+from collections import Counter
 
 # typing related
 from pydantic import validate_call as enforce_types
@@ -14,6 +29,12 @@ class GetPayload(BaseModel):
     user: str
     columns: List[str] = None
 
+    # time range [since; until) and pagination
+    since: str = None
+    until: str = None
+    limit: int = Field(None, gt=0)
+    cursor: str = None
+
     model_config = ConfigDict(extra='forbid')
 
 
@@ -25,8 +46,31 @@ class CommitPayload(BaseModel):
     model_config = ConfigDict(extra='forbid')
 
 
-@enforce_types
-def validate_columns(payload: Union[GetPayload | CommitPayload], columns: Tuple[str, ...]) -> None:
+class CommitRow(BaseModel):
+    datetime: str
+    data: Dict[str, Union[int, float, str]]
+
+    model_config = ConfigDict(extra='forbid')
+
+
+class BatchCommitPayload(BaseModel):
+    user: str
+    rows: List[CommitRow]
+
+    model_config = ConfigDict(extra='forbid')
+
+
+class ExportPayload(BaseModel):
+    # all the users if not given
+    users: List[str] = None
+    columns: List[str] = None
+
+    model_config = ConfigDict(extra='forbid')
+
+
+# not type enforced: called on every request, the payloads are pydantic models already
+@timed("validate_columns")
+def validate_columns(payload: Union[GetPayload | ExportPayload | CommitPayload], columns: Tuple[str, ...]) -> None:
     """
     Incoming JSON validator. Cross validates incoming columns with the ones in the database
     Why: incorporating this into the GetPayload would bring over-proportional complexity
@@ -39,13 +83,14 @@ def validate_columns(payload: Union[GetPayload | CommitPayload], columns: Tuple[
     if not columns:
         raise ValueError("Passed database columns are empty") # FIXME: inconsistent error handling
 
-    got_columns: list = payload.columns if isinstance(payload, GetPayload) else payload.data.keys()
+    reading = isinstance(payload, (GetPayload, ExportPayload))
+    got_columns: list = payload.columns if reading else payload.data.keys()
     if got_columns:
         got_columns = list(got_columns)
     else:
         got_columns = []
 
-    if isinstance(payload, GetPayload) and not got_columns:
+    if reading and not got_columns:
         return
 
     if isinstance(payload, CommitPayload) and not got_columns:
@@ -54,10 +99,11 @@ def validate_columns(payload: Union[GetPayload | CommitPayload], columns: Tuple[
             detail=f"Columns (data) are empty"
         )
 
-    if len(got_columns) != len(set(got_columns)):
+    counts = Counter(got_columns)
+    if len(counts) != len(got_columns):
         raise HTTPException(
             status_code=400,
-            detail=f"There are duplicates in the requested columns: {",".join(filter(lambda x: got_columns.count(x) > 1, got_columns))}"
+            detail=f"There are duplicates in the requested columns: {",".join(col for col, n in counts.items() if n > 1)}"
         )
 
     if not set(got_columns).issubset(columns):
@@ -85,26 +131,213 @@ def validate_post_data(payload: CommitPayload) -> None:
             detail="No data to commit"
         )
 
-    # raise if any value is None or similar
-    if not all(map(bool, payload.data.values())):
+    # raise if any value is missing, 0 and 0.0 are values (e.g. a temperature)
+    if any(value is None for value in payload.data.values()):
         raise HTTPException(
             status_code=400,
             detail="Some values are None"
         )
 
 
+def validate_batch(payload: BatchCommitPayload, columns: Tuple[str, ...]) -> None:
+    """
+    Same rules as validate_columns and validate_post_data, checked for all the rows in one pass.
+    The datetimes are parsed at once instead of row by row.
+
+    :param payload: The incoming JSON object
+    :param columns: Columns in the database
+    :return: None
+    :raises 400: if any of the rows is bad, listing the row numbers
+    """
+    if not payload.rows:
+        raise HTTPException(status_code=400, detail="No rows to commit")
+
+    known = set(columns)
+    unknown, empty, nones, mistyped = set(), [], [], []
+    for i, row in enumerate(payload.rows):
+        if not row.data:
+            empty.append(i)
+        unknown.update(row.data.keys() - known)
+        # 0 and 0.0 are values, only None is missing
+        if any(value is None for value in row.data.values()):
+            nones.append(i)
+        mistyped.extend(check_values([(i, row.data)]))
+
+    if empty:
+        raise HTTPException(status_code=400, detail=f"Columns (data) are empty in the rows: {empty}")
+
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Some columns in the payload are not in the database: {",".join(sorted(unknown))}"
+        )
+
+    index = to_datetime(Series([row.datetime for row in payload.rows]), format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    if index.isna().any():
+        raise HTTPException(status_code=400, detail=f"Bad index in the rows: {list(index.index[index.isna()])}")
+
+    if nones:
+        raise HTTPException(status_code=400, detail=f"Some values are None in the rows: {nones}")
+
+    if mistyped:
+        raise HTTPException(status_code=400, detail=f"Values don't match the schema: {'; '.join(mistyped)}")
+
+
+@enforce_types
+def validate_get_data(payload: GetPayload) -> None:
+    """
+    Check the time range and the cursor of a GET payload
+    :param payload: The incoming JSON object
+    :return: None
+    :raises 400: if a bound or the cursor can't be parsed
+    """
+    for name in ("since", "until"):
+        value = getattr(payload, name)
+        if value is None:
+            continue
+        try:
+            Timestamp(value)
+        except Exception as err:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Bad {name}: {type(err).__name__} - {err}"
+            )
+
+    if payload.cursor is not None:
+        decode_cursor(payload.cursor)
+
+
+def encode_cursor(position: Timestamp, skip: int) -> str:
+    """
+    Opaque pagination cursor: the datetime of the last returned row
+    and how many rows with exactly that datetime have been returned so far.
+    Unlike a row number it stays valid when rows are committed in between pages.
+    """
+    return urlsafe_b64encode(f"{position.isoformat()}|{skip}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Timestamp, int]:
+    """
+    :param cursor: as per encode_cursor
+    :return: (datetime of the last returned row, number of returned rows with that datetime)
+    :raises 400: if the cursor is malformed
+    """
+    try:
+        position, skip = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return Timestamp(position), int(skip)
+    except Exception:
+        raise HTTPException(status_code=400, detail=f"Bad cursor: {cursor}")
+
+
+def entity_tag(version: str, payload: GetPayload, media_type: str) -> str:
+    """
+    ETag of a /get response: the same data version, request and format always give the same bytes
+    :param version: Storage.version of the user
+    :param payload: The request
+    :param media_type: The negotiated format
+    :return: a strong, quoted ETag
+    """
+    request = payload.model_dump_json()
+    return '"' + sha1(f"{version}|{request}|{media_type}".encode()).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    :param if_none_match: The If-None-Match header, e.g. '"abc", W/"def"' or '*'
+    :param etag: The current ETag
+    :return: whether the client's copy is the current one
+    """
+    if not if_none_match:
+        return False
+    # weak comparison, as RFC 9110 asks for If-None-Match
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def index_by_datetime(db: DataFrame) -> DataFrame:
+    """
+    Turn the index into a sorted DatetimeIndex, so that time ranges are found by binary search
+    :param db: The database, indexed by datetime strings or Timestamps
+    :return: the same data with a sorted DatetimeIndex (the original frame if it already has one)
+    :raises 500: if the index can't be parsed
+    """
+    if not isinstance(db.index, DatetimeIndex):
+        try:
+            index = to_datetime(db.index, format="ISO8601")
+        except Exception as err:
+            raise HTTPException(
+                status_code=500,
+                detail="An error occurred while importing the database:\n"
+                       f"{type(err).__name__} - {err}"
+            )
+        db = db.set_axis(index.rename("datetime"), axis="index")
+
+    if not db.index.is_monotonic_increasing:
+        # stable, rows committed with the same datetime keep their order
+        db = db.sort_index(kind="stable")
+    return db
+
+
+def paginate(db: DataFrame, since: Timestamp | None, until: Timestamp | None,
+             limit: int | None = None, cursor: str | None = None) -> Tuple[DataFrame, str | None]:
+    """
+    Cut a time range and a page out of a frame with a sorted DatetimeIndex.
+    The bounds are binary searched: O(log N + k) for a page of k rows.
+
+    :param db: Frame as per index_by_datetime
+    :param since: only rows with datetime >= since
+    :param until: only rows with datetime < until
+    :param limit: maximum number of rows to return
+    :param cursor: the next_cursor of the previous page
+    :return: the page and the cursor of the next one (None if this is the last page)
+    """
+    skip = 0
+    if cursor is not None:
+        position, skip = decode_cursor(cursor)
+        if since is None or since <= position:
+            since = position
+        else:
+            skip = 0
+
+    index = db.index
+    start = index.searchsorted(since, side="left") if since is not None else 0
+    stop = index.searchsorted(until, side="left") if until is not None else len(index)
+    start = min(start + skip, stop)
+
+    if limit is None or stop - start <= limit:
+        return db.iloc[start:stop], None
+
+    end = start + limit
+    last = index[end - 1]
+    returned_with_last = end - index.searchsorted(last, side="left")
+    return db.iloc[start:end], encode_cursor(last, returned_with_last)
+
+
+@timed("load_db")
 @enforce_types
 def load_db(path: str) -> DataFrame:
     """
-    Import the database while checking its integrity and correctness
+    Import the database while checking its integrity and correctness.
+    The columns declared in the schema are read with their dtypes instead of inferring them.
 
     :param path: Path to the db
-    :return: pandas DataFrame of the database
+    :return: pandas DataFrame of the database, with a DatetimeIndex unless the index couldn't be parsed
     :raises 500: if the pandas import failed
     :raises 204: if the database file is empty
     """
+    repair_tail(path)
     try:
-        db = read_csv(path, index_col="datetime")
+        # a writer in another process can't be halfway through the file meanwhile
+        with lock_for(path).shared():
+            with open(path, mode="r", newline="") as f:
+                header = next(csv.reader(f), [])
+            dtypes, dates = read_csv_types(tuple(header[1:]))
+            try:
+                db = read_csv(path, index_col="datetime", dtype=dtypes, parse_dates=dates, date_format="ISO8601")
+            except (TypeError, ValueError):
+                # e.g. a day_rank written as 7.0 by the rewrite mode of old: inferred, then cast
+                db = read_csv(path, index_col="datetime", parse_dates=dates, date_format="ISO8601")
+        db = cast(db)
     except Exception as err:
         raise HTTPException(
             status_code=500,
@@ -116,3 +349,154 @@ def load_db(path: str) -> DataFrame:
         raise HTTPException(status_code=204, detail=f"The database at {path} is empty")
 
     return db
+
+
+def to_payload(db: DataFrame) -> dict:
+    """
+    Serialize a frame the way /get returns it
+    :param db: The (partial) database
+    :return: dict with the following keys: columns, index, data.
+    """
+    # the storage keeps typed columns and a real datetime index, the contract is plain strings and numbers
+    with span("to_dict"):
+        return plain(db).to_dict(orient="split")
+
+
+@enforce_types
+def read_columns(path: str) -> Tuple[str, ...]:
+    """
+    Read only the header of the database, without parsing the rows
+
+    :param path: Path to the db
+    :return: the columns of the database, without the index label
+    :raises 500: if the header can't be read or has no datetime index
+    """
+    try:
+        with open(path, mode="r", newline="") as f:
+            header = next(csv.reader(f))
+    except Exception as err:
+        raise HTTPException(
+            status_code=500,
+            detail="An error occurred while importing the database:\n"
+                   f"{type(err).__name__} - {err}"
+        )
+
+    if not header or header[0] != "datetime":
+        raise HTTPException(status_code=500, detail=f"The database at {path} has no datetime index column")
+
+    return tuple(header[1:])
+
+
+@enforce_types
+def repair_tail(path: str) -> bool:
+    """
+    Detect and repair a torn last line, e.g. left behind by a commit which crashed mid-write.
+    Every append ends with the line terminator, so an unterminated last line is cut off,
+    even if it has as many fields as the header: its last one may be cut short.
+
+    :param path: Path to the db
+    :return: True if the file was modified
+    """
+    # the common case, checked without locking: a properly terminated (or missing) file
+    try:
+        with open(path, mode="rb") as f:
+            size = f.seek(0, SEEK_END)
+            if size == 0:
+                return False
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return False
+    except OSError:
+        # not ours to report, load_db will
+        return False
+
+    with lock_for(path).exclusive(), open(path, mode="rb+") as f:
+        size = f.seek(0, SEEK_END)
+        if size == 0:
+            return False
+
+        # checked again, a writer may have completed the line in the meantime
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return False
+
+        # walk backwards until the start of the last line
+        tail, pos = b"", size
+        while pos > 0 and b"\n" not in tail:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+
+        last_line = tail.rsplit(b"\n", 1)[-1]
+        line_start = size - len(last_line)
+
+        f.seek(0)
+        header = next(csv.reader([f.readline().decode(errors="replace")]))
+        fields = next(csv.reader([last_line.decode(errors="replace")]), [])
+
+        # the header and over-long rows are not torn appends, load_db reports those
+        if line_start == 0 or len(fields) > len(header):
+            return False
+
+        f.truncate(line_start)
+
+        f.flush()
+        fsync(f.fileno())
+    return True
+
+
+@enforce_types
+def append_row(path: str, index: str, data: Dict[str, Union[int, float, str, None]], columns: Tuple[str, ...]) -> None:
+    """
+    Append a single row to the database without rewriting the file.
+    The line is ordered as the header, quoted the same way pandas does and fsync'ed before returning.
+
+    :param path: Path to the db
+    :param index: The datetime index of the row
+    :param data: column -> value, the missing columns are left empty
+    :param columns: Columns of the database (as per read_columns)
+    :return: None
+    :raises 500: if the write failed
+    """
+    append_rows(path, [(index, data)], columns)
+
+
+def append_rows(path: str, rows: List[Tuple[str, Dict[str, Union[int, float, str, None]]]],
+                columns: Tuple[str, ...]) -> None:
+    """
+    Same as append_row for many rows, written with a single write and a single fsync
+    :param path: Path to the db
+    :param rows: (datetime index, column -> value) pairs
+    :param columns: Columns of the database (as per read_columns)
+    :return: None
+    :raises 500: if the write failed
+    """
+    lines = StringIO()
+    writer = csv.writer(lines, lineterminator="\n")
+    for index, data in rows:
+        writer.writerow([index, *("" if data.get(col) is None else data[col] for col in columns)])
+
+    with lock_for(path).exclusive():
+        # a torn line from a previous crash would otherwise swallow these rows
+        repair_tail(path)
+        try:
+            with open(path, mode="ab+") as f:
+                encoded = lines.getvalue().encode()
+
+                # a header-only database may lack the line terminator
+                size = f.seek(0, SEEK_END)
+                if size > 0:
+                    f.seek(size - 1)
+                    if f.read(1) != b"\n":
+                        encoded = b"\n" + encoded
+
+                f.write(encoded)
+                f.flush()
+                fsync(f.fileno())
+        except Exception as err:
+            raise HTTPException(
+                status_code=500,
+                detail="An error occurred while writing to the database:\n"
+                       f"{type(err).__name__} - {err}"
+            )
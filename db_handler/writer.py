@@ -0,0 +1,135 @@
+# concurrency related
+from concurrent.futures import Future
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import sleep
+
+# typing related
+from typing import Dict, List, Tuple, Union
+
+from db_handler.storage import Rejected, Storage
+
+Row = Tuple[str, Dict[str, Union[int, float, str]]]
+
+
+class _Commit:
+    __slots__ = ("user", "rows", "future")
+
+    def __init__(self, user: str, rows: List[Row]):
+        self.user = user
+        self.rows = rows
+        self.future: Future = Future()
+
+
+class Writer:
+    """
+    The single writer of the process: commits are queued and persisted by one thread, in the order they arrived.
+    Everything queued while the previous flush was running, plus what arrives within the group commit window,
+    is flushed together with one write per user. Across processes the writes are serialized by the file lock.
+
+    Readers never wait for it: they are served from the cached snapshot, which the writer replaces
+    (never mutates) once its write is on disk.
+    """
+
+    def __init__(self, storage: Storage, window: float = 0.0, max_batch: int = 10_000):
+        """
+        :param storage: where to flush
+        :param window: seconds to wait for more commits before flushing, 0 flushes as soon as possible
+        :param max_batch: maximum number of commits flushed at once
+        """
+        self.storage = storage
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: Queue = Queue()
+        self._thread: Thread | None = None
+        self._start_lock = Lock()
+        self.flushes = 0
+        self.commits = 0
+
+    def submit(self, user: str, rows: List[Row]) -> Future:
+        """
+        Queue already validated rows of a user for writing
+        :param user: whose rows these are
+        :param rows: (datetime, column -> value) pairs, written all or nothing
+        :return: Future resolved once the rows are persisted, or failed with what the storage raised
+        """
+        commit = _Commit(user, rows)
+        self._ensure_started()
+        self._queue.put(commit)
+        return commit.future
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+
+            if self.window > 0:
+                sleep(self.window)
+
+            batch = [first]
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    commit = self._queue.get_nowait()
+                except Empty:
+                    break
+                if commit is None:
+                    stop = True
+                    break
+                batch.append(commit)
+
+            try:
+                self._flush(batch)
+            except Exception as err:
+                # the thread must survive whatever happens, the waiting requests get the error
+                for commit in batch:
+                    if not commit.future.done():
+                        commit.future.set_exception(err)
+            if stop:
+                return
+
+    def _flush(self, batch: List[_Commit]) -> None:
+        by_user: Dict[str, List[_Commit]] = {}
+        for commit in batch:
+            by_user.setdefault(commit.user, []).append(commit)
+
+        for user, group in by_user.items():
+            try:
+                self.storage.append_many(user, [row for commit in group for row in commit.rows])
+            except Rejected:
+                # nothing was written, one bad commit must not fail the others: fall back to one write per commit
+                for commit in group:
+                    try:
+                        self.storage.append_many(user, commit.rows)
+                    except Exception as err:
+                        commit.future.set_exception(err)
+            except Exception as err:
+                # the rows may be on disk already: written again they would be there twice
+                for commit in group:
+                    commit.future.set_exception(err)
+
+        for commit in batch:
+            if not commit.future.done():
+                commit.future.set_result(None)
+
+        self.flushes += 1
+        self.commits += len(batch)
+
+    def close(self) -> None:
+        """
+        Flush what is queued and stop the thread
+        :return: None
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def stats(self) -> dict:
+        return {"flushes": self.flushes, "commits": self.commits, "queued": self._queue.qsize()}